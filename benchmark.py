@@ -0,0 +1,315 @@
+'''
+Benchmarks for the per-gene layout pipeline on synthetic genes.
+
+    python benchmark.py --sizes 10,100,1000,10000 --output bench/run.json
+    python benchmark.py --compare bench/old.json bench/new.json
+    python benchmark.py --startup
+
+Each function is timed on freshly generated data; setup (building the
+transcripts and running the earlier pipeline stages) is not timed.
+Results are written as JSON so runs can be compared over time.
+--startup instead times, in fresh interpreters, importing the modules the
+command-line tools start from and opening browser sessions.
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+import getGene
+import overlay
+import plotData
+import synthetic
+
+SIZES = [10, 100, 1000, 10000]
+
+# Functions whose cost grows quadratically with the isoform count are
+# skipped above these sizes unless --no-limits is given.
+LIMITS = {'orderTranscripts': 3000, 'groupTran': 100}
+
+STARTUP_MODULES = ['getGene', 'layout', 'exportMatrix', 'synthetic']
+STARTUP_SESSIONS = 5            # sessions opened per interpreter: the first one also imports
+
+IMPORT_CODE = 'import time; t0 = time.time(); import %s; print time.time() - t0'
+
+# Runs browse.py the way the server does for each new session, after
+# importing Bokeh (which the server has done by then).
+SESSION_CODE = '''
+import sys, time
+from bokeh.application.handlers import ScriptHandler
+from bokeh.document import Document
+handler = ScriptHandler(filename=sys.argv[1], argv=[])
+for ix in xrange(int(sys.argv[2])):
+    t0 = time.time()
+    handler.modify_document(Document())
+    if handler.failed:
+        raise SystemExit(handler.error)
+    print time.time() - t0
+'''
+
+
+class BenchOptions (object):
+    '''The subset of params.getParams used by the benchmarked functions.'''
+
+    def __init__(self, height=10, group=None, cluster=3):
+
+        self.height = height
+        self.group = group if group is not None else [1]
+        self.cluster = cluster
+        self.fasta = None
+        self.intronScale = None
+
+
+def prepare(gene, upTo):
+    '''Run the pipeline stages before upTo; returns a dict of their results.'''
+
+    stages = ['assignBlocks', 'findRegions', 'orderTranscripts', 'groupTran', 'getExonData']
+    if upTo == 'groupTranApprox':
+        upTo = 'groupTran'
+    elif upTo == 'overlay':                 # needs the blocks only
+        upTo = 'findRegions'
+    opt = BenchOptions()
+    tranList, exonList = synthetic.makeTranscripts(gene)
+    data = dict(opt=opt, tranList=tranList, exonList=exonList, strand=gene.strand, colorDF=None)
+
+    if gene.strand == '+':
+        exonList.sort(key=lambda x: x.start)
+    else:
+        exonList.sort(key=lambda x: x.end, reverse=True)
+    if upTo in ('assignBlocks', 'assignBlocksReverse'):
+        return data
+
+    for stage in stages:
+        if stage == upTo:
+            break
+        if stage == 'assignBlocks':
+            if gene.strand == '+':
+                data['blocks'] = getGene.assignBlocks(opt, exonList)
+            else:
+                data['blocks'] = getGene.assignBlocksReverse(opt, exonList)
+            data['featureStarts'] = np.array([exon.start for exon in exonList]) - 20     # a feature per exon, overlapping its start
+            data['featureEnds'] = data['featureStarts'] + 100
+        elif stage == 'findRegions':
+            getGene.findRegions(tranList)
+        elif stage == 'orderTranscripts':
+            data['tranNames'] = getGene.orderTranscripts(tranList)
+            data['tranNum'] = len(data['tranNames'])
+    return data
+
+
+def run(name, data):
+    '''Run one benchmarked function on prepared data.'''
+
+    opt = data['opt']
+    if name == 'assignBlocks':
+        getGene.assignBlocks(opt, data['exonList'])
+    elif name == 'assignBlocksReverse':
+        getGene.assignBlocksReverse(opt, data['exonList'])
+    elif name == 'findRegions':
+        getGene.findRegions(data['tranList'])
+    elif name == 'orderTranscripts':
+        getGene.orderTranscripts(data['tranList'])
+    elif name == 'groupTran':
+        getGene.groupTran(data['tranList'], data['exonList'], 15)
+    elif name == 'groupTranApprox':
+        getGene.groupTran(data['tranList'], data['exonList'], 15, approxAbove=0)
+    elif name == 'getExonData':
+        plotData.getExonData(opt, data['exonList'], data['colorDF'], data['tranNum'])
+    elif name == 'getBoundaryData':
+        plotData.getBoundaryData(data['blocks'], 'chr1', data['tranNum'], data['strand'])
+    elif name == 'overlay':
+        blockMap = overlay.BlockMap(data['blocks'])
+        blockMap.map(data['featureStarts'])
+        blockMap.mapIntervals(data['featureStarts'], data['featureEnds'])
+
+
+BENCHMARKS = ['assignBlocks', 'assignBlocksReverse', 'findRegions', 'orderTranscripts',
+              'groupTran', 'groupTranApprox', 'getExonData', 'getBoundaryData', 'overlay']
+
+
+def benchmark(name, size, args):
+    '''Time one function at one size; returns a result record.'''
+
+    strand = '-' if name == 'assignBlocksReverse' else '+'
+    times = list()
+    for rep in xrange(args.repeat):
+        gene = synthetic.makeGene(isoforms=size, exons=args.exons, length=args.length,
+                                  strand=strand, seed=args.seed + rep)
+        data = prepare(gene, 'assignBlocks' if name == 'assignBlocksReverse' else name)
+        t0 = timeit.default_timer()
+        run(name, data)
+        times.append(timeit.default_timer() - t0)
+    return dict(function=name, isoforms=size, exons=args.exons, length=args.length,
+                repeat=args.repeat, best=min(times), mean=sum(times) / len(times))
+
+
+def objectBytes(obj):
+    '''Shallow size of an object plus its __dict__, if it has one.'''
+
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def peakRss():
+    '''Peak resident set size of this process in bytes.'''
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024      # Linux reports kilobytes
+
+
+def memory(genes, args):
+    '''
+    Materialize Transcript/Exon lists for many genes, as a genome-wide
+    export would, and report their size. Run it in a fresh process for
+    a meaningful RSS figure.
+    '''
+
+    size = int(args.sizes.split(',')[0])
+    rss0 = peakRss()
+    kept = list()
+    for ix in xrange(genes):
+        gene = synthetic.makeGene('SYN%d' % ix, isoforms=size, exons=args.exons,
+                                  length=args.length, seed=args.seed + ix)
+        tranList, exonList = synthetic.makeTranscripts(gene)
+        kept.append((tranList, exonList))
+        gene.clusters = None
+    transcripts = sum(len(tranList) for tranList, exonList in kept)
+    exons = sum(len(exonList) for tranList, exonList in kept)
+    nbytes = sum(objectBytes(tran) + objectBytes(exon) for tranList, exonList in kept
+                 for tran, exon in zip(tranList, exonList))
+    nbytes += sum(objectBytes(exon) for tranList, exonList in kept for exon in exonList[len(tranList):])
+    return dict(function='memory', genes=genes, isoforms=size, exons=args.exons,
+                transcripts=transcripts, exonObjects=exons, objectBytes=nbytes,
+                rssGrowth=peakRss() - rss0)
+
+
+def timedRuns(code, argv, workDir):
+    '''Run code in a fresh interpreter; returns the times it prints, one per line.'''
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([here] + [x for x in [env.get('PYTHONPATH')] if x])
+    output = subprocess.check_output([sys.executable, '-c', code] + argv, cwd=workDir, env=env)
+    return [float(line) for line in output.split()]
+
+
+def startup(args):
+    '''
+    Time importing each of STARTUP_MODULES and opening browser sessions,
+    best of args.repeat fresh interpreters. Run from a scratch directory:
+    a session opens the saved-gene database in its working directory.
+    '''
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    workDir = tempfile.mkdtemp(prefix='benchmark.')
+    results = list()
+    try:
+        for module in STARTUP_MODULES:
+            times = [timedRuns(IMPORT_CODE % module, [], workDir)[0] for rep in xrange(args.repeat)]
+            results.append(dict(function='import %s' % module, isoforms=0, repeat=args.repeat,
+                                best=min(times), mean=sum(times) / len(times)))
+        runs = [timedRuns(SESSION_CODE, [os.path.join(here, 'browse.py'), str(STARTUP_SESSIONS)], workDir)
+                for rep in xrange(args.repeat)]
+        first = [times[0] for times in runs]
+        later = [x for times in runs for x in times[1:]]
+        results.append(dict(function='first session', isoforms=0, repeat=args.repeat,
+                            best=min(first), mean=sum(first) / len(first)))
+        results.append(dict(function='next sessions', isoforms=0, repeat=len(later),
+                            best=min(later), mean=sum(later) / len(later)))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+    return results
+
+
+def compare(oldFile, newFile):
+    '''Print per-function speedups between two result files.'''
+
+    with open(oldFile) as handle:
+        old = json.load(handle)
+    with open(newFile) as handle:
+        new = json.load(handle)
+    oldBest = dict(((r['function'], r['isoforms']), r['best']) for r in old['results'] if 'best' in r)
+    print '%-20s %8s %12s %12s %8s' % ('function', 'isoforms', 'old (s)', 'new (s)', 'speedup')
+    for r in new['results']:
+        key = (r['function'], r['isoforms'])
+        if key in oldBest and 'best' in r:
+            print '%-20s %8d %12.6f %12.6f %7.2fx' % (key[0], key[1], oldBest[key], r['best'],
+                                                    oldBest[key] / max(r['best'], 1e-9))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the isoform layout functions.')
+    parser.add_argument('--sizes', default=','.join(str(x) for x in SIZES),
+                        help='comma-separated isoform counts (default %(default)s)')
+    parser.add_argument('--functions', default=','.join(BENCHMARKS),
+                        help='comma-separated functions to time (default: all)')
+    parser.add_argument('--exons', type=int, default=10, help='exons per gene model')
+    parser.add_argument('--length', type=int, default=50000, help='gene length')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per function and size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-limits', dest='limits', action='store_false',
+                        help='also run quadratic functions at large sizes')
+    parser.add_argument('--memory', type=int, metavar='GENES',
+                        help='instead of timing, materialize GENES genes of the first size and report memory')
+    parser.add_argument('--startup', action='store_true',
+                        help='instead of the layout functions, time imports and opening browser sessions')
+    parser.add_argument('--output', help='JSON results file (default bench/<timestamp>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    sizes = [int(x) for x in args.sizes.split(',')]
+    functions = args.functions.split(',') if args.memory is None and not args.startup else list()
+    results = list()
+    if args.startup:
+        for result in startup(args):
+            results.append(result)
+            print '%-20s %12.6f s' % (result['function'], result['best'])
+    if args.memory is not None:
+        result = memory(args.memory, args)
+        results.append(result)
+        print '%(genes)d genes, %(transcripts)d transcripts, %(exonObjects)d exons: ' \
+              '%(objectBytes)d bytes in objects, peak RSS grew %(rssGrowth)d bytes' % result
+    for name in functions:
+        if name not in BENCHMARKS:
+            raise RuntimeError('unknown benchmark %s' % name)
+        for size in sizes:
+            if args.limits and size > LIMITS.get(name, size):
+                print '%-20s %8d    skipped (over limit %d)' % (name, size, LIMITS[name])
+                continue
+            result = benchmark(name, size, args)
+            results.append(result)
+            print '%-20s %8d %12.6f s' % (name, size, result['best'])
+            sys.stdout.flush()
+
+    output = args.output or os.path.join('bench', '%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as handle:
+        json.dump(dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       python=platform.python_version(), platform=platform.platform(),
+                       params=dict(exons=args.exons, length=args.length,
+                                   repeat=args.repeat, seed=args.seed),
+                       results=results), handle, indent=1, sort_keys=True)
+    print 'results written to %s' % output
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,56 @@
 import argparse
-import json
+import threading
+import time
+import traceback
 import getGene
+import geneStats
+import geneStore
+import junctions
+import layout
+import memoryStats
+import overlay
+import prefetch
+import readCoverage
+from params import getParams
+import plotData
+import timing
+from plotData import COLORS
 from bokeh.plotting import Figure
-import pandas as pd
+import numpy as np
 from bokeh.models import ColumnDataSource, HoverTool
 from bokeh.layouts import row, column, widgetbox
-from bokeh.palettes import brewer
 from bokeh.io import curdoc
-from bokeh.models.widgets import Slider, TextInput, PreText, DataTable, TableColumn, CheckboxGroup, Button, RadioButtonGroup, RadioGroup, CheckboxButtonGroup
+from bokeh.models.widgets import Slider, TextInput, PreText, DataTable, TableColumn, CheckboxGroup, Button, RadioButtonGroup, RadioGroup, CheckboxButtonGroup, NumberFormatter
 from bokeh.models.callbacks import CustomJS
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from tt_log import logger
+from tornado.ioloop import IOLoop
 
 #
 # Constants.
 #
 
 TITLE_FONT_SIZE = "25pt"
-# color of transcripts: [reference isoorm, group1, group2...]
-COLORS = brewer["Spectral"][11]
-COLORS = COLORS + brewer["PuBuGn"][4]
-COLORS.insert(0, '#22313F')
+WATCH_INTERVAL = 5                   # seconds between checks of the match files for changes
 
 #
 # Globals.
 #
 
 # the data used for plotting isoforms, boundaries and gene
-blockDict = dict(top=[], bottom=[], left=[], right=[], exon=[],
-                 start=[], end=[], chromosome=[], xs=[], ys=[], boundary=[])
+blockDict = plotData.emptyBlockData()
 tranDict = dict(top=[], bottom=[], left=[], right=[])
-sourceDict = dict(xs=[], ys=[], color=[], line_alpha=[], height=[],
-                  tran=[], full=[], partial=[], annot=[], start=[],
-                  end=[], fileColor=[])
+exonData = plotData.emptyExonData()      # every exon column; source only gets what the glyphs use
 geneDict = dict(Gene=[], Transcripts=[])
-codonDict = dict(x=[], y=[], color=[], size=[])
-try:
-    with open('gene.json', 'r') as f:
-        data = json.load(f)
-        markedDict = {'Gene': data.keys()}
-        f.close()
-except IOError:
-    markedDict = dict()
-    with open('gene.json', 'w') as f:
-        json.dump(markedDict, f)
-        f.close()
+codonDict = overlay.emptyPointData()
+novelDict = dict(x=[], y=[], tran=[], position=[], size=[])
+markedDict = dict(Gene=[])           # filled from the saved-gene store below
+generation = 0                       # number of the latest updateGene request
+colorDF = None                       # grouping of the rows shown
+colorKey = None                      # layout.groupKey of the rows colorDF groups
+watcherReloading = False             # watchMatchFiles started a reload that has not read the files yet
 
 # update the ColumnDataSource = instant update plot
 # selected exon boundaies
@@ -53,10 +60,17 @@ allBlockSource = ColumnDataSource(data=blockDict)
 # each transcript region
 tranSource = ColumnDataSource(data=tranDict)
 # the exons
-source = ColumnDataSource(data=sourceDict)
+source = ColumnDataSource(data=plotData.clientData(exonData))
 # table of genes and # of clusters
-geneSource = ColumnDataSource(data=geneDict)
+geneSource = ColumnDataSource(data=geneDict, name='geneTable')
 codonSource = ColumnDataSource(data=codonDict)
+polyASource = ColumnDataSource(data=overlay.emptyPointData())
+# features of the BED tracks, in rows above the transcripts
+trackSource = ColumnDataSource(data=overlay.emptyTrackData())
+# read depth along the gene, in rows above the BED tracks
+coverageSource = ColumnDataSource(data=readCoverage.emptyCoverageData())
+# exon boundaries of junctions missing from the annotation
+novelSource = ColumnDataSource(data=novelDict)
 markedSource = ColumnDataSource(data=markedDict)
 
 # Create fake data source for Height and Width sliders.
@@ -97,14 +111,31 @@ def createPlot(height=600, width=1200):
            nonselection_fill_alpha=0, nonselection_line_alpha=0)
     # what exons really is
     # Cannot use line_width="height" because it is broken.
-    p.multi_line(xs="xs", ys="ys", line_width=opt.height, color="color",
-                 line_alpha="line_alpha", source=source)
+    p.segment(x0="x0", y0="y", x1="x1", y1="y", line_width=opt.height, color="color",
+              line_alpha="line_alpha", source=source)
     # the start/stop codon
     p.inverted_triangle(x="x", y="y", color="color", source=codonSource,
                         size='size', alpha=0.5)
+    # polyA sites of the annotation
+    p.circle(x="x", y="y", color="color", source=polyASource, size='size', alpha=0.6)
+    # BED track features
+    track = p.segment(x0="x0", y0="y", x1="x1", y1="y", line_width=max(1, int(opt.height) // 2),
+                      color="color", source=trackSource)
+    # read coverage
+    depth = p.quad(left="left", right="right", bottom="bottom", top="top", source=coverageSource,
+                   color=readCoverage.COLOR, line_alpha=0, fill_alpha=0.6)
+    # novel splice junctions, in a layer of their own
+    novel = p.diamond(x="x", y="y", color="red", size="size", alpha=0.8,
+                      source=novelSource)
     # mouse hover on the block
     p.add_tools(HoverTool(tooltips=[("chromosome", "@chromosome"), ("exon", "@exon"),
                 ("start", "@start"), ("end", "@end")], renderers=[quad]))
+    p.add_tools(HoverTool(tooltips=[("novel junction", "@position"), ("isoform", "@tran")],
+                          renderers=[novel]))
+    p.add_tools(HoverTool(tooltips=[("track", "@track"), ("feature", "@name"),
+                                    ("start", "@start"), ("end", "@end")], renderers=[track]))
+    p.add_tools(HoverTool(tooltips=[("track", "@track"), ("reads", "@depth"),
+                                    ("start", "@start"), ("end", "@end")], renderers=[depth]))
     return p
 
 
@@ -114,153 +145,266 @@ def updateGene(use_saved_settings=False):
     When genes are changed, a new plot is created and drawn.
     """
 
-    if opt.gene == Gene.value.strip().upper():
+    geneText = Gene.value.strip()
+    opt.region = getGene.parseRegion(geneText)                # a genomic region rather than a gene name?
+    if opt.region is None:
+        geneText = geneText.upper()
+    if opt.gene == geneText:
         geneUpdated = False
     else:
-        opt.gene = Gene.value.strip().upper()                 # get the gene name from UI, pass to a global variable opt
+        opt.gene = geneText                                   # get the gene name from UI, pass to a global variable opt
         geneUpdated = True
+    support = getGene.supportThresholds(opt)
+    if opt.collapse != (0 in Collapse.active):                # collapsing changes the rows, so regroup them
+        opt.collapse = 0 in Collapse.active
+        geneUpdated = True
+    opt.dropHidden = 0 in DropHidden.active
+
+    myDict = store.get(opt.gene) if use_saved_settings else None
+    if myDict is not None:
+        opt.height = myDict['height']
+        Height.value = opt.height
+        opt.width = myDict['width']
+        Width.value = opt.width
+        opt.full = myDict['full']
+        Full.value = opt.full
+        opt.partial = myDict['partial']
+        Partial.value = opt.partial
+        opt.group = myDict['group']
+        Group.active = opt.group
+        opt.cluster = myDict['cluster']
+        Cluster.value = opt.cluster
+    else:
+        opt.height = Height.value
+        opt.width = Width.value
+        opt.full = Full.value
+        opt.partial = Partial.value
+        opt.group = Group.active
+        opt.cluster = Cluster.value
+    if getGene.supportThresholds(opt) != support:         # other clusters are built: regroup them
+        geneUpdated = True
+    Mark.active = [0] if opt.gene in store else []        # set after opt: markGene saves the current settings
 
-    with open('gene.json', 'r') as f:
-        data = json.load(f)
-        if use_saved_settings and opt.gene in data.keys():
-            Mark.active = [0]
-            myDict = data[opt.gene]
-            opt.height = myDict['height']
-            Height.value = opt.height
-            opt.width = myDict['width']
-            Width.value = opt.width
-            opt.full = myDict['full']
-            Full.value = opt.full
-            opt.partial = myDict['partial']
-            Partial.value = opt.partial
-            opt.group = myDict['group']
-            Group.active = opt.group
-            opt.cluster = myDict['cluster']
-            Cluster.value = opt.cluster
-        else:
-            Mark.active = []
-            opt.height = Height.value
-            opt.width = Width.value
-            opt.full = Full.value
-            opt.partial = Partial.value
-            opt.group = Group.active
-            opt.cluster = Cluster.value
-        f.close()
+    profileDir = None
+    if 0 in Profile.active:                                # profile this one request, then switch off
+        profileDir = opt.profileDir
+        Profile.active = []
 
     # Clear the current plot.
     plotColumn.children = []
 
     # Reset the plot to blank when initial updating genes
-    blockSource.data = dict(top=[], bottom=[], left=[], right=[], exon=[],
-                            start=[], end=[], chromosome=[], xs=[], ys=[],
-                            boundary=[])
-    allBlockSource.data = dict(top=[], bottom=[], left=[], right=[], exon=[],
-                               start=[], end=[], chromosome=[], xs=[], ys=[],
-                               boundary=[])
-    source.data = dict(xs=[], ys=[], color=[], line_alpha=[], height=[],
-                       tran=[], full=[], partial=[], annot=[], start=[],
-                       end=[], fileColor=[])
-    codonSource.data = dict(x=[], y=[], color=[], size=[])
+    blockSource.data = plotData.emptyBlockData()
+    allBlockSource.data = plotData.emptyBlockData()
+    source.data = plotData.clientData(plotData.emptyExonData())
+    codonSource.data = overlay.emptyPointData()
+    polyASource.data = overlay.emptyPointData()
+    trackSource.data = overlay.emptyTrackData()
+    coverageSource.data = readCoverage.emptyCoverageData()
+    novelSource.data = dict(x=[], y=[], tran=[], position=[], size=[])
     matchList = Matches.value.strip().replace(' ', '').split(',')       # get the list of pickle files from UI
     opt.matches = matchList
+
+    # The rest runs on the worker thread. Each request gets the next
+    # generation number; a newer request makes older ones stop at their
+    # next checkpoint, and only the latest result is shown.
+    global generation
+    generation += 1
+    Console.text = 'Console:\nWorking on %s...' % opt.gene
+    shown = None if geneUpdated else (colorKey, colorDF)      # the worker reuses it if the rows are the same
+    executor.submit(computeGene, generation, shown, matchList, GTF.value.strip(), Format.value.strip(), profileDir)
+
+
+def fromWorker(callback):
+    '''
+    Run callback on the event loop, with the document locked. Bokeh adds
+    a next tick callback to the loop before recording it, so adding one
+    from the worker thread can race with the loop running it (the
+    callback is then dropped); registering it on the loop avoids that.
+    '''
+    loop.add_callback(doc.add_next_tick_callback, callback)
+
+
+def isCurrent(myGeneration):
+    return myGeneration == generation
+
+
+def showConsole(myGeneration, text):
+    '''Set the Console from the worker thread, unless the request is stale.'''
+    def callback():
+        if isCurrent(myGeneration):
+            Console.text = text
+    fromWorker(callback)
+
+
+def computeGene(myGeneration, shown, matchList, gtfFile, gtfFormat, profileDir):
+    """
+    Load the files if needed and lay out the gene; runs on the worker
+    thread and hands the result to applyLayout on the event loop.
+    """
+    if not isCurrent(myGeneration):                     # superseded while queued
+        return
+    try:
+        loadAndLayout(myGeneration, shown, matchList, gtfFile, gtfFormat, profileDir)
+    except Exception as e:                              # would be lost in the future otherwise
+        traceback.print_exc()
+        showConsole(myGeneration, 'Console:\nerror: %s' % e)
+
+
+def loadAndLayout(myGeneration, shown, matchList, gtfFile, gtfFormat, profileDir):
+    '''
+    shown is (groupKey, colorDF) of the layout on screen when the request
+    was made, or None if its rows must be grouped again; colorDF is reused
+    only if the rows of this request have the same groupKey.
+    '''
+    global watcherReloading
+    timer = timing.StageTimer(opt.gene, profileDir=profileDir)
     # load the matched isoforms from pickle file
-    Console.text = 'Console:\nReading pickle file...'
-    if opt.clusterDict is None:                                                 # if it's the first time to load up pickle file
+    showConsole(myGeneration, 'Console:\nReading pickle file...')
+    with timer.stage('pickle'):
         try:
-            clusterDict = getGene.getMatchedIsoforms(getParams(None, matchList, None))
-            opt.clusterDict = clusterDict                                       # hold pickle file dictionary in RAM
-            howManyIsoforms(clusterDict, matchList)                             # find out how many isoforms for each gene
+            loaded, dropped = getGene.updateMatchedIsoforms(opt, matchList)     # only files added, removed or changed on disk
+            if loaded or dropped:
+                opt.regionIndex = None                                          # rebuilt on the next region query
+                opt.novelCounts = None
+                prefetcher.clear()                                              # layouts of the old set of files
+                opt.geneSummary = geneStats.combine(opt.geneStats.values())     # gene table columns over all files
+                fromWorker(partial(howManyIsoforms, Counter(opt.geneTotals), opt.geneSummary))   # find out how many isoforms for each gene
             isMatch = True                                                      # the pickle file works well
         except IOError:                                                         # if the file is not found in directory
-            Console.text = 'Console:\none of the matched file \n%s is not found' % matchList
+            showConsole(myGeneration, 'Console:\none of the matched file \n%s is not found' % matchList)
             isMatch = False
-    else:
-        if set(opt.clusterDict.keys()) != set(matchList):            # if the pickle files are updated, do the previous thing
+        finally:
+            watcherReloading = False                                            # new mtimes recorded: watch again
+    showConsole(myGeneration, 'Console:\nReading annotation file...')
+    with timer.stage('annotation'):
+        if opt.annotations is None or opt.gtf != gtfFile or opt.format != gtfFormat:    # first time, or the annotation file is updated
             try:
-                clusterDict = getGene.getMatchedIsoforms(getParams(None, matchList, None))
-                opt.clusterDict = clusterDict
-                howManyIsoforms(clusterDict, matchList)
-                isMatch = True
-            except IOError:
-                Console.text = 'Console:\none of the matched file \n%s is not found' % matchList
-                isMatch = False
-        else:                                                       # if pickle file is not updated, do nothing
-            isMatch = True
-    Console.text = 'Console:\nReading annotation file...'
-    if opt.annotations is None:                             # if it's the first time to load up pickle file
-        try:
-            opt.gtf = GTF.value.strip()                     # get the gene name from UI, pass to a global variable opt
-            Annotations = getGene.getAnnotations(opt)       # get a dictionary of all transcripts in annot file, hold it in RAM
-            opt.annotations = Annotations
-            isAnnot = True                                  # the annotation file works well
-        except IOError:
-            Console.text = 'Console:\nannotations file \n%s is not found' % opt.gtf
-            isAnnot = False
-    else:                                                   # if the annotation files are updated, do the previous thing
-        if opt.gtf != GTF.value.strip():
-            try:
-                opt.gtf = GTF.value.strip()
-                Annotations = getGene.getAnnotations(opt)
+                opt.gtf = gtfFile
+                opt.format = gtfFormat
+                t0 = time.time()
+                Annotations = getGene.getAnnotations(opt)       # get a dictionary of all transcripts in annot file, hold it in RAM
+                opt.loadTimes[gtfFile] = time.time() - t0
                 opt.annotations = Annotations
-                isAnnot = True
+                opt.regionIndex = None
+                opt.novelCounts = None
+                isAnnot = True                                  # the annotation file works well
             except IOError:
-                Console.text = 'Console:\nannotations file \n%s is not found' % opt.gtf
+                showConsole(myGeneration, 'Console:\nannotations file \n%s is not found' % opt.gtf)
                 isAnnot = False
-        else:                                               # if the pickle files are updated, do the previous thing
+        else:
             isAnnot = True
 
-    global tranNum, colorDF, chromosome, strand, opt
-    tranList, exonList = selectGene(isAnnot, isMatch)                       # select transcripts by gene
-    chromosome = getChromosome(tranList)                                         # find out which chromosome does the gene locate
-
-    strand = exonList[0].strand                            # which strand does the gene locate on
-    if strand == '+':                                      # if it's forward strand
-        exonList.sort(key=lambda x: x.start)               # sort the list by start position
-        blocks = getGene.assignBlocks(opt, exonList)       # assign each exon to a block
-    else:                                                  # if it's trailing strand
-        exonList.sort(key=lambda x: x.end, reverse=True)   # sort the list by decreasing end position
-        blocks = getGene.assignBlocksReverse(opt, exonList)       # assign each exon to a block -- backwards
-
-    getGene.findRegions(tranList)                       # determine regions occupied by each transcript
-    tranNames = getGene.orderTranscripts(tranList)      # get the names of transcripts, placed them in the right order
-    tranNames = getGene.reduceNameLength(tranNames)     # if the length of name is too long, reduce it
-
-    tranNum = len(tranNames)                             # how many transcripts are there
-    Console.text = 'Console:\nCreating plot...'
-
-    # Create the plot to visualize gene's transcripts.
-    height = int(opt.height) * 2 * (tranNum + 4)        # set plot height using transcript height
-    width = int(opt.width)
-
-    plot = createPlot(height=height, width=width)
-    plotColumn.children= [plot]
-    plot.title.text = "%s isoforms" % opt.gene         # update the title of plot
-
-    # p.height = Height.value * 2 * (tranNum + 4)       # set the height of plot according to the length of transcripts
-    plot.y_range.factors = tranNames[::-1]             # set the y axis tick to the transcripts names
-
-    Console.text = 'Console:\nGrouping...'
-    if 1 in opt.group and isMatch is True:
-        if geneUpdated:
-            colorDF = getGene.groupTran(tranList, exonList, 15)          # group the transcripts by similarities
+    if opt.novelJunctions and opt.novelCounts is None and isMatch:
+        with timer.stage('novelJunctions'):                 # genome-wide, once per set of input files
+            opt.novelCounts = junctions.novelJunctionCounts(opt.annotations if isAnnot else None,
+                                                            [opt.clusterDict[matchFile] for matchFile in matchList])
+            fromWorker(partial(howManyIsoforms, Counter(opt.geneTotals), opt.geneSummary))
+
+    myOpt = layout.layoutOptions(opt, opt.gene)             # settings of this request, whatever comes next
+    key = layout.layoutKey(myOpt, isAnnot, isMatch)
+    reuse = None
+    if shown is not None and shown[0] == layout.groupKey(myOpt, isAnnot, isMatch):  # not another gene, nor reloaded files
+        reuse = shown[1]
+    myLayout = prefetcher.take(key)                         # computed in the background already?
+    if myLayout is not None:
+        timer.count(prefetched=1, **myLayout.timer.counts)
     else:
-        colorDF = None
-    sourceDict = getExonData(exonList, colorDF)         # get the data of each isoform that can be directly used to plot
-    codonDict = plotStartStop(tranList, blocks)         # get the location of start, stop codons
-    codonSource.data = codonDict
-    source.data = sourceDict
-
-    # update the data used for plotting boundaries and hover block
-    blockDict, tranDict = getBoundaryData(blocks, chromosome)              # get the data of each block that can be directly used to plot
-    blockSource.data = blockDict
-    allBlockSource.data = blockDict
-    tranSource.data = tranDict
+        try:
+            myLayout = layout.computeLayout(myOpt, isAnnot, isMatch, timer,
+                                            colorDF=reuse,
+                                            cancelled=lambda: not isCurrent(myGeneration))
+        except layout.Cancelled:
+            timer.stopProfile()
+            return
+        except RuntimeError as e:
+            showConsole(myGeneration, 'Console:\n%s' % e)
+            timer.finish(opt.timingLog)
+            return
+    timer.stopProfile()                                     # profiles only cover this thread
+    fromWorker(partial(applyLayout, myGeneration, myOpt, myLayout, timer, isAnnot, isMatch))
+
+
+def applyLayout(myGeneration, myOpt, myLayout, timer, isAnnot, isMatch):
+    """
+    Show a computed layout. Runs on the event loop; results of superseded
+    requests are dropped.
+    """
+    if not isCurrent(myGeneration):
+        return
+    global tranNum, colorDF, colorKey, chromosome, strand, exonData
+    tranNames = myLayout.tranNames
+    tranNum = myLayout.tranNum
+    chromosome = myLayout.chromosome
+    strand = myLayout.strand
+    colorDF = myLayout.colorDF
+    colorKey = layout.groupKey(myOpt, isAnnot, isMatch)
+
+    with timer.stage('createPlot'):
+        # Create the plot to visualize gene's transcripts.
+        overRows = myLayout.trackNames + myLayout.coverageNames      # BED tracks, then coverage, above the transcripts
+        rows = tranNum + len(overRows)
+        height = int(myOpt.height) * 2 * (rows + 4)         # set plot height using transcript height
+        width = int(myOpt.width)
+
+        plot = createPlot(height=height, width=width)
+        plotColumn.children= [plot]
+        plot.title.text = "%s isoforms" % myOpt.gene       # update the title of plot
+
+        # p.height = Height.value * 2 * (tranNum + 4)       # set the height of plot according to the length of transcripts
+        plot.y_range.factors = tranNames[::-1] + overRows     # set the y axis tick to the transcripts names
+
+    with timer.stage('serialize'):                          # assigning .data serializes the change for the browser
+        codonSource.data = dict(myLayout.codonDict)         # copies: callbacks edit .data in place
+        polyASource.data = dict(myLayout.polyADict)
+        trackSource.data = dict(myLayout.trackDict)
+        coverageSource.data = dict(myLayout.coverageDict)
+        novelSource.data = dict(myLayout.novelDict)
+        exonData = dict(myLayout.sourceDict)
+        source.data = plotData.clientData(exonData)
+        # update the data used for plotting boundaries and hover block
+        blockSource.data = dict(myLayout.blockDict)
+        allBlockSource.data = dict(myLayout.blockDict)
+        tranSource.data = dict(myLayout.tranDict)
+
+    timer.finish(opt.timingLog)
     if isAnnot is False:
-        Console.text = 'Console:\nSuccess! Annotation\n file is missing.'
+        message = 'Success! Annotation\n file is missing.'
     elif isMatch is False:
-        Console.text = 'Console:\nSuccess! Match file\n is missing.'
+        message = 'Success! Match file\n is missing.'
     else:
-        Console.text = 'Console:\nSuccess!'
+        message = 'Success!'
+    if timer.profileFile is not None:
+        message += '\nprofile: %s' % timer.profileFile
+    Console.text = 'Console:\n%s\n%s' % (message, timer.summary())
+    schedulePrefetch(isAnnot, isMatch)
+
+
+def schedulePrefetch(isAnnot, isMatch):
+    '''Compute the next genes of the gene table, and the saved genes, in the background.'''
+    if opt.prefetch <= 0:
+        return
+    jobs = list()
+    for gene in prefetch.nextGenes(list(geneSource.data['Gene']), opt.gene, opt.prefetch):
+        myOpt = layout.layoutOptions(opt, gene)
+        jobs.append((layout.layoutKey(myOpt, isAnnot, isMatch), myOpt, isAnnot, isMatch))
+    for gene in markedSource.data['Gene']:          # opened with their saved settings
+        if gene != opt.gene:
+            myOpt = layout.layoutOptions(opt, gene, store.get(gene))
+            jobs.append((layout.layoutKey(myOpt, isAnnot, isMatch), myOpt, isAnnot, isMatch))
+    prefetcher.schedule(jobs)
+
+
+def watchMatchFiles():
+    '''Periodic: redraw with reloaded match files when one changes on disk.'''
+    global watcherReloading
+    if opt.gene is None or watcherReloading:            # nothing shown, or the reload has not read them yet
+        return
+    changed = getGene.changedMatchFiles(opt)
+    if changed:
+        logger.info('match files changed on disk: %s' % changed)
+        watcherReloading = True
+        updateGene()                                    # loadAndLayout reloads just these
 
 
 def updateGroup(attrname, old_num_clusters, new_num_clusters):
@@ -271,19 +415,20 @@ def updateGroup(attrname, old_num_clusters, new_num_clusters):
     opt.group = Group.active
     sourceDict = source.data
     if 0 in opt.group:                 # if it is told to group by files
-        sourceDict['color'] = sourceDict['fileColor']
+        sourceDict['color'] = exonData['fileColor']
     else:
         if 1 in opt.group:            # if it is told to group by clustering
             colors = list()
-            colors = [getColorFromDF(tran, colorDF, opt.cluster) for tran in sourceDict['tran']]
+            colors = [plotData.getColorFromDF(tran, colorDF, opt.cluster) for tran in exonData['tran']]
         else:
             colors = list()
-            for i in sourceDict['annot']:
-                if i is True:           # if it's annotation
+            for i in exonData['annot']:
+                if i:                   # if it's annotation
                     colors.append(COLORS[0])
                 else:
                     colors.append(COLORS[1])
         sourceDict['color'] = colors
+    exonData['color'] = sourceDict['color']
     source.data = sourceDict
 
 
@@ -296,12 +441,16 @@ def updateHeightWidth(attrname, old, new):
     """
     opt.height = Height.value
     opt.width = Width.value
-    sourceDict = source.data
-    sourceDict['height'] = [int(opt.height) for x in range(len(sourceDict['xs']))]
-    source.data = sourceDict
+    exonData['height'] = np.full(len(exonData['x0']), int(opt.height), dtype=np.int32)
     codonDict = codonSource.data
     codonDict['size'] = [int(opt.height) * 1.2 for x in range(len(codonDict['x']))]    # adjust the codon size accordingly
     codonSource.data = codonDict
+    polyADict = polyASource.data
+    polyADict['size'] = [int(opt.height) * 0.8 for x in range(len(polyADict['x']))]
+    polyASource.data = polyADict
+    novelDict = novelSource.data
+    novelDict['size'] = [int(opt.height) * 0.8 for x in range(len(novelDict['x']))]
+    novelSource.data = novelDict
 
     # Setting plot height, width is broken in Bokeh version 0.12.0, so this will not work:
     # plot.height = int(Height.value) * 2 * (tranNum + 4)        # update the height of plot according to the height of transcript in UI
@@ -310,17 +459,24 @@ def updateHeightWidth(attrname, old, new):
 
 def updateGeneTable(attrname, old, new):
     actived = Sort.active
+    import pandas as pd             # imported on first use: opening a session shouldn't wait for it
     geneDict = geneSource.data
-    df = pd.DataFrame()
-    df['Gene'] = geneDict['Gene']
-    df['Transcripts'] = geneDict['Transcripts']
+    df = pd.DataFrame(geneDict)
     if actived == 0:
         df = df.sort_values(by='Gene', ascending=True)
     elif actived == 1:
         df = df.sort_values(by='Transcripts', ascending=False)
-    geneDict['Gene'] = list(df['Gene'])
-    geneDict['Transcripts'] = list(df['Transcripts'])
-    geneSource.data = geneDict
+    elif actived == 2:
+        df = df.sort_values(by='Novel', ascending=False)
+    geneSource.data = dict((col, list(df[col])) for col in geneDict)
+
+
+def updateSupport(attr, old, new):
+    '''Full/Partial moved: rebuild the gene when hidden isoforms are dropped, else just hide them.'''
+    if opt.dropHidden:
+        updateGene()
+    else:
+        selectTran(attr, old, new)
 
 
 # show/hide transcripts according to UI selection, implemented by changing the alpha values
@@ -330,33 +486,33 @@ def selectTran(attr, old, new):
     if tranSource.selected['1d']['indices'] == []:          # if no transcript is selected
         sourceDict = source.data
         # change alpha value accordingly
-        sourceDict['line_alpha'] = [getAlpha(None, x) for x in zip(sourceDict['annot'],
-                                    sourceDict['full'], sourceDict['partial'])]
+        sourceDict['line_alpha'] = np.array([getAlpha(None, x) for x in zip(exonData['annot'],
+                                             exonData['full'], exonData['partial'])], dtype=np.float32)
         source.data = sourceDict
         blockSource.data = allBlockSource.data              # reset blocks to initial state
     else:
         index = tranSource.selected['1d']['indices'][0]     # which transcript is selected
         sourceDict = source.data
         # make unselected transcripts more transparent
-        sourceDict['line_alpha'] = [getAlpha(index, x) for x in zip(sourceDict['ys'],
-                                    sourceDict['annot'], sourceDict['full'],
-                                    sourceDict['partial'])]
+        sourceDict['line_alpha'] = np.array([getAlpha(index, x) for x in zip(exonData['y'],
+                                             exonData['annot'], exonData['full'],
+                                             exonData['partial'])], dtype=np.float32)
         source.data = sourceDict
         blocks = list()
         # in selected transcripts, find out the start and end position of each exons,
         # create new block object
-        for i, yy in enumerate(sourceDict['ys']):
-            if yy[0] == index + 1:
+        for i, yy in enumerate(exonData['y']):
+            if yy == index + 1:
                 if strand == '+':
-                    start = sourceDict['start'][i]
-                    end = sourceDict['end'][i]
+                    start = exonData['start'][i]
+                    end = exonData['end'][i]
                 else:
-                    start = sourceDict['end'][i]
-                    end = sourceDict['start'][i]
-                boundary = sourceDict['xs'][i][1]
+                    start = exonData['end'][i]
+                    end = exonData['start'][i]
+                boundary = exonData['x1'][i]
                 bound = getGene.Block(start, end, boundary)
                 blocks.append(bound)
-        bd, tr = getBoundaryData(blocks, chromosome)
+        bd, tr = plotData.getBoundaryData(blocks, chromosome, tranNum, strand)
         blockSource.data = bd
 
 
@@ -364,7 +520,7 @@ def selectTran(attr, old, new):
 # it's not very intuitive cause x is different in each if/else statement
 def getAlpha(index, x):
     if index is None:           # nothing is selected
-        if x[0] is False:       # not an annotation exon
+        if not x[0]:            # not an annotation exon
             if x[1] < opt.full or x[2] < opt.partial:   # low full/partial reads support
                 return 0
             else:
@@ -372,155 +528,60 @@ def getAlpha(index, x):
         else:
             return 1
     else:                   # a transcript is selected
-        if x[1] is False:   # if it's not an annotation exon
+        if not x[1]:        # if it's not an annotation exon
             if x[2] < opt.full or x[3] < opt.partial:       # low full/partial reads support
                 return 0
             else:
-                if index + 1 == x[0][0]:    # if the transcript is selected
+                if index + 1 == x[0]:       # if the transcript is selected
                     return 1
                 else:                       # if the transcript is not selected
                     return 0.3
         else:               # if it is a annotation exon
-                if index + 1 == x[0][0]:    # the transcript is selected
+                if index + 1 == x[0]:       # the transcript is selected
                     return 1
                 else:
                     return 0.3
 
 
-# Select isoforms of a particular gene
-def selectGene(isAnnot, isMatch):
-    tranList = list()                              # list of Transcript objects
-    exonList = list()                              # list of Exon objects
-    if isAnnot:                                    # read the reference file
-        try:
-            getGene.getGeneFromAnnotation(opt, tranList, exonList)
-        except RuntimeError:
-            Console.text = 'Console:\n%s not found in annotation \nfile' % opt.gene
-    if isMatch:                                    # read the pickle file
-        try:
-            getGene.getGeneFromMatches(opt, tranList, exonList)
-        except RuntimeError:
-            Console.text = 'Console:\n%s not found in pickle \nfile' % opt.gene
-    return tranList, exonList
-
-
-# get the data for plotting exons (start, end position for example)
-def getExonData(exonList, colorDF):
-    sourceDict = dict(xs=[], ys=[], color=[], line_alpha=[], height=[],
-                      tran=[], full=[], partial=[], annot=[], start=[],
-                      end=[], fileColor=[])
-    columns = ['xs', 'ys', 'color', 'start', 'end', 'tran', 'full',
-               'partial', 'annot', 'fileColor']
-    num_clusters = opt.cluster
-    for myExon in exonList:
-        exonSize = myExon.end - myExon.start + 1
-        adjStart = myExon.adjStart
-
-        if 0 in opt.group:       # if group by files, pass
-            color = COLORS[myExon.tran.source[0]]
-        else:
-            if colorDF is not None:
-                # Get transcript color based on grouping.
-                color = getColorFromDF(myExon.tran.name, colorDF, num_clusters)
-            else:          # if the grouping effect is off, paint default color
-                if myExon.tran.annot:
-                    color = COLORS[0]
-                else:
-                    color = COLORS[1]
-        xs = (adjStart, adjStart + exonSize)
-        ys = (tranNum - (myExon.tran.tranIx), tranNum - (myExon.tran.tranIx))
-        values = [xs, ys, color, myExon.start, myExon.end,
-                  myExon.tran.name, myExon.tran.full, myExon.tran.partial,
-                  myExon.tran.annot, COLORS[myExon.tran.source[0]]]
-
-        for ix, col in enumerate(columns):
-            sourceDict[columns[ix]].append(values[ix])
-
-    sourceDict['line_alpha'] = [1 for x in range(len(sourceDict['xs']))]
-    sourceDict['height'] = [int(opt.height) for x in range(len(sourceDict['xs']))]
-    return sourceDict
-
-
-def getColorFromDF(transcript_name, colorDF, num_clusters):
-    """
-    Get transcript color based on number of clusters.
-    """
-    if transcript_name not in list(colorDF.name):
-        color = COLORS[0]
-    else:
-        row = colorDF.loc[colorDF['name'] == transcript_name]    # find out which transcript it is, and what group it belongs
-        groupName = 'group%d' % num_clusters          # how many groups are there
-        try:
-            group = row[groupName].values[0]
-            color = COLORS[group + 1]
-        except (ValueError, KeyError):          # if the input groups are more than total number of transcripts
-            color = COLORS[1]
-    return color
-
-
-# find out the position of boundaries
-def getBoundaryData(blocks, chromosome):
-    blockDict = dict(top=[], bottom=[], left=[], right=[], exon=[],
-                     start=[], end=[], chromosome=[], xs=[], ys=[],
-                     boundary=[])
-    tranDict = dict(top=[], bottom=[], left=[], right=[])
-    blockDict['xs'] = [(0, 0)]
-    blockDict['ys'] = [(0, tranNum + 1)]
-    columns = ['boundary', 'left', 'right', 'xs', 'start', 'end', 'exon']
-    exonCounter = 1
-    numberOfBlocks = len(blocks)
-    for bound in blocks:      # infomation for the mouse hover effect on blocks
-        if strand == '+':
-            values = [bound.boundary, bound.boundary + bound.start - bound.end,
-                      bound.boundary, (bound.boundary, bound.boundary),
-                      bound.start, bound.end, exonCounter]
-        else:
-            values = [bound.boundary, bound.boundary - bound.start + bound.end,
-                      bound.boundary, (bound.boundary, bound.boundary),
-                      bound.start, bound.end, exonCounter]
-        blockDict['top'] = [(tranNum + 1) for x in range(numberOfBlocks)]
-        blockDict['bottom'] = [0 for x in range(numberOfBlocks)]
-        blockDict['chromosome'] = [chromosome for x in range(numberOfBlocks)]
-        exonCounter += 1
-        counter = 0
-        while counter < len(columns):
-            blockDict[columns[counter]].append(values[counter])
-            counter += 1
-    right = blockDict['right']
-    blockDict['ys'] = [(0, tranNum + 1) for x in range(numberOfBlocks + 1)]
-
-    # put the region of each transcript into a block
-    tranDict['top'] = [x + 1.5 for x in range(tranNum)]
-    tranDict['bottom'] = [x + 0.5 for x in range(tranNum)]
-    tranDict['left'] = [0 for x in range(tranNum)]
-    tranDict['right'] = [max(right) for x in range(tranNum)]
-    return blockDict, tranDict
-
-
-# find out the chromosome that isosoforms locate on, find by matched isoform
-def getChromosome(tranList):
-    chromosome = None
-    for tran in tranList:
-        if tran.annot is False:               # find it in the matched isoforms
-            chromosome = tran.chr
-            break
-    return chromosome
-
-
-def howManyIsoforms(clusterDict, matchList):
-    allGenes = Counter()                                        # create a counter hastable(dictionary) object
-    for matchFile in matchList:
-        geneDict = dict()
-        myDict = clusterDict[matchFile].getGeneDict()
-        for key, val in myDict.iteritems():
-            geneDict.setdefault(key, len(val))                          # how many isoforms for each gene
-        geneDict = Counter(geneDict)
-        allGenes = allGenes + geneDict                                  # combine every match files
+def howManyIsoforms(allGenes, summary=None):
+    # allGenes: isoforms per gene over every match file, kept up to date
+    # as files are added and removed (getGene.updateMatchedIsoforms);
+    # summary: geneStats.combine of the same files
+    import pandas as pd
     df = pd.DataFrame()
     df['Gene'] = allGenes.keys()
     df['Transcripts'] = allGenes.values()
+    if summary is not None:
+        df = df.join(summary, on='Gene').fillna(0)      # genes without clusters
+    if opt.novelCounts is not None:                             # genome-wide novel junction counts
+        df['Novel'] = [opt.novelCounts.get(gene, 0) for gene in df['Gene']]
     df = df.sort_values(by='Transcripts', ascending=False)
-    geneSource.data = dict(Gene=list(df['Gene']), Transcripts=list(df['Transcripts']))
+    geneSource.data = dict((col, list(df[col])) for col in df.columns)
+
+
+def memoryReport():
+    '''Measure the loaded files on a thread of their own, then the plot data here.'''
+    MemoryPanel.text = 'Measuring memory...'
+
+    def measure():
+        try:
+            myReport = memoryStats.datasetReport()
+        except Exception as e:
+            traceback.print_exc()
+            fromWorker(partial(setattr, MemoryPanel, 'text', 'error: %s' % e))
+            return
+        fromWorker(partial(showMemory, myReport))
+    thread = threading.Thread(target=measure, name='memory-report')    # not the executor: genes would wait
+    thread.daemon = True
+    thread.start()
+
+
+def showMemory(myReport):
+    myReport['sessions'] = memoryStats.sessionReport()
+    MemoryPanel.text = memoryStats.formatReport(myReport)
+    if opt.memoryReport:
+        memoryStats.writeJson(myReport, opt.memoryReport)
+        MemoryPanel.text += '\nwritten to %s' % opt.memoryReport
 
 
 # save the transcripts to .fasta file, the function is copied from MatchAnnot
@@ -529,89 +590,32 @@ def saveFasta(attrname, old, new):
     opt.fasta = Save.value.strip()
     tranList = list()
     exonList = list()
-    getGene.getGeneFromMatches(opt, tranList, exonList)
+    if opt.region is not None:
+        getGene.getGeneFromRegion(opt, tranList, exonList)
+    else:
+        getGene.getGeneFromMatches(opt, tranList, exonList)
     opt.fasta = None
     Console.text = 'Console:\nSuccessfully saved'
 
 
 def markGene(attrname, old, new):
     if 0 in Mark.active:
-        with open('gene.json', 'r') as f:
-            data = json.load(f)
-            f.close()
-        with open('gene.json', 'w+') as f:
-            paramDict = {'height': opt.height, 'width': opt.width, 'full': opt.full,
-                         'partial': opt.partial, 'cluster': opt.cluster, 'group': opt.group}
-            if opt.gene not in data.keys():
-                data[opt.gene] = paramDict
-            f.write(json.dumps(data))
-            markedSource.data = dict(Gene=data.keys())
-            f.truncate()
-            f.close()
+        paramDict = {'height': opt.height, 'width': opt.width, 'full': opt.full,
+                     'partial': opt.partial, 'cluster': opt.cluster, 'group': opt.group}
+        if opt.gene not in store:               # keep the settings it was first saved with
+            store.save(opt.gene, paramDict)
     else:
-        with open('gene.json', 'r') as f:
-            data = json.load(f)
-            f.close()
-        with open('gene.json', 'w+') as f:
-            if opt.gene in data:
-                data.pop(opt.gene, None)
-            f.write(json.dumps(data))
-            markedSource.data = dict(Gene=data.keys())
-            f.truncate()
-            f.close()
-
-
-def plotStartStop(tranList, blocks):
-    '''Add start/stop codons to plot.'''
-    codonDict = dict(x=[], y=[], color=[])
-    for tran in tranList:
-        if tran.annot:                             # only annotations know about start/stops
-            if hasattr(tran, 'startcodon'):
-                codonDict['color'].append('green')
-                xPos = findCodon(tran.startcodon, blocks)
-                codonDict['x'].append(xPos)
-                codonDict['y'].append(tranNum - tran.tranIx)
-            if hasattr(tran, 'stopcodon'):
-                codonDict['color'].append('red')
-                xPos = findCodon(tran.stopcodon, blocks)
-                codonDict['x'].append(xPos)
-                codonDict['y'].append(tranNum - tran.tranIx)
-    codonDict['size'] = [int(opt.height) * 1.2 for x in range(len(codonDict['x']))]
-    return codonDict
-
-
-def findCodon(posit, blocks):
-    '''Add a codon mark to the plot.'''
-    for blk in blocks:
-        if blk.start <= posit and blk.end >= posit or \
-                blk.start >= posit and blk.end <= posit:      # check in both strand directions
-            xPos = blk.boundary - abs(blk.end - posit)
-    return xPos
-
-#
-# Classes.
-#
-
+        store.remove(opt.gene)
+    markedSource.data = dict(Gene=store.genes())
 
-# a class containing all the input parameters
-class getParams(object):
-    def __init__(self, gtf, matches, gene, format="standard", fasta=None,
-                 annotations=None, clusterDict=None, height=None, width=None,
-                 full=None, partial=None, group=None, cluster=None):
-        self.gtf = gtf                              # reference genome file
-        self.matches = matches                      # list of matched files
-        self.gene = gene                            # which gene to load
-        self.format = format                        # format is a keyword
-        self.fasta = fasta                          # output isoforms to fasta
-        self.annotations = annotations              # hold annotation dictionary in RAM
-        self.clusterDict = clusterDict              # hold isoforms information in RAM
-        self.height = height
-        self.width = width
-        self.full = full
-        self.partial = partial
-        self.group = group
-        self.cluster = cluster
 
+def sessionUser():
+    '''User name passed as ?user= in the URL of this session, if any.'''
+    context = curdoc().session_context
+    request = getattr(context, 'request', None) if context is not None else None
+    if request is None or 'user' not in request.arguments:
+        return None
+    return request.arguments['user'][0]
 
 #
 # Application code.
@@ -621,54 +625,130 @@ class getParams(object):
 parser = argparse.ArgumentParser(description='Visual analytics for PacBio data.')
 parser.add_argument('--input', dest='input_file', help='Input file (pickle)')
 parser.add_argument('--anno', dest='anno_file', help='Annotation file (gtf)')
+parser.add_argument('--anno-format', dest='anno_format', default='standard',
+                    help='Annotation file format: standard (GTF), parallel (GTF parsed on several processes), alt or pickle')
+parser.add_argument('--store', dest='store_file', default=geneStore.DEFAULT_DB, help='Saved-gene database (SQLite)')
+parser.add_argument('--user', dest='user', help='Namespace for saved genes (default: ?user= URL argument, then login name)')
+parser.add_argument('--lazy-seq', dest='lazy_seq', action='store_true',
+                    help='Keep cluster sequences in an indexed FASTA next to each pickle instead of in memory')
+parser.add_argument('--processes', dest='processes', type=int,
+                    help='Worker processes for loading match files and parallel annotations (default: one per CPU)')
+parser.add_argument('--collapse-tolerance', dest='collapse_tolerance', type=int, default=getGene.COLLAPSE_TOLERANCE,
+                    help='Bases terminal exon ends may differ by when collapsing identical isoforms')
+parser.add_argument('--novel-junctions', dest='novel_junctions', action='store_true',
+                    help='Count novel splice junctions of every gene at load time and show them in the gene table')
+parser.add_argument('--prefetch', dest='prefetch', type=int, default=prefetch.PREFETCH_GENES,
+                    help='Genes after the current one in the gene table to lay out in the background (0: off)')
+parser.add_argument('--prefetch-workers', dest='prefetch_workers', type=int, default=prefetch.PREFETCH_WORKERS,
+                    help='Background threads for prefetching')
+parser.add_argument('--approx-above', dest='approx_above', type=int, default=getGene.APPROX_THRESHOLD,
+                    help='Group genes with more isoforms than this by distances to landmark isoforms')
+parser.add_argument('--timing-log', dest='timing_log', help='Append per-gene stage timings to this file (JSON lines)')
+parser.add_argument('--watch-interval', dest='watch_interval', type=float, default=WATCH_INTERVAL,
+                    help='Seconds between checks of the match files for changes on disk, 0 for none')
+parser.add_argument('--bed', dest='bed_files', nargs='+', default=[],
+                    help='BED files of features to draw in tracks above the isoforms')
+parser.add_argument('--coverage', dest='coverage', choices=readCoverage.MODES, default='total',
+                    help='Read coverage above the isoforms: one track, a track per match file, or none')
+parser.add_argument('--intron-scale', dest='intron_scale', type=float,
+                    help='Draw introns at this fraction of their genomic length (1: genomic x axis) rather than not at all')
+parser.add_argument('--memory-report', dest='memory_report',
+                    help='Also write the memory report to this file (JSON)')
+parser.add_argument('--profile-dir', dest='profile_dir', default='.', help='Directory for cProfile dumps')
 args, unknown = parser.parse_known_args()
 input_file = args.input_file or "matches.pickle"
 anno_file = args.anno_file or "gencode.vM9.annotation.gtf"
 
+# Saved genes live in a per-user namespace of the store; gene.json in the
+# working directory is imported into it the first time.
+store = geneStore.GeneStore(args.store_file, namespace=args.user or sessionUser())
+store.importJson('gene.json')
+markedSource.data = dict(Gene=store.genes())
+
 # Create all widgets.
 GTF = TextInput(title="Annotation file", value=anno_file)
-Format = TextInput(title="Annotation file format, standard is gtf", value="standard")
+Format = TextInput(title="Annotation file format: standard (gtf), parallel (gtf, on --processes), alt or pickle",
+                   value=args.anno_format)
 Matches = TextInput(title="MatchAnnot pickle files (ex: a.pickle, b.pickle)", value=input_file)
-Gene = TextInput(title="Gene to visualize", value="BRCA1")
+Gene = TextInput(title="Gene or region (chr:start-end) to visualize", value="BRCA1", name='gene')
 Full = Slider(title="Full reads support threshold",
-              value=0, start=0, end=30, step=1.0)
+              value=0, start=0, end=30, step=1.0, name='full')
 Partial = Slider(title="Partial reads support threshold",
-                 value=0, start=0, end=50, step=1.0)
+                 value=0, start=0, end=50, step=1.0, name='partial')
 Group = CheckboxGroup(labels=["Group by file", "Group by similarity"],
                       active=[1])
+Collapse = CheckboxGroup(labels=["Collapse identical isoforms across files"], active=[])
+DropHidden = CheckboxGroup(labels=["Drop isoforms below the thresholds"], active=[])
 Cluster = Slider(title="Number of isoform groups",
-                 value=3, start=1, end=15, step=1.0)
+                 value=3, start=1, end=15, step=1.0, name='cluster')
 Height = Slider(title="Transcript height", value=10, start=5, end=30, step=1)
 Width = Slider(title="Plot width", value=600, start=400, end=1500, step=50)
 Save = TextInput(title="Enter the folder name to save data in Fasta", value=None)
-button = Button(label='GO', button_type="success")
+button = Button(label='GO', button_type="success", name='go')
 Sort = RadioButtonGroup(labels=["Rank by Gene", "Rank by Transcripts"], active=1)
+if args.novel_junctions:
+    Sort.labels = Sort.labels + ["Rank by Novel junctions"]
 Mark = CheckboxButtonGroup(labels=["Save gene"], active=[])
 
-opt = getParams(None, [], None, format=None)    # a object that contains all the inputs options for read data
+Profile = CheckboxButtonGroup(labels=["Profile next update"], active=[])
+MemoryButton = Button(label='Memory report')
+MemoryPanel = PreText(text='', width=280, height=300)
+
+opt = getParams(None, [], None, format=None,    # a object that contains all the inputs options for read data
+                timingLog=args.timing_log, profileDir=args.profile_dir,
+                lazySeq=args.lazy_seq, processes=args.processes,
+                collapseTolerance=args.collapse_tolerance, novelJunctions=args.novel_junctions,
+                prefetch=args.prefetch, approxAbove=args.approx_above,
+                memoryReport=args.memory_report, bedTracks=overlay.bedTracks(args.bed_files),
+                intronScale=args.intron_scale, coverageMode=args.coverage)
+doc = curdoc()                          # this session's document, for callbacks from the worker
+loop = IOLoop.current()                 # the server's event loop: this module runs on it
+executor = ThreadPoolExecutor(max_workers=1)     # one gene at a time; superseded ones are skipped
+prefetcher = prefetch.Prefetcher(workers=args.prefetch_workers if args.prefetch > 0 else 0)
+memorySession = memoryStats.register(doc.session_context.id if doc.session_context else 'local', opt,
+                                     dict(exons=source, blocks=blockSource, allBlocks=allBlockSource,
+                                          transcripts=tranSource, genes=geneSource, codons=codonSource,
+                                          polyA=polyASource, tracks=trackSource, coverage=coverageSource,
+                                          novel=novelSource, marked=markedSource))
 
 # the console box
-Console = PreText(text='Console:\nStart visualize by entering \nannotations, pickle file and\n gene. Press Enter to submit.\n', height=70)
+Console = PreText(text='Console:\nStart visualize by entering \nannotations, pickle file and\n gene. Press Enter to submit.\n', height=170,
+                  name='console')
 
 
 # a table of with all the genes in the match files, and how many isoforms in each gene
 geneColumns = [TableColumn(field="Gene", title="Gene"),
-               TableColumn(field="Transcripts", title="Isoforms")]
-geneCountTable = DataTable(source=geneSource, columns=geneColumns, sortable=False,
-                           row_headers=False, width=280)
+               TableColumn(field="Transcripts", title="Isoforms"),
+               TableColumn(field="Full", title="Full reads"),
+               TableColumn(field="Partial", title="Partial reads"),
+               TableColumn(field="Chains", title="Intron chains"),
+               TableColumn(field="MinExons", title="Min exons"),
+               TableColumn(field="MaxExons", title="Max exons"),
+               TableColumn(field="Span", title="Span (bp)"),
+               TableColumn(field="Matched", title="Matched", formatter=NumberFormatter(format='0%'))]
+if opt.novelJunctions:
+    geneColumns.append(TableColumn(field="Novel", title="Novel junctions"))
+geneCountTable = DataTable(source=geneSource, columns=geneColumns, sortable=True,     # click a header to sort
+                           row_headers=False, width=280, fit_columns=False)
 markedColumns = [TableColumn(field="Gene", title="Saved genes")]
 markedGeneTable = DataTable(source=markedSource, columns=markedColumns, sortable=False, width=280, row_headers=False)
 
 # make changes to the plot when widgets are updated
 button.on_click(updateGene)
 Mark.on_change('active', markGene)
-Full.on_change('value', selectTran)
-Partial.on_change('value', selectTran)
+Full.on_change('value', updateSupport)
+Partial.on_change('value', updateSupport)
 Cluster.on_change('value', updateGroup)
 Group.on_change('active', updateGroup)
+Collapse.on_change('active', lambda attr, old, new: updateGene())
+DropHidden.on_change('active', lambda attr, old, new: updateGene())
 Save.on_change('value', saveFasta)
 tranSource.on_change('selected', selectTran)
 Sort.on_change('active', updateGeneTable)
+MemoryButton.on_click(memoryReport)
+
+if args.watch_interval > 0:
+    doc.add_periodic_callback(watchMatchFiles, int(args.watch_interval * 1000))
 
 # Add mouseup callback on sliders.
 slider_fake_source.on_change('data', lambda attr, old, new: updateGene())
@@ -695,8 +775,8 @@ add_selected_handler(markedGeneTable, True)
 
 
 # Layout interface.
-inputs_and_outputs = [Console, GTF, Matches, Format, Save]
-plot_controls = [Gene, button, Group, Cluster, Full, Partial, Height, Width, Sort, geneCountTable, Mark, markedGeneTable]
+inputs_and_outputs = [Console, GTF, Matches, Format, Save, Profile, MemoryButton, MemoryPanel]
+plot_controls = [Gene, button, Group, Collapse, Cluster, Full, Partial, DropHidden, Height, Width, Sort, geneCountTable, Mark, markedGeneTable]
 
 curdoc().add_root(row( row(inputs_and_outputs), row(widgetbox(plot_controls), plotColumn) ) )
 
@@ -0,0 +1,192 @@
+'''
+Genome-wide isoform x sample count matrix.
+
+    python exportMatrix.py --matches a.pickle b.pickle ... --out counts.tsv
+    python exportMatrix.py --matches *.pickle --out counts.parquet --format parquet
+
+One row per distinct isoform structure of a gene (gene, chromosome,
+strand and intron chain), with the full and partial support of every
+match file (sample) in two columns each, taken from cluster.getFP().
+
+Memory stays bounded however many samples there are: each match file is
+loaded on its own (in a worker process) and reduced to a gene-sorted
+spill file of per-structure counts, then the spill files are merged a
+row at a time. At most one ClusterDict per worker is in memory.
+'''
+
+import argparse
+import heapq
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import getGene
+
+PARQUET_BATCH = 100000          # rows per Parquet row group
+MONO_EXONIC = '.'               # intron chain of single-exon isoforms
+
+
+def chainKey(exons):
+    '''Intron chain as text: "end-start" of each intron, comma-separated.'''
+
+    introns = getGene.intronChain(exons)
+    if not introns:
+        return MONO_EXONIC
+    return ','.join('%d-%d' % intron for intron in introns)
+
+
+def spillSample(job):
+    '''
+    Load one match file and write its per-structure counts, sorted by
+    gene, to spillFile. Runs in a worker process; errors are returned
+    rather than raised, as in getGene.loadMatchFile.
+    '''
+
+    matchFile, spillFile = job
+    try:
+        clusterDict = getGene.cl.ClusterDict.fromPickle(matchFile)
+    except Exception as e:
+        return matchFile, e
+
+    counts = dict()             # (gene, chr, strand, chain) -> [full, partial]
+    for gene, clusters in clusterDict.getGeneDict().iteritems():
+        for cluster in clusters:
+            key = (gene, cluster.chr, cluster.strand, chainKey(list(cluster.cigar.exons())))
+            full, partial = cluster.getFP()
+            total = counts.setdefault(key, [0, 0])
+            total[0] += full
+            total[1] += partial
+    clusterDict = None
+
+    with open(spillFile, 'w') as handle:
+        for key in sorted(counts):
+            handle.write('%s\t%s\t%s\t%s\t%d\t%d\n' % (key + tuple(counts[key])))
+    return matchFile, None
+
+
+def readSpill(spillFile, sampleIx):
+    with open(spillFile) as handle:
+        for line in handle:
+            gene, chrom, strand, chain, full, partial = line.rstrip('\n').split('\t')
+            yield gene, chrom, strand, chain, sampleIx, int(full), int(partial)
+
+
+def mergeSpills(spillFiles):
+    '''
+    Merge gene-sorted spill files into matrix rows: yields
+    (gene, chr, strand, chain, counts) with counts a list of
+    full, partial for every sample in turn.
+    '''
+
+    merged = heapq.merge(*[readSpill(spillFile, ix) for ix, spillFile in enumerate(spillFiles)])
+    for key, entries in itertools.groupby(merged, key=lambda x: x[:4]):
+        counts = [0] * (2 * len(spillFiles))
+        for entry in entries:
+            counts[2 * entry[4]] += entry[5]
+            counts[2 * entry[4] + 1] += entry[6]
+        yield key + (counts,)
+
+
+def sampleNames(matchFiles):
+    '''Column prefixes: match file names without directory and extension.'''
+
+    names = [os.path.splitext(os.path.basename(matchFile))[0] for matchFile in matchFiles]
+    if len(set(names)) < len(names):        # same file name in different directories
+        names = ['%s_%d' % (name, ix + 1) for ix, name in enumerate(names)]
+    return names
+
+
+def header(samples):
+    columns = ['gene', 'chr', 'strand', 'intron_chain']
+    for sample in samples:
+        columns += ['%s_full' % sample, '%s_partial' % sample]
+    return columns
+
+
+def writeTsv(rows, samples, outFile):
+
+    count = 0
+    with open(outFile, 'w') as handle:
+        handle.write('\t'.join(header(samples)) + '\n')
+        for gene, chrom, strand, chain, counts in rows:
+            handle.write('\t'.join([gene, chrom, strand, chain] + [str(x) for x in counts]) + '\n')
+            count += 1
+    return count
+
+
+def writeParquet(rows, samples, outFile, batch=PARQUET_BATCH):
+
+    import pyarrow as pa                # only needed for Parquet output
+    import pyarrow.parquet as pq
+
+    columns = header(samples)
+    schema = pa.schema([pa.field(name, pa.string()) for name in columns[:4]] +
+                       [pa.field(name, pa.int64()) for name in columns[4:]])
+    writer = pq.ParquetWriter(outFile, schema)
+    count = 0
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, batch))
+            if not chunk:
+                break
+            arrays = [pa.array([row[ix] for row in chunk], type=pa.string()) for ix in xrange(4)]
+            arrays += [pa.array([row[4][ix] for row in chunk], type=pa.int64())
+                       for ix in xrange(2 * len(samples))]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(chunk)
+    finally:
+        writer.close()
+    return count
+
+
+def exportMatrix(matchFiles, outFile, fmt='tsv', processes=None, tmpDir=None):
+    '''Write the count matrix of matchFiles to outFile; returns the number of rows.'''
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(matchFiles)))
+    spillDir = tempfile.mkdtemp(prefix='exportMatrix.', dir=tmpDir)
+    try:
+        jobs = [(matchFile, os.path.join(spillDir, '%d.tsv' % ix)) for ix, matchFile in enumerate(matchFiles)]
+        if processes == 1:
+            results = [spillSample(job) for job in jobs]
+        else:
+            pool = multiprocessing.Pool(processes, maxtasksperchild=1)     # free each ClusterDict
+            try:
+                results = pool.map(spillSample, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        for matchFile, error in results:
+            if error is not None:
+                raise error
+
+        rows = mergeSpills([spillFile for matchFile, spillFile in jobs])
+        samples = sampleNames(matchFiles)
+        if fmt == 'parquet':
+            return writeParquet(rows, samples, outFile)
+        return writeTsv(rows, samples, outFile)
+    finally:
+        shutil.rmtree(spillDir, ignore_errors=True)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Export an isoform x sample count matrix from MatchAnnot pickles.')
+    parser.add_argument('--matches', nargs='+', required=True, help='MatchAnnot pickle files, one per sample')
+    parser.add_argument('--out', required=True, help='output file')
+    parser.add_argument('--format', choices=['tsv', 'parquet'],
+                        help='output format (default: from the file extension, else tsv)')
+    parser.add_argument('--processes', type=int, help='match files loaded at once (default: number of CPUs)')
+    parser.add_argument('--tmp-dir', dest='tmp_dir', help='directory for the per-sample spill files')
+    args = parser.parse_args()
+
+    fmt = args.format or ('parquet' if args.out.endswith('.parquet') else 'tsv')
+    rows = exportMatrix(args.matches, args.out, fmt, args.processes, args.tmp_dir)
+    print '%d isoforms x %d samples written to %s' % (rows, len(args.matches), args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+'''
+Per-gene summary statistics of a match file, for the gene table: read
+support, distinct intron chains, exon counts, genomic span and how many
+clusters matched the annotation. Computed in one pass over the clusters
+while the file is loaded (in the load worker), kept as columnar numpy
+arrays and cached next to the match file as <file>.stats.npz.
+'''
+
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+import junctions
+
+MATCHED_SCORE = 4               # MatchAnnot score from which a cluster matches an annotated transcript (all junctions agree)
+CACHE_VERSION = 1               # bump when the statistics change
+SUM_COLUMNS = ('clusters', 'full', 'partial', 'matched')
+MIN_COLUMNS = ('minExons', 'start')
+MAX_COLUMNS = ('maxExons', 'end')
+
+
+def cacheName(matchFile):
+    return matchFile + '.stats.npz'
+
+
+class GeneStats (object):
+    '''
+    Statistics of the genes of one match file, one array per column and
+    one row per gene. Intron chains are kept as hashes, chainOffsets[ix]
+    to chainOffsets[ix + 1] being the distinct chains of gene ix, so
+    chains can be counted over several files.
+    '''
+
+    def __init__(self, genes, columns, chainOffsets, chainHashes):
+
+        self.genes = genes                  # array of gene names
+        self.columns = columns              # column name -> int64 array
+        self.chainOffsets = chainOffsets
+        self.chainHashes = chainHashes
+
+    def __len__(self):
+        return len(self.genes)
+
+    @classmethod
+    def fromClusterDict(cls, clusterDict):
+
+        genes = list()
+        rows = list()
+        chainOffsets = [0]
+        chainHashes = list()
+        for gene, clusters in clusterDict.getGeneDict().iteritems():
+            if not clusters:
+                continue
+            full = partial = matched = 0
+            minExons = maxExons = None
+            start = end = None
+            chains = set()
+            for cluster in clusters:
+                exons = list(cluster.cigar.exons())
+                clusterFull, clusterPartial = cluster.getFP()
+                full += clusterFull
+                partial += clusterPartial
+                if (getattr(cluster, 'bestScore', None) or 0) >= MATCHED_SCORE:
+                    matched += 1
+                minExons = len(exons) if minExons is None else min(minExons, len(exons))
+                maxExons = len(exons) if maxExons is None else max(maxExons, len(exons))
+                start = exons[0].start if start is None else min(start, exons[0].start)
+                end = exons[-1].end if end is None else max(end, exons[-1].end)
+                chains.add(hash(tuple(junctions.exonJunctions(exons))))
+            genes.append(gene)
+            rows.append((len(clusters), full, partial, matched, minExons, start, maxExons, end))
+            chainHashes.extend(sorted(chains))
+            chainOffsets.append(len(chainHashes))
+
+        names = SUM_COLUMNS + MIN_COLUMNS + MAX_COLUMNS
+        table = np.array(rows, dtype=np.int64).reshape(-1, len(names))
+        columns = dict((name, table[:, ix].copy()) for ix, name in enumerate(names))
+        return cls(np.array(genes, dtype=object), columns,
+                   np.array(chainOffsets, dtype=np.int64), np.array(chainHashes, dtype=np.int64))
+
+    def save(self, fileName, sourceFile):
+        '''Write to fileName (npz), stamped with the size and mtime of sourceFile.'''
+
+        # Written to a temporary file that replaces fileName when complete:
+        # other sessions may be reading it.
+        info = os.stat(sourceFile)
+        handle, tmpName = tempfile.mkstemp(prefix=os.path.basename(fileName), dir=os.path.dirname(fileName) or '.')
+        try:
+            with os.fdopen(handle, 'wb') as tmp:
+                np.savez(tmp, genes=self.genes.astype(unicode), chainOffsets=self.chainOffsets,
+                         chainHashes=self.chainHashes,
+                         stamp=np.array([CACHE_VERSION, info.st_size, info.st_mtime], dtype=np.float64),
+                         **dict(('column_' + name, values) for name, values in self.columns.iteritems()))
+            os.rename(tmpName, fileName)
+        except:
+            os.remove(tmpName)
+            raise
+
+    @classmethod
+    def load(cls, fileName, sourceFile):
+        '''Statistics cached in fileName, or None if missing or older than sourceFile.'''
+
+        try:
+            info = os.stat(sourceFile)
+            with np.load(fileName) as cached:
+                if list(cached['stamp']) != [CACHE_VERSION, info.st_size, info.st_mtime]:
+                    return None
+                columns = dict((name[len('column_'):], cached[name]) for name in cached.files
+                               if name.startswith('column_'))
+                return cls(cached['genes'].astype(object), columns, cached['chainOffsets'], cached['chainHashes'])
+        except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile):     # no cache, or an unreadable one
+            return None
+
+
+def statsForFile(matchFile, clusterDict):
+    '''Cached statistics of matchFile, computed (and cached) if need be.'''
+
+    stats = GeneStats.load(cacheName(matchFile), matchFile)
+    if stats is None:
+        stats = GeneStats.fromClusterDict(clusterDict)
+        try:
+            stats.save(cacheName(matchFile), matchFile)
+        except (IOError, OSError):      # read-only data directory: recomputed next time
+            pass
+    return stats
+
+
+def combine(statsList):
+    '''
+    One table over several match files: a DataFrame indexed by gene with
+    Full, Partial, Chains (distinct over all files), MinExons, MaxExons,
+    Span and Matched (fraction of clusters) columns.
+    '''
+
+    import pandas as pd             # only here: loading match files doesn't need it
+
+    statsList = [stats for stats in statsList if len(stats)]
+    if not statsList:
+        return pd.DataFrame(columns=['Full', 'Partial', 'Chains', 'MinExons', 'MaxExons', 'Span', 'Matched'])
+    genes = np.concatenate([stats.genes for stats in statsList])
+    df = pd.DataFrame(dict((name, np.concatenate([stats.columns[name] for stats in statsList]))
+                           for name in SUM_COLUMNS + MIN_COLUMNS + MAX_COLUMNS))
+    df['gene'] = genes
+    grouped = df.groupby('gene')
+    table = grouped[list(SUM_COLUMNS)].sum().join(grouped[list(MIN_COLUMNS)].min()).join(grouped[list(MAX_COLUMNS)].max())
+
+    chains = pd.DataFrame(dict(
+        gene=np.concatenate([np.repeat(stats.genes, np.diff(stats.chainOffsets)) for stats in statsList]),
+        chain=np.concatenate([stats.chainHashes for stats in statsList])))
+    distinct = chains.drop_duplicates().groupby('gene').size()
+
+    summary = pd.DataFrame(index=table.index)
+    summary['Full'] = table['full']
+    summary['Partial'] = table['partial']
+    summary['Chains'] = distinct.reindex(table.index).fillna(0).astype(np.int64)
+    summary['MinExons'] = table['minExons']
+    summary['MaxExons'] = table['maxExons']
+    summary['Span'] = table['end'] - table['start'] + 1
+    summary['Matched'] = table['matched'] / table['clusters'].astype(np.float64)
+    return summary
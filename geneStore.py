@@ -0,0 +1,152 @@
+'''
+Saved genes and their view settings, kept in SQLite.
+
+Replaces gene.json: each mark/unmark is a single-row upsert or delete
+instead of a rewrite of the whole file, concurrent sessions (and server
+processes) share the database safely through WAL mode, and genes are
+kept per user namespace. Existing gene.json files are imported once:
+
+    python geneStore.py --db genes.db --user alice gene.json
+'''
+
+import argparse
+import getpass
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB = 'genes.db'
+DEFAULT_NAMESPACE = 'default'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS saved_genes (
+    namespace TEXT NOT NULL,
+    gene TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (namespace, gene)
+);
+CREATE TABLE IF NOT EXISTS imports (
+    path TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    imported REAL NOT NULL,
+    genes INTEGER NOT NULL,
+    PRIMARY KEY (path, namespace)
+);
+'''
+
+
+class GeneStore (object):
+    '''Saved genes of one namespace (usually one user).'''
+
+    def __init__(self, path=DEFAULT_DB, namespace=None, timeout=30.0):
+
+        self.path = path
+        self.namespace = namespace or defaultNamespace()
+        self.lock = threading.Lock()        # one connection, possibly used from worker threads
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')      # readers don't block the writer
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.lock:
+            self.conn.executescript(SCHEMA)
+            self.conn.commit()
+
+    def genes(self):
+        '''Names of the saved genes, sorted.'''
+
+        with self.lock:
+            rows = self.conn.execute('SELECT gene FROM saved_genes WHERE namespace = ? ORDER BY gene',
+                                     (self.namespace,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get(self, gene):
+        '''Saved settings of a gene as a dict, or None if it is not saved.'''
+
+        with self.lock:
+            row = self.conn.execute('SELECT settings FROM saved_genes WHERE namespace = ? AND gene = ?',
+                                    (self.namespace, gene)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def __contains__(self, gene):
+        return self.get(gene) is not None
+
+    def save(self, gene, settings):
+        '''Insert or update one gene.'''
+
+        with self.lock:
+            with self.conn:                 # commits, or rolls back on error
+                self.conn.execute('INSERT OR REPLACE INTO saved_genes (namespace, gene, settings, updated) '
+                                  'VALUES (?, ?, ?, ?)',
+                                  (self.namespace, gene, json.dumps(settings, sort_keys=True), time.time()))
+
+    def remove(self, gene):
+
+        with self.lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM saved_genes WHERE namespace = ? AND gene = ?',
+                                  (self.namespace, gene))
+
+    def importJson(self, filename):
+        '''
+        Import a gene.json file into this namespace, once. Genes already
+        in the store keep their settings. Returns the number of genes
+        imported, 0 if the file is missing or was imported before.
+        '''
+
+        if not os.path.isfile(filename):
+            return 0
+        path = os.path.abspath(filename)
+        with open(filename) as handle:
+            data = json.load(handle)
+
+        with self.lock:
+            with self.conn:
+                done = self.conn.execute('SELECT 1 FROM imports WHERE path = ? AND namespace = ?',
+                                         (path, self.namespace)).fetchone()
+                if done is not None:
+                    return 0
+                now = time.time()
+                imported = 0
+                for gene, settings in data.iteritems():
+                    cursor = self.conn.execute('INSERT OR IGNORE INTO saved_genes (namespace, gene, settings, updated) '
+                                               'VALUES (?, ?, ?, ?)',
+                                               (self.namespace, gene, json.dumps(settings, sort_keys=True), now))
+                    imported += cursor.rowcount
+                self.conn.execute('INSERT INTO imports (path, namespace, imported, genes) VALUES (?, ?, ?, ?)',
+                                  (path, self.namespace, now, imported))
+        return imported
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def defaultNamespace():
+    '''The login name of whoever runs the server.'''
+
+    try:
+        return getpass.getuser()
+    except Exception:
+        return DEFAULT_NAMESPACE
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Import gene.json files into the saved-gene database.')
+    parser.add_argument('--db', default=DEFAULT_DB, help='database file (default %(default)s)')
+    parser.add_argument('--user', help='namespace to import into (default: login name)')
+    parser.add_argument('files', nargs='+', help='gene.json files')
+    args = parser.parse_args()
+
+    store = GeneStore(args.db, args.user)
+    for filename in args.files:
+        print '%s: %d genes imported into %s' % (filename, store.importJson(filename), store.namespace)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
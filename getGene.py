@@ -1,18 +1,34 @@
+import cPickle
+import multiprocessing
 import os
 import re
 import string
+import time
+from collections import Counter
+from itertools import izip
 from tt_log import logger
 import Annotations as anno
 import Best as best
 import Cluster as cl
-import pandas as pd
-from sklearn.cluster import KMeans
+from intervalIndex import IntervalIndex
+import geneStats
+import seqStore
+import workerPool
 import numpy as np
 
+# pandas, scikit-learn and scipy are only needed to group transcripts and
+# are imported there: loading them takes longer than the rest of the
+# imports together, which every command-line tool and headless use of
+# this module would pay for.
+
 MIN_REGION_SIZE = 50
+APPROX_THRESHOLD = 500          # isoforms above which groupTran uses landmark distances
+APPROX_LANDMARKS = 64           # landmark transcripts for approximate grouping
+COLLAPSE_TOLERANCE = 50         # bases terminal exon ends may differ by and still be collapsed
 FASTA_WRAP = 60                 # bases per fasta line
 REGEX_NAME = re.compile('(c\d+)')      # cluster ID in cluster name
 REGEX_LEN = re.compile('\/(\d+)$')     # cluster length in cluster name
+REGEX_REGION = re.compile('^([\w.]+):([\d,]+)-([\d,]+)$')     # genomic region, e.g. chr17:43,040,000-43,130,000
 COMPLTAB = string.maketrans('ACGTacgt', 'TGCAtgca')    # for reverse-complementing reads
 
 
@@ -23,6 +39,9 @@ def getAnnotations(opt):
         annotList = anno.AnnotationList.fromPickle(opt.gtf)
     elif opt.format == 'alt':
         annotList = anno.AnnotationList(opt.gtf, altFormat=True)
+    elif opt.format == 'parallel':      # standard GTF, parsed a chromosome range per process
+        import gtfParallel
+        annotList = gtfParallel.loadAnnotations(opt.gtf, opt.processes)
     else:     # standard format
         annotList = anno.AnnotationList(opt.gtf)
 
@@ -36,12 +55,7 @@ def getGeneFromAnnotation(opt, tranList, exonList):
     if opt.annotations:
         annotList = opt.annotations
     else:
-        if opt.format == 'pickle':
-            annotList = anno.AnnotationList.fromPickle(opt.gtf)
-        elif opt.format == 'alt':
-            annotList = anno.AnnotationList(opt.gtf, altFormat=True)
-        else:     # standard format
-            annotList = anno.AnnotationList(opt.gtf)
+        annotList = getAnnotations(opt)
     allGenes = annotList.getGeneDict()
     allGenes.update({k.upper(): v for k, v in allGenes.iteritems()})
     if opt.gene not in allGenes:
@@ -50,10 +64,15 @@ def getGeneFromAnnotation(opt, tranList, exonList):
     if len(geneList) > 1:
         logger.warning('gene %s appears %d times in annotations, first occurrence plotted'
                        % (opt.gene, len(geneList)))
-    myGene = geneList[0]
+    addAnnotationGene(opt, geneList[0], tranList, exonList)
+    return tranList, exonList
+
+
+def addAnnotationGene(opt, myGene, tranList, exonList):
+    # Add the transcripts and exons of one annotation gene.
     for tran in myGene.getChildren():            # tran is an Annotation object
         myTran = Transcript(tran.name, start=tran.start, end=tran.end,
-                            annot=True, ID=tran.ID, source=(0, opt.gtf))
+                            annot=True, ID=tran.ID, chr=getattr(tran, 'chr', None), source=(0, opt.gtf))
         if hasattr(tran, 'startcodon'):
             myTran.startcodon = tran.startcodon
         if hasattr(tran, 'stopcodon'):
@@ -66,14 +85,127 @@ def getGeneFromAnnotation(opt, tranList, exonList):
             exonList.append(myExon)
             myTran.exons.append(myExon)
         tranList.append(myTran)
-    return tranList, exonList
 
 
 def getMatchedIsoforms(opt):
-    clusterDict = dict()
-    for matchFile in opt.matches:
-        clusterDict[matchFile] = cl.ClusterDict.fromPickle(matchFile)
-    return clusterDict
+    # Load every match file, in parallel when there are several. Per-gene
+    # isoform counts come back with them, in opt.geneCounts.
+    opt.clusterDict = None
+    updateMatchedIsoforms(opt, opt.matches)
+    return opt.clusterDict
+
+
+def updateMatchedIsoforms(opt, matchFiles):
+    '''
+    Bring opt.clusterDict in line with matchFiles: load the files that
+    are new, or changed on disk since they were loaded, and drop the
+    ones no longer wanted. opt.geneTotals (isoforms per gene over all
+    files) is updated by the per-file counts that came and went.
+    Returns (loaded, dropped) lists of files; a reloaded file is in both.
+    '''
+
+    current = opt.clusterDict or dict()
+    changed = set(changedMatchFiles(opt)) if current else set()
+    wanted = set(matchFiles)
+    dropped = [matchFile for matchFile in current if matchFile not in wanted or matchFile in changed]
+    toLoad = [matchFile for matchFile in sorted(wanted) if matchFile not in current or matchFile in changed]
+    if not toLoad and not dropped:
+        return list(), list()
+
+    mtimes = dict((matchFile, os.path.getmtime(matchFile)) for matchFile in toLoad if os.path.exists(matchFile))
+    loaded = loadMatchFiles(toLoad, opt.processes, opt.lazySeq) if toLoad else dict()   # IOError leaves opt as it was
+
+    # A new dict rather than an update in place: layouts cached on the
+    # identity of opt.clusterDict (layout.layoutKey) become stale.
+    clusterDict = dict((matchFile, myDict) for matchFile, myDict in current.iteritems()
+                       if matchFile not in dropped)
+    for matchFile in dropped:
+        opt.geneTotals.subtract(opt.geneCounts.pop(matchFile, Counter()))
+        opt.supportIndex.pop(matchFile, None)
+        opt.geneStats.pop(matchFile, None)
+        opt.loadTimes.pop(matchFile, None)
+        opt.matchMtimes.pop(matchFile, None)
+        opt.seqStores.pop(matchFile, None)
+        opt.coverage.pop(matchFile, None)
+    for matchFile, (myDict, indexes, stats, seconds) in loaded.iteritems():
+        clusterDict[matchFile] = myDict
+        counts = Counter(dict((gene, len(indexes[gene])) for gene in myDict.getGeneDict()))   # how many isoforms for each gene
+        opt.geneCounts[matchFile] = counts
+        opt.supportIndex[matchFile] = indexes
+        opt.geneStats[matchFile] = stats
+        opt.geneTotals.update(counts)
+        opt.loadTimes[matchFile] = seconds
+        opt.matchMtimes[matchFile] = mtimes.get(matchFile)
+        if opt.lazySeq:                 # bases were moved to the sidecar, fetch them for writeFasta
+            opt.seqStores[matchFile] = seqStore.SequenceStore(seqStore.sidecarName(matchFile))
+    opt.geneTotals += Counter()         # drops the genes of removed files
+    opt.clusterDict = clusterDict
+    logger.debug('match files loaded: %s, dropped: %s' % (sorted(loaded), dropped))
+    return sorted(loaded), dropped
+
+
+def changedMatchFiles(opt):
+    '''Loaded match files modified on disk since they were loaded.'''
+
+    changed = list()
+    for matchFile, mtime in opt.matchMtimes.items():     # items(): the worker thread may be loading
+        try:
+            if os.path.getmtime(matchFile) != mtime:
+                changed.append(matchFile)
+        except OSError:                 # deleted: keep what is loaded
+            pass
+    return changed
+
+
+def loadMatchFiles(matchFiles, processes=None, lazySeq=False):
+    '''
+    Unpickle MatchAnnot files on worker processes (see workerPool). Returns a dict of
+    match file -> (ClusterDict, gene -> SupportIndex, geneStats.GeneStats,
+    seconds taken to load it).
+    '''
+
+    jobs = [(matchFile, lazySeq) for matchFile in matchFiles]
+    results = workerPool.map(loadMatchFile, jobs, processes)
+
+    loaded = dict()
+    for matchFile, data, indexes, stats, seconds in results:
+        if isinstance(data, Exception):     # e.g. IOError for a missing file
+            raise data
+        if isinstance(data, str):           # came back from a worker, still pickled
+            t0 = time.time()
+            data = cPickle.loads(data)
+            seconds += time.time() - t0
+        loaded[matchFile] = (data, indexes, stats, seconds)
+    return loaded
+
+
+def loadMatchFile(job):
+    '''Load one match file; runs in a worker process when loading in parallel.'''
+
+    # The worker does everything that needs to walk every cluster (moving
+    # bases to the sidecar, indexing clusters by support, gene statistics)
+    # so the parent only unpickles the result. That goes back as a binary
+    # pickle, which is much quicker to load than the protocol-0 pickles
+    # MatchAnnot writes.
+
+    # Errors are returned rather than raised: Pool.map gives up on the
+    # first error while other workers may still be sending large
+    # results, which can leave the pool unable to shut down.
+
+    matchFile, lazySeq = job
+    t0 = time.time()
+    try:
+        clusterDict = cl.ClusterDict.fromPickle(matchFile)
+    except Exception as e:
+        return matchFile, e, None, None, None
+    if lazySeq:
+        seqStore.stripSequences(clusterDict, matchFile)
+    indexes = supportIndexes(clusterDict)
+    stats = geneStats.statsForFile(matchFile, clusterDict)
+    if multiprocessing.current_process().name == 'MainProcess':
+        return matchFile, clusterDict, indexes, stats, time.time() - t0
+    data = cPickle.dumps(clusterDict, cPickle.HIGHEST_PROTOCOL)
+    return matchFile, data, indexes, stats, time.time() - t0
 
 
 def getGeneFromMatches(opt, tranList, exonList):
@@ -82,7 +214,10 @@ def getGeneFromMatches(opt, tranList, exonList):
 
     if opt.matches is None:
         return tranList, exonList
+    minFull, minPartial = supportThresholds(opt) if not opt.collapse else (0, 0)   # collapsed: on the sums
     localList = list()                                                 # temporary list of clusters
+    fulls = list()
+    partials = list()
     totClusters = 0
     for ix, matchFile in enumerate(opt.matches):                            # --matches may have been specified more thn once
 
@@ -90,26 +225,164 @@ def getGeneFromMatches(opt, tranList, exonList):
             clusterDict = opt.clusterDict[matchFile]
         else:
             clusterDict = cl.ClusterDict.fromPickle(matchFile)            # pickle file produced by matchAnnot.py
-        for cluster in getClustersForGene(clusterDict, opt.gene):       # cluster is Cluster object
+        clusters = list(getClustersForGene(clusterDict, opt.gene))
+        totClusters += len(clusters)
+        index = opt.supportIndex.get(matchFile, dict()).get(opt.gene)
+        if index is None:                                                 # not indexed at load time
+            index = SupportIndex(clusters)
+        positions, full, partial = index.select(minFull, minPartial)     # thresholds applied before building anything
+        for pos in positions:
+            cluster = clusters[pos]                                       # cluster is Cluster object
             cluster.source = (ix + 1, matchFile)
-            totClusters += 1
-
-            full, partial = cluster.getFP()
-            sortKey = 'f%06dp%06d' % (full, partial)               # single key includes full and partial counts
 
             matchLen = re.search(REGEX_LEN, cluster.name)          # filter by cluster length, if requested
 
             if matchLen is None:
                 raise RuntimeError('no length in name: %s' % cluster.name)
             else:
-                localList.append([cluster, sortKey])
+                localList.append(cluster)
+        fulls.append(full)
+        partials.append(partial)
+
+    if localList:                                                      # sort by full/partial counts, over all files
+        order = np.lexsort((-np.concatenate(partials), -np.concatenate(fulls)))
+        localList = [localList[ix] for ix in order]
+    totFull, totPartial = addClusterRows(opt, localList, tranList, exonList)
+    logger.debug('kept %d of %d clusters for gene %s' % (len(localList), totClusters, opt.gene))
+    logger.debug('kept clusters include %d full + %d partial reads' % (totFull, totPartial))
+
+    return tranList, exonList
+
+
+def supportThresholds(opt):
+    '''
+    Minimum (full, partial) support of the rows to build, when hidden
+    isoforms are dropped from the plot rather than hidden. Clusters are
+    judged on their own support; collapsed rows on the support summed
+    over their clusters (addClusterRows).
+    '''
+
+    if opt.dropHidden:
+        return int(opt.full or 0), int(opt.partial or 0)
+    return 0, 0
+
+
+class SupportIndex (object):
+    '''
+    The clusters of one gene of a match file in order of decreasing full,
+    then partial, support: positions in the gene's cluster list, with
+    their full and partial read counts.
+    '''
+
+    def __init__(self, clusters):
+
+        support = np.array([cluster.getFP() for cluster in clusters], dtype=np.int32).reshape(-1, 2)
+        self.order = np.lexsort((-support[:, 1], -support[:, 0])).astype(np.int32)    # stable: ties keep file order
+        self.full = support[self.order, 0]
+        self.partial = support[self.order, 1]
+
+    def __len__(self):
+        return len(self.order)
+
+    def select(self, minFull=0, minPartial=0):
+        '''(positions, full, partial) of the clusters with at least
+           minFull full and minPartial partial reads, best supported first.'''
+
+        count = np.searchsorted(-self.full, -minFull, side='right')   # full >= minFull is a prefix
+        keep = self.partial[:count] >= minPartial
+        return self.order[:count][keep], self.full[:count][keep], self.partial[:count][keep]
+
+
+def supportIndexes(clusterDict):
+    '''gene -> SupportIndex of every gene of clusterDict, under its
+       name as given and in upper case (as genes are looked up).'''
+
+    indexes = dict()
+    for gene, clusters in clusterDict.getGeneDict().items():
+        indexes[gene] = SupportIndex(clusters)
+        indexes.setdefault(gene.upper(), indexes[gene])
+    return indexes
+
+
+def addClusterRows(opt, clusters, tranList, exonList):
+    # Add clusters, sorted by decreasing support, one row per cluster or,
+    # with opt.collapse, one row per distinct structure.
+    if not opt.collapse:
+        return addClusters(opt, clusters, tranList, exonList)
+
+    groups = collapseClusters(clusters, opt.collapseTolerance)
+    minFull, minPartial = supportThresholds(opt)
+    if minFull or minPartial:                   # drop rows on the support summed over their clusters
+        sums = [np.sum([cluster.getFP() for cluster in group], axis=0) for group in groups]
+        groups = [group for group, (full, partial) in zip(groups, sums)
+                  if full >= minFull and partial >= minPartial]
+    first = len(tranList)
+    addClusters(opt, [group[0] for group in groups], tranList, exonList)
+    if opt.fasta is not None:                   # the rows show one cluster of each group: export all of them
+        for group in groups:
+            for cluster in group[1:]:
+                writeFasta(opt, cluster)
+    totFull = 0
+    totPartial = 0
+    for myTran, group in zip(tranList[first:], groups):
+        myTran.samples = dict()                 # match file index -> [full, partial]
+        for cluster in group:
+            full, partial = cluster.getFP()
+            counts = myTran.samples.setdefault(cluster.source[0], [0, 0])
+            counts[0] += full
+            counts[1] += partial
+        myTran.full = sum(counts[0] for counts in myTran.samples.itervalues())
+        myTran.partial = sum(counts[1] for counts in myTran.samples.itervalues())
+        totFull += myTran.full
+        totPartial += myTran.partial
+    logger.debug('collapsed %d clusters into %d rows' % (len(clusters), len(groups)))
+    return totFull, totPartial
+
+
+def intronChain(exons):
+    '''Intron coordinates between consecutive exons, as a hashable tuple.'''
+
+    return tuple((exons[ix].end, exons[ix + 1].start) for ix in xrange(len(exons) - 1))
+
+
+def collapseClusters(clusters, tolerance=COLLAPSE_TOLERANCE):
+    '''
+    Group clusters with identical structure: same chromosome, strand and
+    intron chain, and terminal-exon ends within tolerance bases of the
+    group's first cluster. clusters should be sorted by decreasing
+    support, so each group's first cluster is its best supported one.
+    Returns a list of groups (lists of clusters), in order of first member.
+    '''
+
+    # Intron chains are compared by hashing them; only clusters sharing a
+    # chain are compared on their terminal ends.
+
+    groups = list()
+    byChain = dict()            # (chr, strand, intron chain) -> list of (start, end, group)
+    for cluster in clusters:
+        exons = list(cluster.cigar.exons())
+        start = exons[0].start
+        end = exons[-1].end
+        candidates = byChain.setdefault((cluster.chr, cluster.strand, intronChain(exons)), list())
+        for repStart, repEnd, group in candidates:
+            if abs(start - repStart) <= tolerance and abs(end - repEnd) <= tolerance:
+                group.append(cluster)
+                break
+        else:
+            group = [cluster]
+            candidates.append((start, end, group))
+            groups.append(group)
+    return groups
+
+
+def addClusters(opt, clusters, tranList, exonList):
+    '''Add a Transcript, with its exons, for each cluster. Returns the
+       total full and partial read counts of the clusters.'''
 
-    localList.sort(key=lambda x: x[1], reverse=True)                   # sort by full/partial counts
     totFull = 0
     totPartial = 0
 
-    for ent in localList:
-        cluster = ent[0]
+    for cluster in clusters:
         myTran = Transcript(cluster.name, score=cluster.bestScore,
                             source=cluster.source)
         myTran.chr = cluster.chr
@@ -125,17 +398,16 @@ def getGeneFromMatches(opt, tranList, exonList):
 
         for exonNum, exon in enumerate(cluster.cigar.exons()):         # exon is a cs.Exon object
 
-            exonName = '%s/%d' % (myTran.name, exonNum)                # exons don't have names: make one up
-
             if end < exon.end:
                 end = exon.end
             if start > exon.start:
                 start = exon.start
 
             if cluster.cigar.MD is not None:                           # if MD string was supplied
-                myExon = Exon(myTran, exonName, exon.start, exon.end, cluster.strand, QScore=exon.QScore())
+                myExon = Exon(myTran, None, exon.start, exon.end, cluster.strand,     # exons don't have names: made up
+                              QScore=exon.QScore(), number=exonNum)                     # from the number when needed
             else:
-                myExon = Exon(myTran, exonName, exon.start, exon.end, cluster.strand)
+                myExon = Exon(myTran, None, exon.start, exon.end, cluster.strand, number=exonNum)
 
             if exonNum == 0:
                 myExon.leading = leading              # add leading softclips to first exon
@@ -151,138 +423,172 @@ def getGeneFromMatches(opt, tranList, exonList):
 
         if opt.fasta is not None:
             writeFasta(opt, cluster)
-    logger.debug('kept %d of %d clusters for gene %s' % (len(localList), totClusters, opt.gene))
-    logger.debug('kept clusters include %d full + %d partial reads' % (totFull, totPartial))
+
+    return totFull, totPartial
+
+
+def parseRegion(text):
+    '''Parse a genomic region such as chr17:43,040,000-43,130,000.
+       Returns (chromosome, start, end), or None if text is not a region.'''
+
+    match = re.match(REGEX_REGION, text.strip())
+    if match is None:
+        return None
+    start = int(match.group(2).replace(',', ''))
+    end = int(match.group(3).replace(',', ''))
+    if start > end:
+        start, end = end, start
+    return match.group(1), start, end
+
+
+def buildRegionIndex(opt):
+    '''Build an interval index over annotation genes and match clusters.'''
+
+    # Payloads are (0, gene) for annotation genes and (ix + 1, matchFile,
+    # cluster) for clusters, mirroring the Transcript.source convention.
+
+    index = IntervalIndex()
+    if opt.annotations is not None:
+        for geneList in opt.annotations.getGeneDict().itervalues():
+            for gene in geneList:
+                index.add(gene.chr, gene.start, gene.end, (0, gene))
+    if opt.clusterDict:
+        for ix, matchFile in enumerate(opt.matches):
+            seen = set()
+            for clusters in opt.clusterDict[matchFile].getGeneDict().itervalues():
+                for cluster in clusters:
+                    if id(cluster) in seen:             # a cluster may be listed under several genes
+                        continue
+                    seen.add(id(cluster))
+                    exons = list(cluster.cigar.exons())
+                    start = min(exon.start for exon in exons)
+                    end = max(exon.end for exon in exons)
+                    index.add(cluster.chr, start, end, (ix + 1, matchFile, cluster))
+    index.index()
+    logger.debug('indexed %d genes and clusters' % len(index))
+    return index
+
+
+def getGeneFromRegion(opt, tranList, exonList):
+    '''Add to lists of transcripts and exons: every annotation gene and
+       cluster overlapping the genomic region opt.region.'''
+
+    if opt.regionIndex is None:
+        opt.regionIndex = buildRegionIndex(opt)
+    chrom, start, end = opt.region
+
+    clusters = list()
+    for item in opt.regionIndex.overlap(chrom, start, end):
+        if item[0] == 0:
+            addAnnotationGene(opt, item[1], tranList, exonList)
+        else:
+            cluster = item[2]
+            cluster.source = (item[0], item[1])
+            clusters.append(cluster)
+    clusters.sort(key=lambda cluster: cluster.getFP(), reverse=True)      # sort by full/partial counts
+    addClusterRows(opt, clusters, tranList, exonList)
+    if len(tranList) == 0:
+        raise RuntimeError('nothing found in region %s:%d-%d' % (chrom, start, end))
+    logger.debug('found %d transcripts in region %s:%d-%d' % (len(tranList), chrom, start, end))
 
     return tranList, exonList
 
 
-def assignBlocks(opt, exonList):
-    # assign exons into blocks
+def blockLayout(starts, ends, reverse=False, intronScale=None, offset=0):
     '''
-    Assign exons to blocks, separated by sequence which is intronic in
-    all transcripts. exonList is assumed to be sorted by ascending
-    start position.
+    Blocks of exons, given as arrays of their start and end positions,
+    sorted as for assignBlocks (or assignBlocksReverse if reverse).
+    Exons overlapping the running maximum of the ends before them join
+    its block. Blocks are laid end to end from x = offset; with
+    intronScale, the introns between them take that fraction of their
+    genomic length. Returns arrays of (block of each exon, adjStart of
+    each exon, block starts, block ends, block boundaries).
     '''
 
-    adjust = 0
-    blockNo = 0
-    exonIx = 0
-    blocks = list()
+    # The reverse strand runs in decreasing position: negated, it is
+    # the forward strand.
+    if reverse:
+        lo = -np.asarray(ends, dtype=np.int64)
+        hi = -np.asarray(starts, dtype=np.int64)
+    else:
+        lo = np.asarray(starts, dtype=np.int64)
+        hi = np.asarray(ends, dtype=np.int64)
+    if not len(lo):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty, empty
+
+    reach = np.maximum.accumulate(hi)               # furthest end so far
+    first = np.empty(len(lo), dtype=bool)           # exon opens a block
+    first[0] = True
+    first[1:] = lo[1:] > reach[:-1]
+    blockOf = np.cumsum(first) - 1
+    firsts = np.flatnonzero(first)
+    blockLo = lo[firsts]
+    blockHi = reach[np.append(firsts[1:] - 1, len(lo) - 1)]
+    width = blockHi - blockLo + 1
+    if intronScale is None:
+        right = np.cumsum(width) + offset
+    else:
+        gaps = np.zeros(len(width), dtype=np.int64)
+        gaps[1:] = np.rint((blockLo[1:] - blockHi[:-1] - 1) * intronScale)
+        right = np.cumsum(width + gaps) + offset
+    adjStart = lo - blockLo[blockOf] + (right - width)[blockOf]
+    if reverse:
+        return blockOf, adjStart, -blockLo, -blockHi, right
+    return blockOf, adjStart, blockLo, blockHi, right
 
-    while exonIx < len(exonList):               # can't use enumerate here, it's a double loop
 
-        blockStart = exonList[exonIx].start     # block start = start of first exon in block
-        blockEnd = exonList[exonIx].end       # initial value, updated in the loop below
+def placeExons(opt, exonList, reverse):
+    '''
+    Sort exonList in place, by ascending start (decreasing end if
+    reverse), and assign the exons to blocks and x coordinates; returns
+    the Blocks.
+    '''
 
-        while exonIx < len(exonList) and exonList[exonIx].start <= blockEnd:
-            myExon = exonList[exonIx]
-            if myExon.end > blockEnd:
-                blockEnd = myExon.end
-            myExon.block = blockNo
-            myExon.tran.blocks.add(blockNo)    # transcript has an exon in this block
-            myExon.adjStart = myExon.start - blockStart + adjust
-            exonIx += 1
+    starts = np.array([myExon.start for myExon in exonList], dtype=np.int64)
+    ends = np.array([myExon.end for myExon in exonList], dtype=np.int64)
+    order = np.argsort(-ends if reverse else starts, kind='mergesort')     # stable, as list.sort
+    exonList[:] = [exonList[ix] for ix in order.tolist()]
+    blockOf, adjStart, blockStart, blockEnd, boundary = blockLayout(starts[order], ends[order],
+                                                                    reverse, opt.intronScale)
+    for myExon, blockNo, x in izip(exonList, blockOf.tolist(), adjStart.tolist()):
+        myExon.block = blockNo
+        myExon.tran.blocks.add(blockNo)    # transcript has an exon in this block
+        myExon.adjStart = x
+    return [Block(start, end, right) for start, end, right in
+            zip(blockStart.tolist(), blockEnd.tolist(), boundary.tolist())]
 
-        adjust += blockEnd - blockStart + 1
-        blocks.append(Block(blockStart, blockEnd, adjust))
-        blockNo += 1
 
-    return blocks
+def assignBlocks(opt, exonList):
+    '''
+    Assign exons to blocks, separated by sequence which is intronic in
+    all transcripts. exonList is sorted by ascending start position.
+    '''
+    return placeExons(opt, exonList, False)
 
 
 def assignBlocksReverse(opt, exonList):
     # Like assignblocks, but for the reverse strand, ordering blocks
-    # from the 5' end of the transcript. exonList is assumed to be
-    # sorted by decreasing exon end position.
-
-    # I did this as a separate mirror image of assignBlocks, rather
-    # than clutter the scenery with lots of forward/reverse checks.
-
-    adjust = 0
-    blockNo = 0
-    exonIx = 0
-    blocks = list()
-
-    while exonIx < len(exonList):               # can't use enumerate here, it's a double loop
-
-        blockStart = exonList[exonIx].end       # block start = end of last exon in block
-        blockEnd = exonList[exonIx].start     # initial value, updated in the loop below
-
-        while exonIx < len(exonList) and exonList[exonIx].end >= blockEnd:
-
-            myExon = exonList[exonIx]
-            if myExon.start < blockEnd:
-                blockEnd = myExon.start
-            myExon.block = blockNo
-            myExon.tran.blocks.add(blockNo)    # transcript has an exon in this block
-            myExon.adjStart = blockStart - myExon.end + adjust
-            exonIx += 1
-
-        adjust += blockStart - blockEnd + 1
-        blocks.append(Block(blockStart, blockEnd, adjust))
-        blockNo += 1
-
-    return blocks
-
-
-def annotationBlocks(exonList):
-    # Assign exons to blocks, separated by sequence which is intronic in
-    # all transcripts. exonList is assumed to be sorted by ascending
-    # start position.
-
-    annotExons = list()
-    for e in exonList:
-        if e.tran.annot is True:
-            annotExons.append(e)
-
-    adjust = annotExons[0].adjStart
-    blockNo = 0
-    exonIx = 0
-    blocks = list()
-
-    while exonIx < len(annotExons):               # can't use enumerate here, it's a double loop
-
-        blockStart = annotExons[exonIx].start     # block start = start of first exon in block
-        blockEnd = annotExons[exonIx].end       # initial value, updated in the loop below
-
-        while exonIx < len(annotExons) and annotExons[exonIx].start <= blockEnd:
-            myExon = annotExons[exonIx]
-            if myExon.end > blockEnd:
-                blockEnd = myExon.end
-            exonIx += 1
-
-        adjust += blockEnd - blockStart + 1
-        blocks.append(Block(blockStart, blockEnd, adjust))
-        blockNo += 1
+    # from the 5' end of the transcript. exonList is sorted by
+    # decreasing exon end position.
+    return placeExons(opt, exonList, True)
 
-    return blocks
 
+def annotationBlocks(exonList, reverse=False, intronScale=None):
+    # Blocks of the annotation exons alone, laid out from the x of the
+    # first one. exonList is sorted as for assignBlocks (or
+    # assignBlocksReverse if reverse) and already placed.
 
-def annotationBlocksReverse(exonList):
-    annotExons = list()
-    for e in exonList:
-        if e.tran.annot is True:
-            annotExons.append(e)
-    adjust = annotExons[0].adjStart
-    blockNo = 0
-    exonIx = 0
-    blocks = list()
-    while exonIx < len(annotExons):               # can't use enumerate here, it's a double loop
+    annotExons = [e for e in exonList if e.tran.annot is True]
+    blockOf, adjStart, blockStart, blockEnd, boundary = blockLayout(
+        [e.start for e in annotExons], [e.end for e in annotExons],
+        reverse, intronScale, offset=annotExons[0].adjStart)
+    return [Block(start, end, right) for start, end, right in
+            zip(blockStart.tolist(), blockEnd.tolist(), boundary.tolist())]
 
-        blockStart = annotExons[exonIx].end     # block start = start of first exon in block
-        blockEnd = annotExons[exonIx].start       # initial value, updated in the loop below
 
-        while exonIx < len(annotExons) and annotExons[exonIx].end >= blockEnd:
-            myExon = annotExons[exonIx]
-            if myExon.start < blockEnd:
-                blockEnd = myExon.start
-            exonIx += 1
-
-        adjust += blockStart - blockEnd + 1
-        blocks.append(Block(blockStart, blockEnd, adjust))
-        blockNo += 1
-    return blocks
+def annotationBlocksReverse(exonList, intronScale=None):
+    return annotationBlocks(exonList, True, intronScale)
 
 
 def findRegions(tranList):
@@ -294,8 +600,8 @@ def findRegions(tranList):
     breaks = list()
     for tranIx, tran in enumerate(tranList):
         for exon in tran.exons:
-            breaks.append([exon.start, 0, tranIx, tran.name, exon.name])
-            breaks.append([exon.end, 1, tranIx, tran.name, exon.name])
+            breaks.append([exon.start, 0, tranIx])
+            breaks.append([exon.end, 1, tranIx])
 
     breaks.sort(key=lambda x: x[0])
     curPos = breaks[0][0]
@@ -303,7 +609,7 @@ def findRegions(tranList):
     region = 0
 
     for ix in xrange(len(breaks)):
-        posit, flag, tranIx, tranName, exonName = breaks[ix]
+        posit, flag, tranIx = breaks[ix]
         if posit > curPos + MIN_REGION_SIZE:             # this is a new region
             if len(curTranSet) > 0:
                 for ix in curTranSet:
@@ -376,7 +682,9 @@ def writeFasta(opt, cluster):
     if match is None:
         raise RuntimeError('cannot find cluster ID in %s' % cluster.name)
 
-    if cluster.strand == '+':     # Cluster object includes bases in forward strand sense
+    if cluster.bases is None:     # sequences were moved to the sidecar at load time
+        bases = opt.seqStores[cluster.source[1]].fetch(cluster.name, reverse=cluster.strand != '+')
+    elif cluster.strand == '+':     # Cluster object includes bases in forward strand sense
         bases = cluster.bases
     else:
         bases = cluster.bases[::-1].translate(COMPLTAB)     # fasta file wants them in read sense
@@ -391,11 +699,16 @@ def writeFasta(opt, cluster):
     handle.close()
 
 
-def groupTran(tranList, exonList, cluster_num):
+def groupTran(tranList, exonList, cluster_num, checkpoint=None, approxAbove=None):
     """
-    Group transcripts by exon/intron similarities.
+    Group transcripts by exon/intron similarities. checkpoint, if given,
+    is called once per row of the distance matrix and may raise to stop.
+    Above approxAbove isoforms, groupTranApprox is used instead.
     """
 
+    import pandas as pd
+    from sklearn.cluster import KMeans
+
     # minVal is the minimum starting point of all the transcripts,
     # maxVal stands for maximum
     maxVal = 0
@@ -410,6 +723,8 @@ def groupTran(tranList, exonList, cluster_num):
             matchTran.append(tran)
     if len(matchTran) == 0:
         return None
+    if approxAbove is not None and len(matchTran) > approxAbove:
+        return groupTranApprox(matchTran, cluster_num, checkpoint=checkpoint)
     df = pd.DataFrame(data=matchTran, columns=['tran'])
     df['min'] = minVal
     df['max'] = maxVal
@@ -448,6 +763,8 @@ def groupTran(tranList, exonList, cluster_num):
     length = len(df)
     matrix = np.full((length, length), 0.0)
     for cur_index in range(1, length):
+        if checkpoint is not None:
+            checkpoint()
         matrix[cur_index][0:cur_index] = [calcDis(df, cur_index, i) for i in range(cur_index)]
     matrix = matrix + matrix.T
 
@@ -472,6 +789,76 @@ def groupTran(tranList, exonList, cluster_num):
     return colorDF
 
 
+def groupTranApprox(matchTran, cluster_num, landmarks=APPROX_LANDMARKS, checkpoint=None):
+    """
+    Group transcripts like groupTran, in memory linear in their number:
+    instead of the n x n distance table, K-Means gets the distances to
+    a few landmark transcripts.
+    """
+
+    # The distance is the one calcDis computes, the Jaccard distance
+    # between the sets of bases covered, but evaluated on a sparse
+    # occupancy matrix: rows are transcripts, columns the elementary
+    # intervals between consecutive exon boundaries, weighted by their
+    # length. Landmarks are picked farthest-first, so that every distinct
+    # structure is close to one of them.
+
+    import pandas as pd
+    from scipy import sparse
+    from sklearn.cluster import KMeans
+
+    starts = list()
+    ends = list()
+    for tran in matchTran:
+        for exon in tran.exons:
+            starts.append(exon.start)
+            ends.append(exon.end + 1)           # half-open intervals
+    bounds = np.unique(np.array(starts + ends, dtype=np.int64))
+    weights = np.diff(bounds).astype(np.float64)
+
+    indptr = [0]
+    indices = list()
+    for tran in matchTran:
+        cols = set()
+        for exon in tran.exons:
+            first = np.searchsorted(bounds, exon.start)
+            last = np.searchsorted(bounds, exon.end + 1)
+            cols.update(xrange(first, last))
+        indices.extend(sorted(cols))
+        indptr.append(len(indices))
+    occupancy = sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+                                  shape=(len(matchTran), len(weights)))
+    weighted = occupancy.multiply(weights).tocsr()          # bases of each interval a transcript covers
+    lengths = np.asarray(weighted.sum(axis=1)).ravel()
+
+    def distances(ix):
+        # distance of every transcript to transcript ix
+        overlap = weighted.dot(occupancy.getrow(ix).T).toarray().ravel()
+        return 1.0 - overlap / np.maximum(lengths + lengths[ix] - overlap, 1.0)
+
+    landmarks = min(landmarks, len(matchTran))
+    features = np.empty((len(matchTran), landmarks))
+    nearest = np.full(len(matchTran), np.inf)
+    landmark = 0                                # the best supported transcript comes first
+    for col in xrange(landmarks):
+        if checkpoint is not None:
+            checkpoint()
+        features[:, col] = distances(landmark)
+        nearest = np.minimum(nearest, features[:, col])
+        landmark = int(np.argmax(nearest))      # farthest from all landmarks so far
+
+    colorDF = pd.DataFrame()
+    colorDF['name'] = [tran.name for tran in matchTran]
+    if len(colorDF) < cluster_num:
+        cluster_num = len(colorDF)
+    for i in range(cluster_num):
+        group = KMeans(n_clusters=i + 1).fit_predict(features)
+        groupName = 'group%s' % str(i + 1)
+        colorDF[groupName] = group
+
+    return colorDF
+
+
 # functions that are applied by pandas dataframe
 def getExon(row):
     startEnd = list()
@@ -542,6 +929,13 @@ def getClustersForGene(clusterDict, gene):
 class Transcript (object):
     '''Just a struct actually, containing data about a transcript.'''
 
+    # __slots__ keeps per-instance memory down when many genes are
+    # materialized. startcodon/stopcodon are only set for annotations
+    # that have them, so hasattr() still tells whether they exist.
+    __slots__ = ('name', 'score', 'annot', 'tranIx', 'full', 'partial', 'start', 'end',
+                 'ID', 'exons', 'blocks', 'regions', 'chr', 'source', 'samples',
+                 'startcodon', 'stopcodon')
+
     def __init__(self, name, start=None, end=None, score=None, full=None,
                  partial=None, annot=False, ID=None, chr=None, source=None):
 
@@ -559,6 +953,7 @@ class Transcript (object):
         self.regions = set()        # regions where this transcript has exon(s)
         self.chr = chr
         self.source = source
+        self.samples = None         # collapsed rows: match file index -> [full, partial]
         # What's the difference between a block and a region? Every
         # exon boundary defines a new region. A new block occurs only
         # when exon coverage transitions from 0 to >0. The example
@@ -578,10 +973,18 @@ class Transcript (object):
 class Exon (object):
     '''Struct containing data about an exon.'''
 
-    def __init__(self, tran, name, start, end, strand, QScore=None):
+    # Cluster exons have no names of their own; rather than formatting
+    # one per exon up front, pass number and the name is made up from
+    # the transcript name when asked for. polyAs is only set when the
+    # annotation has it.
+    __slots__ = ('tran', 'number', '_name', 'start', 'end', 'strand', 'QScore', 'block',
+                 'adjStart', 'leading', 'trailing', 'polyAs', 'novelStart', 'novelEnd')
+
+    def __init__(self, tran, name, start, end, strand, QScore=None, number=None):
 
         self.tran = tran            # Transcript object containing this exon
-        self.name = name
+        self._name = name
+        self.number = number        # position of the exon in its transcript, for made-up names
         self.start = start
         self.end = end
         self.strand = strand
@@ -590,6 +993,18 @@ class Exon (object):
         self.adjStart = None        # start of exon in phony x-axis coordinates
         self.leading = 0            # number of leading softclipped bases
         self.trailing = 0           # number of trailing softclipped bases
+        self.novelStart = False     # start is the acceptor of a junction missing from the annotation
+        self.novelEnd = False       # end is the donor of a junction missing from the annotation
+
+    @property
+    def name(self):
+        if self._name is None:
+            return '%s/%d' % (self.tran.name, self.number)
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
 
 
 class Block (object):
@@ -602,6 +1017,10 @@ class Block (object):
 
     # one implication of that scheme is that the x axis of the plot is
     # meaningless: it represents neither genomic nor RNA sequence range.
+    # With opt.intronScale the separators get a width proportional to
+    # the intron, so distances across blocks mean something again.
+
+    __slots__ = ('start', 'end', 'boundary', 'annot')
 
     def __init__(self, start, end, boundary):
 
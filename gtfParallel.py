@@ -0,0 +1,369 @@
+'''
+Parallel loading of a GTF annotation (--anno-format parallel).
+
+The file is cut at chromosome boundaries, found by binary search over
+byte offsets, and each part is parsed on a process pool into compact
+tables: one row per gene, transcript and exon, in numpy arrays. The
+parent merges the tables into an AnnotationList that answers like
+MatchAnnot's: getGeneDict() maps gene names to gene objects whose
+getChildren() are transcripts, whose children are exons. Transcripts and
+exons are only made into objects when a gene is first looked at.
+
+    python gtfParallel.py gencode.v25.annotation.gtf --processes 8
+'''
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+import workerPool
+
+PROBE_STEP = 1 << 20            # bytes: first step of the search for the end of a chromosome
+FEATURES = ('gene', 'transcript', 'exon', 'start_codon', 'stop_codon')
+
+
+def lineAt(handle, offset):
+    '''(start, chromosome) of the first data line starting at or after offset;
+       chromosome is None at the end of the file.'''
+
+    if offset > 0:
+        handle.seek(offset - 1)
+        handle.readline()                   # rest of the line holding offset - 1
+    else:
+        handle.seek(0)
+    while True:
+        start = handle.tell()
+        line = handle.readline()
+        if not line:
+            return start, None
+        if not line.startswith('#'):
+            return start, line.split('\t', 1)[0]
+
+
+def chromosomeEnd(handle, offset, chromosome, size):
+    '''Offset of the first line after offset that is not on chromosome
+       (lines of a chromosome being together).'''
+
+    # Double the step until past the chromosome, then bisect.
+    lo = offset
+    step = PROBE_STEP
+    while True:
+        hi = min(lo + step, size)
+        start, found = lineAt(handle, hi)
+        if found != chromosome:
+            break
+        if hi == size:
+            return size
+        lo = hi
+        step *= 2
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if lineAt(handle, mid)[1] == chromosome:
+            lo = mid
+        else:
+            hi = mid
+    return lineAt(handle, hi)[0]
+
+
+def partitions(fileName, count):
+    '''
+    Byte ranges of fileName, about count of them, each holding whole
+    chromosomes. Fewer when chromosomes are larger than size / count.
+    '''
+
+    size = os.path.getsize(fileName)
+    bounds = [0]
+    with open(fileName, 'rb') as handle:
+        for ix in xrange(1, count):
+            target = max(size * ix // count, bounds[-1])
+            start, chromosome = lineAt(handle, target)
+            if chromosome is None:
+                break
+            end = chromosomeEnd(handle, start, chromosome, size)
+            if end > bounds[-1] and end < size:
+                bounds.append(end)
+    bounds.append(size)
+    return zip(bounds[:-1], bounds[1:])
+
+
+def attribute(text, key, default=None):
+    '''
+    Value of key in a GTF attribute column, quoted (key "value";) or not
+    (exon_number 3; in GENCODE). text starts with a space, so that every
+    key follows one.
+    '''
+
+    ix = text.find(' %s ' % key)
+    if ix < 0:
+        return default
+    ix += len(key) + 2
+    if text.startswith('"', ix):
+        return text[ix + 1:text.index('"', ix + 1)]
+    end = text.find(';', ix)
+    return text[ix:end if end >= 0 else len(text)].strip()
+
+
+class Tables (object):
+    '''Genes, transcripts and exons of part of a GTF file, as columns.'''
+
+    def __init__(self):
+
+        self.chromosomes = list()
+        self.geneChr = list()
+        self.geneStart = list()
+        self.geneEnd = list()
+        self.geneStrand = list()
+        self.geneName = list()
+        self.geneID = list()
+        self.tranGene = list()
+        self.tranStart = list()
+        self.tranEnd = list()
+        self.tranName = list()
+        self.tranID = list()
+        self.startCodon = list()            # -1 where there is none
+        self.stopCodon = list()
+        self.exonTran = list()
+        self.exonStart = list()
+        self.exonEnd = list()
+        self.exonNumber = list()
+
+    def compact(self):
+        '''Turn the numeric columns into numpy arrays, quicker to send between processes.'''
+
+        for name, dtype in (('geneChr', np.int32), ('geneStart', np.int64), ('geneEnd', np.int64),
+                            ('tranGene', np.int64), ('tranStart', np.int64), ('tranEnd', np.int64),
+                            ('startCodon', np.int64), ('stopCodon', np.int64), ('exonTran', np.int64),
+                            ('exonStart', np.int64), ('exonEnd', np.int64), ('exonNumber', np.int32)):
+            setattr(self, name, np.array(getattr(self, name), dtype=dtype))
+        return self
+
+    def __len__(self):
+        return len(self.geneName)
+
+
+def parsePartition(job):
+    '''Parse a byte range of a GTF file into Tables; runs in a worker process.'''
+
+    fileName, start, end = job
+    tables = Tables()
+    chrIx = dict()
+    genes = dict()                          # gene_id -> row, on the current chromosome
+    trans = dict()                          # transcript_id -> row
+    chromosome = None
+
+    def geneRow(fields, attrs):
+        geneID = attribute(attrs, 'gene_id')
+        row = genes.get(geneID)
+        if row is None:                     # no gene line (before this one): make it
+            row = genes[geneID] = len(tables.geneName)
+            tables.geneChr.append(chrIx[chromosome])
+            tables.geneStart.append(int(fields[3]))
+            tables.geneEnd.append(int(fields[4]))
+            tables.geneStrand.append(fields[6])
+            tables.geneName.append(attribute(attrs, 'gene_name', geneID))
+            tables.geneID.append(geneID)
+        return row
+
+    def tranRow(fields, attrs):
+        tranID = attribute(attrs, 'transcript_id')
+        row = trans.get(tranID)
+        if row is None:
+            row = trans[tranID] = len(tables.tranName)
+            tables.tranGene.append(geneRow(fields, attrs))
+            tables.tranStart.append(int(fields[3]))
+            tables.tranEnd.append(int(fields[4]))
+            tables.tranName.append(attribute(attrs, 'transcript_name', tranID))
+            tables.tranID.append(tranID)
+            tables.startCodon.append(-1)
+            tables.stopCodon.append(-1)
+        return row
+
+    with open(fileName, 'rb') as handle:
+        handle.seek(start)
+        remaining = end - start
+        for line in handle:
+            remaining -= len(line)
+            if remaining < 0:
+                break
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            feature = fields[2]
+            if feature not in FEATURES:     # CDS, UTR, Selenocysteine...
+                continue
+            if fields[0] != chromosome:
+                chromosome = fields[0]
+                if chromosome not in chrIx:
+                    chrIx[chromosome] = len(tables.chromosomes)
+                    tables.chromosomes.append(chromosome)
+                genes.clear()               # ids may repeat on chrY's PAR copies
+                trans.clear()
+            attrs = ' ' + fields[8]
+            if feature == 'gene':
+                genes.pop(attribute(attrs, 'gene_id'), None)
+                geneRow(fields, attrs)
+            elif feature == 'transcript':
+                trans.pop(attribute(attrs, 'transcript_id'), None)
+                tranRow(fields, attrs)
+            else:
+                row = tranRow(fields, attrs)
+                first, last = int(fields[3]), int(fields[4])
+                if feature == 'exon':
+                    tables.exonTran.append(row)
+                    tables.exonStart.append(first)
+                    tables.exonEnd.append(last)
+                    tables.exonNumber.append(int(attribute(attrs, 'exon_number', 0)))
+                    tables.tranStart[row] = min(tables.tranStart[row], first)   # for transcripts made up from exons
+                    tables.tranEnd[row] = max(tables.tranEnd[row], last)
+                else:                       # codon position: its first base along the transcript
+                    position = first if fields[6] == '+' else last
+                    column = tables.startCodon if feature == 'start_codon' else tables.stopCodon
+                    if column[row] < 0:
+                        column[row] = position
+    return tables.compact()
+
+
+def merge(partList):
+    '''One Tables from the Tables of consecutive parts of a file.'''
+
+    merged = Tables()
+    geneOffset = tranOffset = 0
+    for part in partList:
+        chrOffset = len(merged.chromosomes)
+        merged.chromosomes.extend(part.chromosomes)
+        merged.geneChr.append(part.geneChr + chrOffset)
+        merged.tranGene.append(part.tranGene + geneOffset)
+        merged.exonTran.append(part.exonTran + tranOffset)
+        for name in ('geneStart', 'geneEnd', 'tranStart', 'tranEnd', 'startCodon', 'stopCodon',
+                     'exonStart', 'exonEnd', 'exonNumber'):
+            getattr(merged, name).append(getattr(part, name))
+        for name in ('geneStrand', 'geneName', 'geneID', 'tranName', 'tranID'):
+            getattr(merged, name).extend(getattr(part, name))
+        geneOffset += len(part.geneName)
+        tranOffset += len(part.tranName)
+    for name in ('geneChr', 'geneStart', 'geneEnd', 'tranGene', 'tranStart', 'tranEnd', 'startCodon',
+                 'stopCodon', 'exonTran', 'exonStart', 'exonEnd', 'exonNumber'):
+        columns = getattr(merged, name)
+        setattr(merged, name, np.concatenate(columns) if columns else np.zeros(0, dtype=np.int64))
+    return merged
+
+
+def groupOffsets(keys, count):
+    '''Rows of keys grouped by key, keeping their order: (order, offsets),
+       rows of key k being order[offsets[k]:offsets[k + 1]].'''
+
+    order = np.argsort(keys, kind='mergesort')
+    offsets = np.searchsorted(keys[order], np.arange(count + 1))
+    return order, offsets
+
+
+class Feature (object):
+    '''A gene, transcript or exon, with the attributes of a MatchAnnot Annotation.'''
+
+    __slots__ = ('name', 'ID', 'chr', 'start', 'end', 'strand', 'children', 'startcodon', 'stopcodon')
+
+    def __init__(self, name, ID, chr, start, end, strand, children=None):
+        self.name = name
+        self.ID = ID
+        self.chr = chr
+        self.start = start
+        self.end = end
+        self.strand = strand
+        self.children = children
+
+    def getChildren(self):
+        return self.children
+
+
+class Gene (Feature):
+    '''A gene whose transcripts are built from the tables when first asked for.'''
+
+    __slots__ = ('annotList', 'row')
+
+    def getChildren(self):
+        if self.children is None:
+            self.children = self.annotList.transcripts(self)
+        return self.children
+
+
+class AnnotationList (object):
+    '''Stands in for a MatchAnnot AnnotationList, built from merged Tables.'''
+
+    def __init__(self, tables, fileName=None):
+
+        self.fileName = fileName
+        self.tables = tables
+        self.tranOrder, self.tranOffsets = groupOffsets(tables.tranGene, len(tables.geneName))
+        self.exonOrder, self.exonOffsets = groupOffsets(tables.exonTran, len(tables.tranName))
+        self.geneDict = dict()
+        for row in xrange(len(tables.geneName)):
+            gene = Gene(tables.geneName[row], tables.geneID[row], tables.chromosomes[tables.geneChr[row]],
+                        int(tables.geneStart[row]), int(tables.geneEnd[row]), tables.geneStrand[row])
+            gene.annotList = self
+            gene.row = row
+            self.geneDict.setdefault(gene.name, list()).append(gene)
+
+    def getGeneDict(self):
+        return self.geneDict
+
+    def transcripts(self, gene):
+        '''Transcript and exon objects of a gene.'''
+
+        tables = self.tables
+        tranList = list()
+        for tranRow in self.tranOrder[self.tranOffsets[gene.row]:self.tranOffsets[gene.row + 1]]:
+            tran = Feature(tables.tranName[tranRow], tables.tranID[tranRow], gene.chr,
+                           int(tables.tranStart[tranRow]), int(tables.tranEnd[tranRow]), gene.strand, list())
+            for attr, column in (('startcodon', tables.startCodon), ('stopcodon', tables.stopCodon)):
+                if column[tranRow] >= 0:            # only transcripts with codons have the attribute
+                    setattr(tran, attr, int(column[tranRow]))
+            for exonRow in self.exonOrder[self.exonOffsets[tranRow]:self.exonOffsets[tranRow + 1]]:
+                number = tables.exonNumber[exonRow] or len(tran.children) + 1
+                tran.children.append(Feature('%s/%d' % (tran.name, number), None, gene.chr,
+                                             int(tables.exonStart[exonRow]), int(tables.exonEnd[exonRow]),
+                                             gene.strand))
+            tranList.append(tran)
+        return tranList
+
+
+def loadAnnotations(fileName, processes=None):
+    '''AnnotationList of a GTF file, parsed in processes parts on worker
+       processes (default: one per CPU; see workerPool).'''
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    jobs = [(fileName, start, end) for start, end in partitions(fileName, max(1, processes))]
+    partList = workerPool.map(parsePartition, jobs, processes)
+
+    # Parts hold whole chromosomes only if the file keeps the lines of
+    # each chromosome together, as GENCODE and Ensembl do. Otherwise a
+    # transcript may have been cut in two: parse the file in one go.
+    seen = set()
+    for part in partList:
+        if seen.intersection(part.chromosomes):
+            partList = [parsePartition((fileName, 0, os.path.getsize(fileName)))]
+            break
+        seen.update(part.chromosomes)
+    return AnnotationList(merge(partList), fileName)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Time parallel loading of a GTF file.')
+    parser.add_argument('gtf', help='annotation file (GTF)')
+    parser.add_argument('--processes', type=int, help='worker processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    annotList = loadAnnotations(args.gtf, args.processes)
+    seconds = time.time() - t0
+    tables = annotList.tables
+    print '%d genes, %d transcripts, %d exons on %d chromosomes in %.2f s' % (
+        len(tables.geneName), len(tables.tranName), len(tables.exonStart), len(tables.chromosomes), seconds)
+
+
+if __name__ == '__main__':
+    main()
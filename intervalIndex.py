@@ -0,0 +1,140 @@
+# Linear scan cutoff: subtrees of height <= LINEAR_LEVEL are scanned
+# directly instead of being descended node by node.
+LINEAR_LEVEL = 3
+
+
+class IntervalIndex (object):
+    '''
+    Per-chromosome index of closed genomic intervals [start, end],
+    answering overlap queries in O(log n + k).
+    '''
+
+    # Each chromosome keeps its intervals in an array sorted by start
+    # position. The sorted array doubles as an implicit binary search
+    # tree (the root is the element at index 2^K - 1, leaves sit at
+    # even indices) and every node is augmented with the maximum end
+    # position found in its subtree. A query walks down the tree and
+    # prunes any subtree whose max end lies left of the query. This is
+    # the layout used by cgranges/IITree, which needs no pointers and
+    # only one extra integer per interval.
+
+    def __init__(self):
+
+        self.chroms = dict()        # chromosome -> _ChromIntervals
+        self.indexed = True
+
+    def add(self, chrom, start, end, item):
+        '''Add an interval, carrying an arbitrary payload.'''
+
+        if chrom not in self.chroms:
+            self.chroms[chrom] = _ChromIntervals()
+        self.chroms[chrom].add(start, end, item)
+        self.indexed = False
+
+    def index(self):
+        '''Sort and augment every chromosome. Must be called before overlap().'''
+
+        for chromIntervals in self.chroms.itervalues():
+            chromIntervals.index()
+        self.indexed = True
+        return self
+
+    def overlap(self, chrom, start, end):
+        '''Return payloads of intervals overlapping [start, end], sorted by start.'''
+
+        if not self.indexed:
+            self.index()
+        if chrom not in self.chroms:
+            return list()
+        return self.chroms[chrom].overlap(start, end)
+
+    def chromosomes(self):
+        return sorted(self.chroms.keys())
+
+    def __len__(self):
+        return sum(len(ci.starts) for ci in self.chroms.itervalues())
+
+
+class _ChromIntervals (object):
+    '''Intervals on one chromosome, stored as parallel sorted lists.'''
+
+    def __init__(self):
+
+        self.starts = list()
+        self.ends = list()
+        self.items = list()
+        self.maxEnds = list()       # max end position in each node's subtree
+        self.rootLevel = -1
+
+    def add(self, start, end, item):
+
+        self.starts.append(start)
+        self.ends.append(end)
+        self.items.append(item)
+
+    def index(self):
+
+        order = sorted(xrange(len(self.starts)), key=lambda ix: self.starts[ix])
+        self.starts = [self.starts[ix] for ix in order]
+        self.ends = [self.ends[ix] for ix in order]
+        self.items = [self.items[ix] for ix in order]
+        self.maxEnds = list(self.ends)
+
+        n = len(self.starts)
+        if n == 0:
+            self.rootLevel = -1
+            return
+
+        # leaves: every even index is a leaf, its max end is its own end
+        for ix in xrange(0, n, 2):
+            lastIx = ix
+            last = self.maxEnds[ix]
+
+        # internal nodes, one tree level at a time
+        level = 1
+        while 1 << level <= n:
+            half = 1 << (level - 1)
+            for ix in xrange((half << 1) - 1, n, half << 2):
+                left = self.maxEnds[ix - half]
+                right = self.maxEnds[ix + half] if ix + half < n else last
+                self.maxEnds[ix] = max(self.ends[ix], left, right)
+            # track the rightmost node at this level; its right subtree may be missing
+            lastIx = lastIx - half if (lastIx >> level) & 1 else lastIx + half
+            if lastIx < n and self.maxEnds[lastIx] > last:
+                last = self.maxEnds[lastIx]
+            level += 1
+
+        self.rootLevel = level - 1
+
+    def overlap(self, start, end):
+
+        n = len(self.starts)
+        hits = list()
+        if n == 0:
+            return hits
+
+        # stack entries: (level, node index, left child already visited?)
+        stack = [(self.rootLevel, (1 << self.rootLevel) - 1, False)]
+        while stack:
+            level, ix, leftDone = stack.pop()
+            if level <= LINEAR_LEVEL:
+                # small subtree: plain scan, stopping once starts pass the query
+                lo = ix >> level << level
+                hi = min(lo + (1 << (level + 1)) - 1, n)
+                jx = lo
+                while jx < hi and self.starts[jx] <= end:
+                    if self.ends[jx] >= start:
+                        hits.append(jx)
+                    jx += 1
+            elif not leftDone:
+                stack.append((level, ix, True))
+                child = ix - (1 << (level - 1))
+                if child >= n or self.maxEnds[child] >= start:
+                    stack.append((level - 1, child, False))
+            elif ix < n and self.starts[ix] <= end:
+                if self.ends[ix] >= start:
+                    hits.append(ix)
+                stack.append((level - 1, ix + (1 << (level - 1)), False))
+
+        hits.sort()
+        return [self.items[ix] for ix in hits]
@@ -0,0 +1,111 @@
+import numpy as np
+
+# Splice junctions, as (donor, acceptor) = (end of one exon, start of the
+# next) in genomic order. A junction is packed into one int64 so sets of
+# junctions are plain sorted arrays and membership is a searchsorted.
+
+EMPTY = np.zeros(0, dtype=np.int64)
+
+
+def encode(donors, acceptors):
+    '''Pack donor/acceptor coordinates into int64 keys.'''
+
+    return (np.asarray(donors, dtype=np.int64) << 32) | np.asarray(acceptors, dtype=np.int64)
+
+
+def exonJunctions(exons):
+    '''(donor, acceptor) pairs between consecutive exons, in genomic order.'''
+
+    exons = sorted(exons, key=lambda exon: exon.start)
+    return [(exons[ix].end, exons[ix + 1].start) for ix in xrange(len(exons) - 1)]
+
+
+def junctionKeys(exonLists):
+    '''Sorted, distinct junction keys of several exon lists.'''
+
+    pairs = [pair for exons in exonLists for pair in exonJunctions(exons)]
+    if not pairs:
+        return EMPTY
+    donors, acceptors = zip(*pairs)
+    return np.unique(encode(donors, acceptors))
+
+
+def isKnown(known, keys):
+    '''Boolean array: which of keys are in the sorted array known.'''
+
+    keys = np.asarray(keys, dtype=np.int64)
+    if len(known) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    ix = np.searchsorted(known, keys)
+    ix[ix == len(known)] = 0
+    return known[ix] == keys
+
+
+class JunctionTable (object):
+    '''Annotated junctions of one gene (or region).'''
+
+    def __init__(self, known=EMPTY):
+        self.known = known          # sorted int64 junction keys
+
+    @classmethod
+    def fromTranscripts(cls, tranList):
+        return cls(junctionKeys([tran.exons for tran in tranList if tran.annot]))
+
+    def __len__(self):
+        return len(self.known)
+
+    def markNovel(self, tranList):
+        '''
+        Flag the exon boundaries of cluster transcripts which take part in
+        a junction missing from the annotation (exon.novelEnd for the
+        donor side, exon.novelStart for the acceptor side). Returns the
+        number of distinct novel junctions.
+        '''
+
+        donorExons = list()
+        acceptorExons = list()
+        donors = list()
+        acceptors = list()
+        for tran in tranList:
+            if tran.annot:
+                continue
+            exons = sorted(tran.exons, key=lambda exon: exon.start)
+            for ix in xrange(len(exons) - 1):
+                donorExons.append(exons[ix])
+                acceptorExons.append(exons[ix + 1])
+                donors.append(exons[ix].end)
+                acceptors.append(exons[ix + 1].start)
+        if not donors:
+            return 0
+
+        keys = encode(donors, acceptors)
+        novel = ~isKnown(self.known, keys)          # one vectorized test for the whole gene
+        for ix in np.flatnonzero(novel):
+            donorExons[ix].novelEnd = True
+            acceptorExons[ix].novelStart = True
+        return len(np.unique(keys[novel]))
+
+
+def novelJunctionCounts(annotList, clusterDicts):
+    '''
+    Genome-wide precompute for the gene table: gene name -> number of
+    distinct cluster junctions (over all match files) missing from the
+    annotation of that gene.
+    '''
+
+    annotGenes = annotList.getGeneDict() if annotList is not None else dict()
+    clusterGenes = dict()           # gene -> list of exon lists
+    for clusterDict in clusterDicts:
+        for gene, clusters in clusterDict.getGeneDict().iteritems():
+            exonLists = clusterGenes.setdefault(gene, list())
+            exonLists.extend(list(cluster.cigar.exons()) for cluster in clusters)
+
+    counts = dict()
+    for gene, exonLists in clusterGenes.iteritems():
+        keys = junctionKeys(exonLists)
+        known = EMPTY
+        if gene in annotGenes:
+            known = junctionKeys([tran.getChildren() for myGene in annotGenes[gene]
+                                  for tran in myGene.getChildren()])
+        counts[gene] = int(np.count_nonzero(~isKnown(known, keys)))
+    return counts
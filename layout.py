@@ -0,0 +1,237 @@
+'''
+Layout of one gene: the transcripts, blocks, ordering, groups and plot
+columns that updateGene shows. Computed from the loaded annotation and
+match files without touching the Bokeh document, so it can also run
+ahead of time on a background thread (see prefetch.py).
+'''
+
+import copy
+
+import numpy as np
+
+import getGene
+import junctions
+import overlay
+import plotData
+import readCoverage
+import timing
+
+
+class Cancelled (Exception):
+    '''Raised inside computeLayout when its result is no longer wanted.'''
+    pass
+
+
+class Layout (object):
+    '''Plot data of one gene, ready to be assigned to the ColumnDataSources.'''
+
+    def __init__(self, gene):
+
+        self.gene = gene
+        self.messages = list()      # genes not found in the annotation or match files
+        self.tranList = None
+        self.exonList = None
+        self.blocks = None
+        self.tranNames = None
+        self.tranNum = 0
+        self.chromosome = None
+        self.strand = None
+        self.colorDF = None
+        self.novelJunctions = 0
+        self.sourceDict = None      # exons
+        self.codonDict = None       # start/stop codons
+        self.polyADict = None       # polyA sites
+        self.trackDict = None       # features of the BED tracks
+        self.trackNames = list()    # rows of the BED tracks, above the transcripts
+        self.coverageDict = None    # read depth along the gene
+        self.coverageNames = list() # rows of the coverage tracks, above the BED tracks
+        self.novelDict = None       # novel junction marks
+        self.blockDict = None       # block boundaries and hover
+        self.tranDict = None        # selectable transcript rows
+        self.timer = None           # stage timings of the computation
+
+
+def layoutKey(opt, isAnnot=True, isMatch=True):
+    '''Everything the layout of opt.gene depends on.'''
+
+    return (opt.gene, id(opt.annotations) if isAnnot else None, id(opt.clusterDict) if isMatch else None,
+            opt.collapse, getGene.supportThresholds(opt), tuple(opt.group), opt.cluster, int(opt.height),
+            opt.intronScale, opt.coverageMode)
+
+
+def groupKey(opt, isAnnot=True, isMatch=True):
+    '''Everything the rows of opt.gene, and so their grouping, depend on.'''
+
+    return (opt.gene, id(opt.annotations) if isAnnot else None, id(opt.clusterDict) if isMatch else None,
+            opt.collapse, getGene.supportThresholds(opt))
+
+
+def layoutOptions(opt, gene, settings=None):
+    '''A copy of opt for computing the layout of another gene, with that
+       gene's saved settings if given.'''
+
+    myOpt = copy.copy(opt)          # shares the loaded files
+    myOpt.gene = gene
+    myOpt.region = getGene.parseRegion(gene)
+    myOpt.fasta = None
+    if settings is not None:
+        for name in ('height', 'width', 'full', 'partial', 'group', 'cluster'):
+            setattr(myOpt, name, settings[name])
+    return myOpt
+
+
+def selectGene(opt, isAnnot, isMatch, messages):
+    # Select isoforms of a particular gene (or region).
+    tranList = list()                              # list of Transcript objects
+    exonList = list()                              # list of Exon objects
+    if opt.region is not None:                     # everything overlapping a genomic region
+        try:
+            getGene.getGeneFromRegion(opt, tranList, exonList)
+        except RuntimeError:
+            messages.append('nothing found in region \n%s' % opt.gene)
+        return tranList, exonList
+    if isAnnot:                                    # read the reference file
+        try:
+            getGene.getGeneFromAnnotation(opt, tranList, exonList)
+        except RuntimeError:
+            messages.append('%s not found in annotation \nfile' % opt.gene)
+    if isMatch:                                    # read the pickle file
+        try:
+            getGene.getGeneFromMatches(opt, tranList, exonList)
+        except RuntimeError:
+            messages.append('%s not found in pickle \nfile' % opt.gene)
+    return tranList, exonList
+
+
+# find out the chromosome that isosoforms locate on, find by matched isoform
+def getChromosome(tranList):
+    chromosome = None
+    for tran in tranList:
+        if tran.annot is False:               # find it in the matched isoforms
+            chromosome = tran.chr
+            break
+    else:                                     # annotations only
+        for tran in tranList:
+            if tran.chr is not None:
+                chromosome = tran.chr
+                break
+    return chromosome
+
+
+def computeLayout(opt, isAnnot=True, isMatch=True, timer=None, colorDF=None, cancelled=None):
+    '''
+    Compute the layout of opt.gene. colorDF, if given, is reused rather
+    than grouping the transcripts again. cancelled, if given, is called
+    between stages; computeLayout raises Cancelled once it returns True.
+    Raises RuntimeError if the gene is found nowhere.
+    '''
+
+    if timer is None:
+        timer = timing.StageTimer(opt.gene)
+
+    def checkpoint():
+        if cancelled is not None and cancelled():
+            raise Cancelled(opt.gene)
+
+    myLayout = Layout(opt.gene)
+    myLayout.timer = timer
+    with timer.stage('selectGene'):
+        tranList, exonList = selectGene(opt, isAnnot, isMatch, myLayout.messages)     # select transcripts by gene
+    if not exonList:
+        raise RuntimeError(myLayout.messages[-1] if myLayout.messages else '%s not found' % opt.gene)
+    with timer.stage('junctions'):
+        novelJunctions = junctions.JunctionTable.fromTranscripts(tranList).markNovel(tranList)
+    chromosome = getChromosome(tranList)                    # find out which chromosome does the gene locate
+
+    if opt.region is None:
+        strand = exonList[0].strand                        # which strand does the gene locate on
+    else:
+        strand = '+'                                       # a region may hold genes on both strands: plot in genomic order
+    checkpoint()
+    with timer.stage('assignBlocks'):
+        if strand == '+':                                      # if it's forward strand
+            blocks = getGene.assignBlocks(opt, exonList)       # sort by start, assign each exon to a block
+        else:                                                  # if it's trailing strand
+            blocks = getGene.assignBlocksReverse(opt, exonList)       # the same backwards, by decreasing end
+
+    with timer.stage('findRegions'):
+        getGene.findRegions(tranList)                       # determine regions occupied by each transcript
+    checkpoint()
+    with timer.stage('orderTranscripts'):
+        tranNames = getGene.orderTranscripts(tranList)      # get the names of transcripts, placed them in the right order
+        tranNames = getGene.reduceNameLength(tranNames)     # if the length of name is too long, reduce it
+
+    tranNum = len(tranNames)                             # how many transcripts are there
+    timer.count(transcripts=tranNum, exons=len(exonList), blocks=len(blocks), novel=novelJunctions)
+
+    checkpoint()
+    with timer.stage('groupTran'):
+        if 1 in opt.group and isMatch is True:
+            if colorDF is None:
+                colorDF = getGene.groupTran(tranList, exonList, 15, checkpoint,    # group the transcripts by similarities
+                                            approxAbove=opt.approxAbove)
+        else:
+            colorDF = None
+    checkpoint()
+    with timer.stage('getExonData'):
+        myLayout.sourceDict = plotData.getExonData(opt, exonList, colorDF, tranNum)   # data of each isoform that can be directly used to plot
+        myLayout.novelDict = plotData.getNovelData(opt, exonList, tranNum, strand)
+    with timer.stage('overlay'):
+        blockMap = overlay.BlockMap(blocks)                 # genomic position -> x, by binary search
+        myLayout.codonDict = overlay.codonData(tranList, blockMap, tranNum, opt.height)   # the location of start, stop codons
+        myLayout.polyADict = overlay.polyAData(exonList, blockMap, tranNum, opt.height)
+        myLayout.trackDict = overlay.trackData(opt.bedTracks, chromosome, blockMap, tranNum + 1)
+        myLayout.trackNames = overlay.trackNames(opt.bedTracks)
+    with timer.stage('coverage'):
+        if isMatch:
+            myLayout.coverageDict, myLayout.coverageNames = readCoverage.coverageData(
+                opt, blockMap, tranNum + 1 + len(myLayout.trackNames))
+        else:
+            myLayout.coverageDict = readCoverage.emptyCoverageData()
+    with timer.stage('getBoundaryData'):
+        myLayout.blockDict, myLayout.tranDict = plotData.getBoundaryData(blocks, chromosome, tranNum, strand)
+
+    myLayout.tranList = tranList
+    myLayout.exonList = exonList
+    myLayout.blocks = blocks
+    myLayout.tranNames = tranNames
+    myLayout.tranNum = tranNum
+    myLayout.chromosome = chromosome
+    myLayout.strand = strand
+    myLayout.colorDF = colorDF
+    myLayout.novelJunctions = novelJunctions
+    return myLayout
+
+
+def columns(data, names):
+    '''The named columns of plot data as lists, for JSON.'''
+    return dict((name, np.asarray(data[name]).tolist()) for name in names)
+
+
+def asDict(myLayout, cluster):
+    '''
+    The layout as plain lists and dicts, without the plot styling: rows
+    are the transcript names from the top of the plot down (row i is
+    drawn at y = len(rows) - i), x coordinates are in the phony
+    coordinates of the blocks, groups maps transcript names to their
+    group when there are cluster groups, and coverage gives the read
+    depth over [left, right] of each coverage track.
+    '''
+
+    groups = None
+    groupName = 'group%d' % cluster
+    if myLayout.colorDF is not None and groupName in myLayout.colorDF:
+        groups = dict((name, int(group)) for name, group in
+                      zip(myLayout.colorDF['name'], myLayout.colorDF[groupName]))
+    return dict(gene=myLayout.gene, chromosome=myLayout.chromosome, strand=myLayout.strand,
+                rows=list(myLayout.tranNames), tracks=list(myLayout.trackNames),
+                exons=columns(myLayout.sourceDict, ['x0', 'x1', 'y', 'tran', 'start', 'end',
+                                                    'full', 'partial', 'annot']),
+                blocks=columns(myLayout.blockDict, ['left', 'right', 'start', 'end']),
+                codons=columns(myLayout.codonDict, ['x', 'y', 'color', 'position']),
+                polyA=columns(myLayout.polyADict, ['x', 'y', 'position']),
+                features=columns(myLayout.trackDict, ['x0', 'x1', 'y', 'name', 'track', 'start', 'end']),
+                novel=columns(myLayout.novelDict, ['x', 'y', 'tran', 'position']),
+                coverage=columns(myLayout.coverageDict, ['left', 'right', 'depth', 'track', 'start', 'end']),
+                coverageTracks=list(myLayout.coverageNames),
+                groups=groups, novelJunctions=myLayout.novelJunctions)
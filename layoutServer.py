@@ -0,0 +1,229 @@
+'''
+Gene layouts as JSON over HTTP, for tools that want what the browser
+shows without the browser (notebooks, a lab portal):
+
+    python layoutServer.py --input a.pickle b.pickle --anno a.gtf --port 5007
+    curl 'http://localhost:5007/gene/BRCA1?clusters=4&full=2&partial=0'
+
+The files are loaded once, at startup. A layout is computed by
+layout.computeLayout, as in the browser, and kept serialized in a
+least-recently-used cache. Responses carry an ETag made of the request
+settings and the modification times of the files, so a client sending
+it back in If-None-Match gets a 304 without anything being computed.
+Isoforms below the full/partial thresholds are left out of the layout;
+with collapse=1, rows are judged on the support summed over their
+clusters.
+See layout.asDict for the fields of the JSON.
+'''
+
+import argparse
+import collections
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.web import Application, RequestHandler
+
+import getGene
+import layout
+import overlay
+import readCoverage
+from params import getParams
+
+PORT = 5007
+CACHE_SIZE = 256                # serialized layouts kept
+MAX_CLUSTERS = 15               # as the browser's cluster slider
+
+
+class LayoutCache (object):
+    '''Serialized layouts by layout.layoutKey, least recently used dropped first.'''
+
+    def __init__(self, size=CACHE_SIZE):
+
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()    # key -> JSON text
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.pop(key, None)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries[key] = body                # now the most recently used
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = body
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class LayoutService (object):
+    '''The loaded files, the cache and the thread layouts are computed on.'''
+
+    def __init__(self, opt, cacheSize=CACHE_SIZE):
+
+        self.opt = opt
+        self.cache = LayoutCache(cacheSize)
+        self.executor = ThreadPoolExecutor(max_workers=1)      # layouts share the loaded files
+        files = [opt.gtf] + sorted(opt.clusterDict)
+        self.stamp = repr([(fileName, os.path.getmtime(fileName)) for fileName in files])
+
+    def options(self, gene, cluster, full, partial, collapse):
+        '''Options for one request, sharing the loaded files.'''
+
+        if getGene.parseRegion(gene) is None:       # gene names as the browser looks them up
+            gene = gene.upper()
+        myOpt = layout.layoutOptions(self.opt, gene)
+        myOpt.cluster = cluster
+        myOpt.full = full
+        myOpt.partial = partial
+        myOpt.collapse = collapse
+        myOpt.dropHidden = True                     # no plot to hide them in
+        return myOpt
+
+    def etag(self, myOpt):
+        # The key without the identities of the loaded files, which differ
+        # between runs of the server; the file stamp stands in for them.
+        key = layout.layoutKey(myOpt, isAnnot=False, isMatch=False)
+        return '"%s"' % hashlib.sha1(self.stamp + repr(key)).hexdigest()
+
+    def compute(self, myOpt):
+        '''JSON text of the layout of myOpt.gene; RuntimeError if not found.'''
+
+        myLayout = layout.computeLayout(myOpt)
+        return json.dumps(layout.asDict(myLayout, myOpt.cluster), separators=(',', ':'))
+
+
+class GeneHandler (RequestHandler):
+    '''GET /gene/<name>?clusters=k&full=n&partial=n&collapse=0|1'''
+
+    def initialize(self, service):
+        self.service = service
+        self.etag = None
+
+    def intArgument(self, name, default, low, high):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError('%s must be a whole number' % name)
+        if not low <= value <= high:
+            raise ValueError('%s must be between %d and %d' % (name, low, high))
+        return value
+
+    def fail(self, status, message):
+        self.set_status(status)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(dict(error=message)))
+
+    def compute_etag(self):
+        return self.etag                            # of the settings, not of the body
+
+    @gen.coroutine
+    def get(self, gene):
+        try:
+            myOpt = self.service.options(gene,
+                                         cluster=self.intArgument('clusters', 3, 1, MAX_CLUSTERS),
+                                         full=self.intArgument('full', 0, 0, sys.maxint),
+                                         partial=self.intArgument('partial', 0, 0, sys.maxint),
+                                         collapse=bool(self.intArgument('collapse', 0, 0, 1)))
+        except ValueError as e:
+            self.fail(400, str(e))
+            return
+        self.etag = self.service.etag(myOpt)
+        self.set_etag_header()
+        if self.check_etag_header():                # the client has it already
+            self.set_status(304)
+            return
+        self.clear_header('Etag')                   # only a layout gets one, not a 404
+
+        key = layout.layoutKey(myOpt)
+        body = self.service.cache.get(key)
+        if body is None:
+            try:
+                body = yield self.service.executor.submit(self.service.compute, myOpt)
+            except RuntimeError as e:               # gene not found
+                self.fail(404, str(e).replace('\n', ''))
+                return
+            self.service.cache.put(key, body)
+        self.set_etag_header()
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Cache-Control', 'no-cache')    # revalidate: the ETag makes that cheap
+        self.write(body)
+
+
+class StatsHandler (RequestHandler):
+    '''GET /stats: cache counts.'''
+
+    def initialize(self, service):
+        self.service = service
+
+    def get(self):
+        cache = self.service.cache
+        self.write(dict(cached=len(cache.entries), size=cache.size, hits=cache.hits, misses=cache.misses))
+
+
+def loadFiles(args):
+    '''Options with the annotation and match files loaded.'''
+
+    opt = getParams(args.anno_file, args.input_files, None, format=args.anno_format,
+                    height=10, width=600, full=0, partial=0, group=[1], cluster=3,
+                    processes=args.processes, bedTracks=overlay.bedTracks(args.bed_files),
+                    intronScale=args.intron_scale, coverageMode=args.coverage)
+    t0 = time.time()
+    getGene.updateMatchedIsoforms(opt, args.input_files)
+    opt.annotations = getGene.getAnnotations(opt)
+    print >> sys.stderr, 'loaded %d match files and %s in %.1f s' % (len(args.input_files), args.anno_file,
+                                                                     time.time() - t0)
+    return opt
+
+
+def makeApp(service):
+    return Application([(r'/gene/(.+)', GeneHandler, dict(service=service)),
+                        (r'/stats', StatsHandler, dict(service=service))])
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Serve gene layouts as JSON.')
+    parser.add_argument('--input', dest='input_files', nargs='+', required=True, help='MatchAnnot pickle files')
+    parser.add_argument('--anno', dest='anno_file', required=True, help='Annotation file')
+    parser.add_argument('--anno-format', dest='anno_format', default='standard',
+                        help='Annotation file format: standard (GTF), parallel, alt or pickle')
+    parser.add_argument('--processes', dest='processes', type=int,
+                        help='Worker processes for loading the files (default: one per CPU)')
+    parser.add_argument('--bed', dest='bed_files', nargs='+', default=[],
+                        help='BED files of features to include as tracks')
+    parser.add_argument('--coverage', dest='coverage', choices=readCoverage.MODES, default='total',
+                        help='Read coverage tracks: one, one per match file, or none')
+    parser.add_argument('--intron-scale', dest='intron_scale', type=float,
+                        help='Lay introns out at this fraction of their genomic length rather than not at all')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--address', default='localhost', help='Address to listen on')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=CACHE_SIZE,
+                        help='Layouts kept in memory')
+    args = parser.parse_args()
+
+    service = LayoutService(loadFiles(args), args.cache_size)
+    makeApp(service).listen(args.port, address=args.address)
+    print >> sys.stderr, 'serving on http://%s:%d/gene/<name>' % (args.address, args.port)
+    IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+'''
+Load test of the browser: starts a local server, drives N concurrent
+sessions against it and reports callback latency, server memory and
+throughput for each number of sessions.
+
+    python loadTest.py --sessions 1,2,4,8 --actions 20
+    python loadTest.py --input a.pickle --anno a.gtf --genes BRCA1,TP53
+
+Without --input/--anno a synthetic dataset is written to a temporary
+directory (see synthetic.py). Each session opens the document, shows a
+first gene, then repeatedly selects a gene from the gene table or moves
+the cluster/full/partial sliders. Genes are laid out on the server's
+worker thread, so a gene action is timed until the Console says it is
+done; a slider action until the server has run its callback.
+'''
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+
+import numpy as np
+from tornado import gen
+
+import memoryStats
+
+ACTION_TIMEOUT = 300            # seconds before an action counts as failed
+SELECT_WEIGHT = 0.4             # fraction of actions that select a gene, the rest move a slider
+
+
+def freePort():
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def startServer(port, inputFile, annoFile, appArgs, workDir):
+    '''Start serve.py on port, in workDir (the saved-gene database goes
+       there); returns the process once the app answers.'''
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, os.path.join(here, 'serve.py'), '--port', str(port),
+               os.path.join(here, 'browse.py'), '--args', '--input', inputFile, '--anno', annoFile] + appArgs
+    server = subprocess.Popen(command, cwd=workDir)
+    url = 'http://localhost:%d/browse' % port
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('server exited with status %d' % server.returncode)
+        try:
+            urllib2.urlopen(url, timeout=5).read()
+            return server
+        except (urllib2.URLError, socket.error):
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError('server did not start within a minute')
+
+
+class Session (object):
+    '''One simulated user: a client session of the browse app.'''
+
+    def __init__(self, url, rand):
+
+        from bokeh.client import pull_session      # imports tornado's client side
+        self.rand = rand
+        t0 = time.time()
+        self.session = pull_session(url=url)
+        self.openSeconds = time.time() - t0
+        doc = self.session.document
+        self.gene = doc.select_one({'name': 'gene'})
+        self.go = doc.select_one({'name': 'go'})
+        self.console = doc.select_one({'name': 'console'})
+        self.geneTable = doc.select_one({'name': 'geneTable'})
+        self.sliders = [doc.select_one({'name': name}) for name in ('cluster', 'full', 'partial')]
+        self.acks = 0                               # changes of ours the server has handled
+        self.consoleText = None                     # Console text since the last action
+        self.console.on_change('text', self.consoleChanged)
+        self.applyPatch = self.session._handle_patch
+        self.session._handle_patch = self.handlePatch
+        self.popMessage = self.session._connection._pop_message
+        self.session._connection._pop_message = self.receive
+
+    @gen.coroutine
+    def receive(self):
+        '''Next message from the server, counting the OKs: the server sends
+           one for each change of ours, after running its callbacks.'''
+        message = yield self.popMessage()
+        if message is not None and message.msgtype == 'OK':
+            self.acks += 1
+        raise gen.Return(message)
+
+    def handlePatch(self, message):
+        '''Apply a server patch. The Python side of bokeh can't read back
+           some of what it sends (e.g. glyph sizes in screen units); a
+           browser would, and the rest of the document is what we need.
+           Later patches to the models it couldn't read fail too.'''
+        try:
+            self.applyPatch(message)
+        except (ValueError, RuntimeError):
+            pass
+
+    def consoleChanged(self, attr, old, new):
+        self.consoleText = new
+
+    def pump(self, done):
+        '''
+        Apply server messages until done() (checked as each one arrives)
+        or ACTION_TIMEOUT. force_roundtrip won't do: it waits for its
+        reply and drops the document patches that come before it.
+        '''
+
+        connection = self.session._connection      # bokeh.client has no public call for this
+        handle = connection.io_loop.call_later(ACTION_TIMEOUT, connection.io_loop.stop)
+        connection._loop_until(done)
+        connection.io_loop.remove_timeout(handle)
+        return done()
+
+    def geneDone(self):
+        text = self.consoleText or ''
+        return 'Success' in text or 'error' in text or 'not found' in text
+
+    def waitForGene(self):
+        '''Wait for the Console to report the end of a gene update; True on success.'''
+        return self.pump(self.geneDone) and 'Success' in self.consoleText
+
+    def showGene(self, gene):
+        self.consoleText = None
+        self.gene.value = gene
+        self.go.clicks += 1
+        return self.waitForGene()
+
+    def selectGene(self):
+        genes = self.geneTable.data.get('Gene', [])
+        selected = self.geneTable.selected['1d']['indices']
+        choices = [ix for ix in xrange(len(genes)) if ix not in selected]
+        if not choices:
+            return None
+        self.consoleText = None
+        self.geneTable.selected = {'0d': {'glyph': None, 'indices': []},
+                                   '1d': {'indices': [self.rand.choice(choices)]},
+                                   '2d': {'indices': {}}}
+        return self.waitForGene()
+
+    def moveSlider(self):
+        '''Move a slider; done once the server has run its callback.'''
+        slider = self.rand.choice(self.sliders)
+        values = [value for value in xrange(int(slider.start), int(slider.end) + 1) if value != slider.value]
+        if not values:
+            return None
+        before = self.acks
+        slider.value = self.rand.choice(values)
+        return self.pump(lambda: self.acks > before)
+
+    def close(self):
+        self.session.close()
+
+
+def runSession(url, firstGene, actions, seed, records):
+    '''Body of one session thread; appends (kind, seconds, ok) to records.'''
+
+    rand = random.Random(seed)
+    try:
+        session = Session(url, rand)
+    except Exception as e:
+        records.append(('open', None, False))
+        print >> sys.stderr, 'session failed to open: %s' % e
+        return
+    records.append(('open', session.openSeconds, True))
+    try:
+        t0 = time.time()
+        ok = session.showGene(firstGene)
+        records.append(('gene', time.time() - t0, ok))
+        for ix in xrange(actions):
+            t0 = time.time()
+            if rand.random() < SELECT_WEIGHT:
+                ok = session.selectGene()
+                kind = 'gene'
+            else:
+                ok = session.moveSlider()
+                kind = 'slider'
+            if ok is not None:
+                records.append((kind, time.time() - t0, ok))
+    except Exception as e:                  # e.g. the server went away
+        records.append(('error', None, False))
+        print >> sys.stderr, 'session failed: %s' % e
+    finally:
+        session.close()
+
+
+def percentiles(seconds):
+    if not seconds:
+        return dict(count=0)
+    values = np.percentile(seconds, [50, 95, 99])
+    return dict(count=len(seconds), p50=values[0], p95=values[1], p99=values[2], max=max(seconds))
+
+
+def runLevel(url, count, args, serverPid, genes):
+    '''Run count sessions at once; returns the result record of this level.'''
+
+    records = list()
+    rssBefore = memoryStats.residentBytes(serverPid)
+    threads = list()
+    t0 = time.time()
+    for ix in xrange(count):
+        thread = threading.Thread(target=runSession,
+                                  args=(url, genes[ix % len(genes)], args.actions, args.seed + ix, records))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - t0
+    rssAfter = memoryStats.residentBytes(serverPid)
+
+    result = dict(sessions=count, seconds=seconds, rssBefore=rssBefore, rssAfter=rssAfter,
+                  failed=sum(1 for kind, sec, ok in records if not ok))
+    done = [sec for kind, sec, ok in records if ok and kind in ('gene', 'slider')]
+    result['actionsPerSecond'] = len(done) / seconds
+    result['perSessionPerSecond'] = result['actionsPerSecond'] / count
+    for kind in ('open', 'gene', 'slider'):
+        result[kind] = percentiles([sec for myKind, sec, ok in records if myKind == kind and ok])
+    result['all'] = percentiles(done)
+    return result
+
+
+def printResult(result):
+
+    def ms(stats, name):
+        return '%7.0f' % (stats[name] * 1000) if stats['count'] else '      -'
+
+    mb = lambda size: '%6.0f' % (size / 1048576.0) if size is not None else '     ?'
+    print '%8d %7.1f %7.2f %s %s %s   %s %s %s   %s %s %s %s %6d' % (
+        result['sessions'], result['actionsPerSecond'], result['perSessionPerSecond'],
+        ms(result['all'], 'p50'), ms(result['all'], 'p95'), ms(result['all'], 'p99'),
+        ms(result['gene'], 'p50'), ms(result['gene'], 'p95'), ms(result['gene'], 'p99'),
+        ms(result['slider'], 'p50'), ms(result['slider'], 'p99'),
+        mb(result['rssBefore']), mb(result['rssAfter']), result['failed'])
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Load test the browser with concurrent sessions.')
+    parser.add_argument('--sessions', default='1,2,4,8', help='comma-separated numbers of concurrent sessions')
+    parser.add_argument('--actions', type=int, default=20, help='gene selections and slider moves per session')
+    parser.add_argument('--input', help='MatchAnnot pickle (default: synthetic data)')
+    parser.add_argument('--anno', help='annotation GTF (default: synthetic data)')
+    parser.add_argument('--genes', help='comma-separated genes sessions start from (default: from the data)')
+    parser.add_argument('--synthetic-genes', dest='synthetic_genes', type=int, default=50)
+    parser.add_argument('--isoforms', type=int, default=50, help='isoforms per synthetic gene')
+    parser.add_argument('--url', help='test a running server instead of starting one')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the results to this file (JSON)')
+    args, appArgs = parser.parse_known_args()       # the rest goes to browse.py, e.g. --prefetch 0
+
+    tmpDir = tempfile.mkdtemp(prefix='loadTest.')
+    server = None
+    try:
+        genes = args.genes.split(',') if args.genes else None
+        if args.url is None:
+            inputFile, annoFile = args.input, args.anno
+            if inputFile is None or annoFile is None:
+                import synthetic
+                geneList = synthetic.makeGenes(args.synthetic_genes, args.isoforms, seed=args.seed)
+                annoFile, inputFile = synthetic.writeDataset(os.path.join(tmpDir, 'synthetic'), geneList)
+                genes = genes or [gene.name for gene in geneList]
+            port = freePort()
+            server = startServer(port, os.path.abspath(inputFile), os.path.abspath(annoFile), appArgs, tmpDir)
+            url = 'http://localhost:%d/browse' % port
+        else:
+            url = args.url
+        if not genes:
+            parser.error('--genes is needed with real data')
+
+        serverPid = server.pid if server is not None else None
+        print '%8s %7s %7s %7s %7s %7s   %7s %7s %7s   %7s %7s %6s %6s %6s' % (
+            'sessions', 'act/s', 'act/s/s', 'p50ms', 'p95ms', 'p99ms', 'gene50', 'gene95', 'gene99',
+            'slide50', 'slide99', 'rssMB', 'after', 'failed')
+        results = list()
+        for count in [int(x) for x in args.sessions.split(',')]:
+            result = runLevel(url, count, args, serverPid, genes)
+            results.append(result)
+            printResult(result)
+            sys.stdout.flush()
+        if args.output:
+            with open(args.output, 'w') as handle:
+                json.dump(dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'), url=url, actions=args.actions,
+                               appArgs=appArgs, results=results), handle, indent=1, sort_keys=True)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
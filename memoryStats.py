@@ -0,0 +1,201 @@
+'''
+Memory accounting of a browser process: approximate deep sizes of the
+loaded annotation and match files, and of each session's plot data.
+Shown by the "Memory report" button and written out as JSON.
+'''
+
+import collections
+import gc
+import json
+import sys
+import time
+import types
+import weakref
+
+import numpy as np
+
+# Shared, not owned by a dataset: never counted, nor walked into.
+SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+              types.MethodType, types.ClassType)
+
+# Every session of the server runs browse.py in its own module, with its
+# own options and loaded files. Sessions register here so a report can
+# cover all of them; an entry goes away with its session's module.
+sessions = weakref.WeakValueDictionary()       # session id -> Session
+datasetCache = dict()                           # id(dataset) -> (weak reference, stats)
+
+
+class Session (object):
+    '''What one browser session holds: its options (and so its loaded
+       files) and its ColumnDataSources by name.'''
+
+    def __init__(self, name, opt, sources):
+        self.name = name
+        self.opt = opt
+        self.sources = sources
+
+
+def register(name, opt, sources):
+    '''Register a session; keep the returned Session referenced for as long as it lives.'''
+
+    session = Session(name, opt, sources)
+    sessions[name] = session
+    return session
+
+
+def deepSize(root):
+    '''
+    Approximate memory held by root and everything reachable from it:
+    (bytes, number of objects, Counter of objects by type name).
+    Numpy arrays count their buffers; shared objects are counted once.
+    '''
+
+    seen = set()
+    stack = [root]
+    size = 0
+    typeCounts = collections.Counter()
+    while stack:                            # iterative: cluster trees are deep
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SKIP_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        typeCounts[type(obj).__name__] += 1
+        if isinstance(obj, np.ndarray):
+            if obj.base is None:            # views share their base's buffer
+                size += obj.nbytes
+            continue
+        if isinstance(obj, (str, unicode, int, long, float, bool)) or obj is None:
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.iterkeys())
+            stack.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(obj)
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for name in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, name):
+                stack.append(getattr(obj, name))
+    return size, len(seen), typeCounts
+
+
+def datasetStats(dataset, loadTime=None):
+    '''Size and contents of an AnnotationList or ClusterDict.'''
+
+    t0 = time.time()
+    size, objects, typeCounts = deepSize(dataset)
+    geneDict = dataset.getGeneDict()
+    return dict(bytes=size, objects=objects,
+                genes=len(geneDict),
+                entries=sum(len(entries) for entries in geneDict.itervalues()),   # genes or clusters
+                loadSeconds=loadTime,
+                measureSeconds=time.time() - t0,
+                topTypes=typeCounts.most_common(5))
+
+
+def sourceStats(sources):
+    '''Rows, columns and approximate size of each named ColumnDataSource.'''
+
+    stats = dict()
+    for name, source in sources.iteritems():
+        data = dict(source.data)            # a plain dict: .data refers back to its models
+        rows = max([len(column) for column in data.itervalues()] or [0])
+        stats[name] = dict(rows=rows, columns=len(data), bytes=deepSize(data)[0])
+    return stats
+
+
+def residentBytes(pid='self'):
+    '''Resident set size of a process (this one by default), None where /proc is missing.'''
+
+    try:
+        with open('/proc/%s/status' % pid) as handle:
+            for line in handle:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
+
+def datasetReport(cache=None):
+    '''
+    Sizes of the files loaded by the registered sessions, with the
+    process RSS. cache keeps dataset stats between reports: the files
+    don't change once loaded, and walking them is slow. Safe to run off
+    the event loop.
+    '''
+
+    if cache is None:
+        cache = datasetCache
+
+    def cached(dataset, loadTime):
+        key = id(dataset)
+        if key not in cache or cache[key][0]() is not dataset:
+            cache[key] = (weakref.ref(dataset), datasetStats(dataset, loadTime))
+        return cache[key][1]
+
+    datasets = dict()
+    settings = dict()
+    for name, session in sessions.items():
+        opt = session.opt
+        files = list()
+        if opt.annotations is not None:
+            files.append((opt.gtf, 'AnnotationList', opt.annotations))
+        for matchFile, clusterDict in (opt.clusterDict or dict()).iteritems():
+            files.append((matchFile, 'ClusterDict', clusterDict))
+        for fileName, kind, dataset in files:
+            stats = datasets.setdefault(id(dataset), dict(file=fileName, kind=kind, sessions=[],
+                                                          **cached(dataset, opt.loadTimes.get(fileName))))
+            stats['sessions'].append(name)
+        settings[name] = dict(lazySeq=opt.lazySeq, collapse=opt.collapse, gene=opt.gene)
+
+    return dict(time=time.time(),
+                residentBytes=residentBytes(),
+                gcObjects=len(gc.get_objects()),
+                datasets=sorted(datasets.values(), key=lambda x: (x['file'], x['sessions'])),
+                settings=settings)
+
+
+def sessionReport():
+    '''Plot data sizes of the registered sessions. Run it on the event
+       loop, which is what changes the sources.'''
+
+    return dict((name, sourceStats(session.sources)) for name, session in sessions.items())
+
+
+def humanBytes(size):
+    if size is None:
+        return '?'
+    if size < 1024:
+        return '%d B' % size
+    for unit in ('KB', 'MB', 'GB'):
+        size /= 1024.0
+        if size < 1024 or unit == 'GB':
+            return '%.1f %s' % (size, unit)
+
+
+def formatReport(myReport):
+    '''The report as text for the app panel.'''
+
+    lines = ['Memory: RSS %s' % humanBytes(myReport['residentBytes'])]
+    for stats in myReport['datasets']:
+        lines.append('%s (%s)' % (stats['file'], stats['kind']))
+        lines.append('  %s, %d objects' % (humanBytes(stats['bytes']), stats['objects']))
+        lines.append('  %d genes, %d %s' % (stats['genes'], stats['entries'],
+                                            'clusters' if stats['kind'] == 'ClusterDict' else 'gene entries'))
+        if stats['loadSeconds'] is not None:
+            lines.append('  loaded in %.1f s' % stats['loadSeconds'])
+        if len(stats['sessions']) > 1:
+            lines.append('  shared by %d sessions' % len(stats['sessions']))
+    for session, sources in sorted(myReport['sessions'].iteritems()):
+        total = sum(stats['bytes'] for stats in sources.itervalues())
+        lines.append('session %s: %s' % (session, humanBytes(total)))
+        for name, stats in sorted(sources.iteritems(), key=lambda x: -x[1]['bytes'])[:4]:
+            lines.append('  %s: %d rows, %s' % (name, stats['rows'], humanBytes(stats['bytes'])))
+    return '\n'.join(lines)
+
+
+def writeJson(myReport, fileName):
+    with open(fileName, 'w') as handle:
+        json.dump(myReport, handle, indent=2, sort_keys=True)
@@ -0,0 +1,253 @@
+'''
+Features drawn over the isoforms: start/stop codons, polyA sites and
+tracks of features read from BED files.
+
+The x axis of the plot is in phony coordinates (see getGene.Block): each
+block of exonic sequence is laid end to end, the introns between blocks
+taking no room. BlockMap maps genomic positions onto it with a binary
+search over the block edges, for whole arrays of positions at once.
+'''
+
+import os
+import shlex
+
+import numpy as np
+
+from intervalIndex import IntervalIndex
+
+CODON_COLORS = dict(startcodon='green', stopcodon='red')
+POLYA_COLOR = 'purple'
+TRACK_COLORS = ['#444444', '#1f77b4', '#ff7f0e', '#2ca02c', '#9467bd', '#8c564b']
+
+bedCache = dict()               # file name -> BedTrack, shared by the sessions
+
+
+class BlockMap (object):
+    '''Genomic position -> x coordinate, for the blocks of one gene.'''
+
+    def __init__(self, blocks):
+
+        # Blocks never overlap. On the reverse strand they come in order
+        # of decreasing position with start > end; sorting by the lower
+        # edge makes one code path of both.
+        lo = np.array([min(blk.start, blk.end) for blk in blocks], dtype=np.int64)
+        order = np.argsort(lo, kind='mergesort')
+        self.lo = lo[order]
+        self.hi = np.array([max(blk.start, blk.end) for blk in blocks], dtype=np.int64)[order]
+        self.end = np.array([blk.end for blk in blocks], dtype=np.int64)[order]
+        self.boundary = np.array([blk.boundary for blk in blocks], dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.lo)
+
+    def span(self):
+        '''Lowest and highest genomic position covered, or None.'''
+
+        if not len(self.lo):
+            return None
+        return int(self.lo[0]), int(self.hi[-1])
+
+    def blockOf(self, positions):
+        '''Index (in lo order) of the block holding each position, -1 for none.'''
+
+        positions = np.asarray(positions, dtype=np.int64)
+        ix = np.searchsorted(self.lo, positions, side='right') - 1
+        inside = (ix >= 0) & (positions <= self.hi[np.maximum(ix, 0)])
+        return np.where(inside, ix, -1)
+
+    def map(self, positions):
+        '''x coordinates of positions; NaN for positions outside every block.'''
+
+        positions = np.asarray(positions, dtype=np.int64)
+        ix = self.blockOf(positions)
+        safe = np.maximum(ix, 0)
+        x = (self.boundary[safe] - np.abs(self.end[safe] - positions)).astype(np.float64)
+        x[ix < 0] = np.nan
+        return x
+
+    def mapIntervals(self, starts, ends):
+        '''
+        x extent (x0 <= x1) of genomic intervals, clipped to the blocks
+        they overlap: an interval across an intron is drawn across the
+        block boundary. keep is False for intervals in no block.
+        '''
+
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        count = len(starts)
+        if not len(self.lo) or not count:
+            empty = np.zeros(count)
+            return empty, empty, np.zeros(count, dtype=bool)
+
+        # Move starts in an intron to the next block, ends to the one before.
+        last = len(self.lo) - 1
+        startBlock = np.searchsorted(self.lo, starts, side='right') - 1
+        gap = (startBlock < 0) | (starts > self.hi[np.maximum(startBlock, 0)])
+        startBlock = np.where(gap, startBlock + 1, startBlock)
+        endBlock = np.searchsorted(self.lo, ends, side='right') - 1
+        keep = (startBlock <= last) & (endBlock >= 0) & (startBlock <= endBlock)
+        startBlock = np.clip(startBlock, 0, last)
+        endBlock = np.clip(endBlock, 0, last)
+        starts = np.where(gap, self.lo[startBlock], starts)
+        ends = np.minimum(ends, self.hi[endBlock])
+        x0 = self.boundary[startBlock] - np.abs(self.end[startBlock] - starts)
+        x1 = self.boundary[endBlock] - np.abs(self.end[endBlock] - ends)
+        return np.minimum(x0, x1), np.maximum(x0, x1), keep
+
+
+def codonData(tranList, blockMap, tranNum, height):
+    '''Start (green) and stop (red) codons of the annotated transcripts.'''
+
+    positions = list()
+    ys = list()
+    colors = list()
+    for tran in tranList:
+        if not tran.annot:                  # only annotations know about start/stops
+            continue
+        for attr in ('startcodon', 'stopcodon'):
+            if hasattr(tran, attr):
+                positions.append(getattr(tran, attr))
+                ys.append(tranNum - tran.tranIx)
+                colors.append(CODON_COLORS[attr])
+    return pointData(blockMap, positions, ys, colors, int(height) * 1.2)
+
+
+def polyAPositions(polyAs):
+    '''Positions of an exon's polyA sites: a dict keyed by position, or a
+       sequence of positions or of objects with an end.'''
+
+    if isinstance(polyAs, dict):
+        return list(polyAs)
+    return [getattr(site, 'end', site) for site in polyAs]
+
+
+def polyAData(exonList, blockMap, tranNum, height):
+    '''PolyA sites of annotation exons, on their transcript's row.'''
+
+    positions = list()
+    ys = list()
+    for myExon in exonList:
+        polyAs = getattr(myExon, 'polyAs', None)
+        if polyAs:
+            sites = polyAPositions(polyAs)
+            positions.extend(sites)
+            ys.extend([tranNum - myExon.tran.tranIx] * len(sites))
+    return pointData(blockMap, positions, ys, [POLYA_COLOR] * len(positions), int(height) * 0.8)
+
+
+def pointData(blockMap, positions, ys, colors, size):
+    '''Column data of point features; those outside every block are left out.'''
+
+    if not positions:
+        return emptyPointData()
+    x = blockMap.map(positions)
+    keep = ~np.isnan(x)
+    return dict(x=x[keep], y=np.asarray(ys, dtype=np.int32)[keep],
+                color=[color for color, kept in zip(colors, keep) if kept],
+                position=np.asarray(positions, dtype=np.int64)[keep],
+                size=np.full(int(keep.sum()), size, dtype=np.float32))
+
+
+def emptyPointData():
+    return dict(x=np.zeros(0), y=np.zeros(0, dtype=np.int32), color=[],
+                position=np.zeros(0, dtype=np.int64), size=np.zeros(0, dtype=np.float32))
+
+
+def emptyTrackData():
+    return dict(x0=np.zeros(0), x1=np.zeros(0), y=np.zeros(0, dtype=np.int32), color=[],
+                name=[], track=[], start=np.zeros(0, dtype=np.int64), end=np.zeros(0, dtype=np.int64))
+
+
+def trackData(tracks, chromosome, blockMap, firstRow):
+    '''
+    Features of each BED track overlapping the gene, one plot row per
+    track from y = firstRow up. Returns column data for a segment glyph.
+    '''
+
+    data = emptyTrackData()
+    span = blockMap.span()
+    if chromosome is None or span is None:
+        return data
+    columns = dict((name, list()) for name in data)
+    names = trackNames(tracks)
+    for trackIx, track in enumerate(tracks):
+        features = track.overlap(chromosome, span[0], span[1])
+        if not features:
+            continue
+        starts = [feature[1] for feature in features]
+        ends = [feature[2] for feature in features]
+        x0, x1, keep = blockMap.mapIntervals(starts, ends)
+        kept = np.flatnonzero(keep)
+        columns['x0'].append(x0[kept])
+        columns['x1'].append(x1[kept])
+        columns['y'].append(np.full(len(kept), firstRow + trackIx, dtype=np.int32))
+        columns['start'].append(np.asarray(starts, dtype=np.int64)[kept])
+        columns['end'].append(np.asarray(ends, dtype=np.int64)[kept])
+        columns['name'].extend(features[ix][0] for ix in kept)
+        columns['track'].extend([names[trackIx]] * len(kept))
+        columns['color'].extend([TRACK_COLORS[trackIx % len(TRACK_COLORS)]] * len(kept))
+    for name in ('x0', 'x1', 'y', 'start', 'end'):
+        if columns[name]:
+            data[name] = np.concatenate(columns[name])
+    for name in ('name', 'track', 'color'):
+        data[name] = columns[name]
+    return data
+
+
+class BedTrack (object):
+    '''Features of a BED file, indexed for overlap queries.'''
+
+    def __init__(self, fileName):
+
+        self.fileName = fileName
+        self.name = os.path.splitext(os.path.basename(fileName))[0]
+        self.index = IntervalIndex()
+        with open(fileName) as handle:
+            for line in handle:
+                if line.startswith('track'):            # e.g. track name="CAGE peaks"
+                    for word in shlex.split(line):
+                        if word.startswith('name='):
+                            self.name = word[len('name='):]
+                    continue
+                if not line.strip() or line.startswith(('#', 'browser')):
+                    continue
+                fields = line.rstrip('\n').split('\t')
+                start = int(fields[1]) + 1              # BED is 0-based, half open
+                end = int(fields[2])
+                name = fields[3] if len(fields) > 3 else '%s:%d-%d' % (fields[0], start, end)
+                self.index.add(fields[0], start, end, (name, start, end))
+        self.index.index()
+
+    def __len__(self):
+        return len(self.index)
+
+    def overlap(self, chromosome, start, end):
+        '''(name, start, end) of the features overlapping [start, end].'''
+        return self.index.overlap(chromosome, start, end)
+
+
+def trackNames(tracks):
+    '''Names of the tracks as plot rows: repeated names get a number, " (2)" on.'''
+
+    names = list()
+    seen = set()
+    for track in tracks:
+        name = track.name
+        number = 1
+        while name in seen:
+            number += 1
+            name = '%s (%d)' % (track.name, number)
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def bedTracks(fileNames):
+    '''BedTracks of fileNames, each file read once per server.'''
+
+    tracks = list()
+    for fileName in fileNames:
+        if fileName not in bedCache:
+            bedCache[fileName] = BedTrack(fileName)
+        tracks.append(bedCache[fileName])
+    return tracks
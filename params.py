@@ -0,0 +1,60 @@
+'''
+The options of a browser session, also used by the tools that lay out
+genes without the browser (see layoutServer.py).
+'''
+
+from collections import Counter
+
+import getGene
+import prefetch
+
+
+# a class containing all the input parameters
+class getParams(object):
+    def __init__(self, gtf, matches, gene, format="standard", fasta=None,
+                 annotations=None, clusterDict=None, height=None, width=None,
+                 full=None, partial=None, group=None, cluster=None,
+                 region=None, regionIndex=None, timingLog=None, profileDir='.',
+                 lazySeq=False, processes=None, collapse=False,
+                 collapseTolerance=getGene.COLLAPSE_TOLERANCE, novelJunctions=False,
+                 prefetch=prefetch.PREFETCH_GENES, approxAbove=getGene.APPROX_THRESHOLD,
+                 memoryReport=None, bedTracks=None, intronScale=None, coverageMode='total'):
+        self.gtf = gtf                              # reference genome file
+        self.matches = matches                      # list of matched files
+        self.gene = gene                            # which gene to load
+        self.format = format                        # format is a keyword
+        self.fasta = fasta                          # output isoforms to fasta
+        self.annotations = annotations              # hold annotation dictionary in RAM
+        self.clusterDict = clusterDict              # hold isoforms information in RAM
+        self.height = height
+        self.width = width
+        self.full = full
+        self.partial = partial
+        self.group = group
+        self.cluster = cluster
+        self.region = region                        # (chromosome, start, end) when a region is visualized
+        self.regionIndex = regionIndex              # interval index over genes and clusters
+        self.timingLog = timingLog                  # append per-request timing records (JSON lines) here
+        self.profileDir = profileDir                # where cProfile dumps are written
+        self.lazySeq = lazySeq                      # keep cluster bases on disk rather than in RAM
+        self.seqStores = dict()                     # match file -> seqStore.SequenceStore
+        self.processes = processes                  # worker processes for loading match files
+        self.geneCounts = dict()                    # match file -> Counter of isoforms per gene
+        self.geneStats = dict()                     # match file -> geneStats.GeneStats
+        self.geneSummary = None                     # gene table statistics over all match files (DataFrame)
+        self.supportIndex = dict()                  # match file -> gene -> getGene.SupportIndex
+        self.geneTotals = Counter()                 # gene -> isoforms over all loaded match files
+        self.matchMtimes = dict()                   # match file -> modification time when loaded
+        self.loadTimes = dict()                     # file -> seconds it took to load
+        self.collapse = collapse                    # one row per distinct intron chain across files
+        self.dropHidden = False                     # don't build isoforms below the Full/Partial thresholds
+        self.collapseTolerance = collapseTolerance  # bases terminal exon ends may differ by when collapsing
+        self.novelJunctions = novelJunctions        # count novel junctions of every gene for the gene table
+        self.novelCounts = None                     # gene -> number of novel junctions
+        self.prefetch = prefetch                    # genes of the table to compute ahead, 0 for none
+        self.approxAbove = approxAbove              # isoforms above which grouping is approximate
+        self.memoryReport = memoryReport            # JSON file for the memory report
+        self.bedTracks = bedTracks or list()        # overlay.BedTrack of each --bed file
+        self.intronScale = intronScale              # draw introns at this fraction of their length, None: not at all
+        self.coverageMode = coverageMode            # coverage tracks: none, total or files (see readCoverage.py)
+        self.coverage = dict()                      # match file -> gene -> readCoverage.Coverage
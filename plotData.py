@@ -0,0 +1,150 @@
+import numpy as np
+from bokeh.palettes import brewer
+
+# Plot data for the browser, built from Transcript/Exon/Block lists.
+# These functions only return plain dicts, ready to be assigned to a
+# ColumnDataSource, so they can be used and timed without a Bokeh document.
+
+# color of transcripts: [reference isoorm, group1, group2...]
+COLORS = brewer["Spectral"][11]
+COLORS = COLORS + brewer["PuBuGn"][4]
+COLORS.insert(0, '#22313F')
+
+
+# Numeric columns are typed NumPy arrays: Bokeh sends those base64
+# encoded (decoded into typed arrays by the client) rather than as JSON
+# lists. Bokeh only does that for 32-bit and smaller types.
+COORD = np.int32
+EXON_COLUMNS = ['x0', 'x1', 'y', 'color', 'line_alpha', 'height', 'tran', 'full',
+                'partial', 'annot', 'start', 'end', 'fileColor']
+BLOCK_COLUMNS = ['top', 'bottom', 'left', 'right', 'exon', 'start', 'end',
+                 'chromosome', 'boundary']
+
+
+# Of the exon columns, only these are used by glyphs: the others stay on
+# the server, for the callbacks, and are not sent to the browser.
+CLIENT_COLUMNS = ['x0', 'x1', 'y', 'color', 'line_alpha']
+
+
+def clientData(exonData):
+    return dict((col, exonData[col]) for col in CLIENT_COLUMNS)
+
+
+def emptyExonData():
+    return dict((col, []) for col in EXON_COLUMNS)
+
+
+def emptyBlockData():
+    return dict((col, []) for col in BLOCK_COLUMNS)
+
+
+# get the data for plotting exons (start, end position for example),
+# one horizontal segment from (x0, y) to (x1, y) per exon
+def getExonData(opt, exonList, colorDF, tranNum):
+    num_clusters = opt.cluster
+    size = len(exonList)
+    x0 = np.empty(size, dtype=COORD)
+    x1 = np.empty(size, dtype=COORD)
+    y = np.empty(size, dtype=COORD)
+    full = np.empty(size, dtype=np.int32)
+    partial = np.empty(size, dtype=np.int32)
+    annot = np.empty(size, dtype=np.uint8)
+    start = np.empty(size, dtype=COORD)
+    end = np.empty(size, dtype=COORD)
+    colors = list()
+    trans = list()
+    fileColors = list()
+    for ix, myExon in enumerate(exonList):
+        exonSize = myExon.end - myExon.start + 1
+        adjStart = myExon.adjStart
+
+        if 0 in opt.group:       # if group by files, pass
+            color = COLORS[myExon.tran.source[0]]
+        else:
+            if colorDF is not None:
+                # Get transcript color based on grouping.
+                color = getColorFromDF(myExon.tran.name, colorDF, num_clusters)
+            else:          # if the grouping effect is off, paint default color
+                if myExon.tran.annot:
+                    color = COLORS[0]
+                else:
+                    color = COLORS[1]
+        x0[ix] = adjStart
+        x1[ix] = adjStart + exonSize
+        y[ix] = tranNum - myExon.tran.tranIx
+        full[ix] = myExon.tran.full or 0            # None for annotations
+        partial[ix] = myExon.tran.partial or 0
+        annot[ix] = myExon.tran.annot
+        start[ix] = myExon.start
+        end[ix] = myExon.end
+        colors.append(color)
+        trans.append(myExon.tran.name)
+        fileColors.append(COLORS[myExon.tran.source[0]])
+
+    return dict(x0=x0, x1=x1, y=y, color=colors, tran=trans, full=full, partial=partial,
+                annot=annot, start=start, end=end, fileColor=fileColors,
+                line_alpha=np.ones(size, dtype=np.float32),
+                height=np.full(size, int(opt.height), dtype=np.int32))
+
+
+# mark exon boundaries that belong to junctions missing from the annotation
+def getNovelData(opt, exonList, tranNum, strand):
+    novelDict = dict(x=[], y=[], tran=[], position=[])
+    for myExon in exonList:
+        exonSize = myExon.end - myExon.start + 1
+        y = tranNum - myExon.tran.tranIx
+        for flag, position in ((myExon.novelStart, myExon.start), (myExon.novelEnd, myExon.end)):
+            if not flag:
+                continue
+            if (position == myExon.start) == (strand == '+'):    # the left edge of the exon in the plot
+                x = myExon.adjStart
+            else:
+                x = myExon.adjStart + exonSize
+            novelDict['x'].append(x)
+            novelDict['y'].append(y)
+            novelDict['tran'].append(myExon.tran.name)
+            novelDict['position'].append(position)
+    novelDict['size'] = [int(opt.height) * 0.8 for x in range(len(novelDict['x']))]
+    return novelDict
+
+
+def getColorFromDF(transcript_name, colorDF, num_clusters):
+    """
+    Get transcript color based on number of clusters.
+    """
+    if transcript_name not in list(colorDF.name):
+        color = COLORS[0]
+    else:
+        row = colorDF.loc[colorDF['name'] == transcript_name]    # find out which transcript it is, and what group it belongs
+        groupName = 'group%d' % num_clusters          # how many groups are there
+        try:
+            group = row[groupName].values[0]
+            color = COLORS[group + 1]
+        except (ValueError, KeyError):          # if the input groups are more than total number of transcripts
+            color = COLORS[1]
+    return color
+
+
+# find out the position of boundaries
+def getBoundaryData(blocks, chromosome, tranNum, strand):
+    numberOfBlocks = len(blocks)
+    boundary = np.array([bound.boundary for bound in blocks], dtype=COORD)
+    start = np.array([bound.start for bound in blocks], dtype=COORD)
+    end = np.array([bound.end for bound in blocks], dtype=COORD)
+    if strand == '+':       # infomation for the mouse hover effect on blocks
+        left = boundary + start - end
+    else:
+        left = boundary - start + end
+    blockDict = dict(top=np.full(numberOfBlocks, tranNum + 1, dtype=np.int32),
+                     bottom=np.zeros(numberOfBlocks, dtype=np.int32),
+                     left=left, right=boundary.copy(), boundary=boundary,
+                     start=start, end=end,
+                     exon=np.arange(1, numberOfBlocks + 1, dtype=np.int32),
+                     chromosome=[chromosome] * numberOfBlocks)
+
+    # put the region of each transcript into a block
+    rows = np.arange(tranNum, dtype=np.float32)
+    tranDict = dict(top=rows + 1.5, bottom=rows + 0.5,
+                    left=np.zeros(tranNum, dtype=np.int32),
+                    right=np.full(tranNum, boundary.max() if numberOfBlocks else 0, dtype=COORD))
+    return blockDict, tranDict
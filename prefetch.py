@@ -0,0 +1,137 @@
+import collections
+import Queue
+import threading
+
+from tt_log import logger
+import layout
+
+PREFETCH_GENES = 3              # genes after the current one in the gene table
+PREFETCH_WORKERS = 1            # background threads computing layouts
+CACHE_SIZE = 16                 # layouts kept, least recently added dropped first
+IDLE_SECONDS = 30               # a thread with nothing to do for this long exits
+
+
+class Prefetcher (object):
+    '''
+    Computes gene layouts on background threads before they are asked
+    for. A call to schedule() replaces the queue with new jobs; take()
+    hands over a finished (or nearly finished) layout, or cancels all
+    background work when the wanted gene was not anticipated.
+    '''
+
+    # Cancelling is by generation: every schedule() or missed take()
+    # starts a new generation, queued jobs of older generations are
+    # dropped and running ones stop at their next checkpoint.
+
+    def __init__(self, workers=PREFETCH_WORKERS, cacheSize=CACHE_SIZE, idleSeconds=IDLE_SECONDS):
+
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict()     # key -> Layout
+        self.pending = dict()                       # key -> Event, set when computed (or given up)
+        self.queue = Queue.Queue()
+        self.generation = 0
+        self.wanted = None                          # key take() is waiting for; never cancelled
+        self.cacheSize = cacheSize
+        self.hits = 0
+        self.misses = 0
+        self.workers = workers
+        self.threads = list()                       # started by schedule(), gone when idle
+        self.idleSeconds = idleSeconds
+
+    def startWorkers(self):
+        '''Start the background threads; sessions that never show a gene don't need them.'''
+
+        for ix in xrange(self.workers - len(self.threads)):
+            thread = threading.Thread(target=self.work, name='prefetch-%d' % len(self.threads))
+            thread.daemon = True                    # don't keep the server alive
+            thread.start()
+            self.threads.append(thread)
+
+    def schedule(self, jobs):
+        '''Queue (key, opt, isAnnot, isMatch) jobs, dropping older ones.'''
+
+        with self.lock:
+            self.startWorkers()
+            self.generation += 1
+            for key, opt, isAnnot, isMatch in jobs:
+                if key not in self.cache and key not in self.pending:
+                    self.queue.put((self.generation, key, opt, isAnnot, isMatch))
+
+    def take(self, key):
+        '''The layout for key if it was prefetched, else None.'''
+
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                return self.cache.pop(key)
+            event = self.pending.get(key)
+            self.generation += 1                    # the user went elsewhere: stop the rest
+            if event is None:
+                self.misses += 1
+                return None
+            self.wanted = key
+        event.wait()                                # being computed right now: just wait for it
+        with self.lock:
+            self.wanted = None
+            myLayout = self.cache.pop(key, None)
+            if myLayout is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return myLayout
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.cache.clear()
+
+    def cancelled(self, generation, key):
+        return generation != self.generation and key != self.wanted
+
+    def work(self):
+
+        # Threads exit when idle: nothing else stops them when the session
+        # goes away, and a thread keeps its Prefetcher alive.
+        while True:
+            try:
+                job = self.queue.get(timeout=self.idleSeconds)
+            except Queue.Empty:
+                with self.lock:                     # schedule() starts a new thread if a job comes after this
+                    if self.queue.empty():
+                        self.threads.remove(threading.current_thread())
+                        return
+                continue
+            self.compute(*job)
+            del job                                 # its opt holds the session's loaded files
+
+    def compute(self, generation, key, opt, isAnnot, isMatch):
+
+        with self.lock:
+            if self.cancelled(generation, key) or key in self.cache or key in self.pending:
+                return
+            event = self.pending[key] = threading.Event()
+        myLayout = None
+        try:
+            myLayout = layout.computeLayout(opt, isAnnot, isMatch,
+                                            cancelled=lambda: self.cancelled(generation, key))
+        except layout.Cancelled:
+            pass
+        except Exception:                       # e.g. a gene missing from every file
+            logger.debug('prefetch of %s failed' % opt.gene, exc_info=True)
+        with self.lock:
+            if myLayout is not None:
+                self.cache[key] = myLayout
+                while len(self.cache) > self.cacheSize:
+                    self.cache.popitem(last=False)
+            del self.pending[key]
+        event.set()
+
+
+def nextGenes(genes, current, count=PREFETCH_GENES):
+    '''The count genes following current in the list, in order.'''
+
+    try:
+        ix = genes.index(current)
+    except ValueError:
+        return list()
+    return genes[ix + 1:ix + 1 + count]
@@ -0,0 +1,140 @@
+'''
+Read coverage along a gene: the full + partial reads of each cluster,
+summed over the bases of its exons, drawn as a track above the isoforms.
+
+The coverage of a gene in a match file does not depend on the layout
+(thresholds, collapsing, the other files), so it is computed once, in
+genomic coordinates, and kept in opt.coverage. It is kept as a
+difference array: +reads where an exon starts, -reads past its end, at
+the sorted distinct positions where the depth changes. Sums over files
+are the same array over the union of positions, and the depth is its
+cumulative sum. Laying it out maps the steps onto the blocks (see
+overlay.BlockMap).
+'''
+
+import os
+
+import numpy as np
+
+import getGene
+
+COLOR = '#555555'
+MODES = ('none', 'total', 'files')     # no track, one track, a track per match file
+
+
+class Coverage (object):
+    '''Changes of read depth of one gene: depth goes up by delta[i] at positions[i].'''
+
+    __slots__ = ('positions', 'delta')
+
+    def __init__(self, positions, delta):
+        self.positions = positions
+        self.delta = delta
+
+    @classmethod
+    def fromIntervals(cls, starts, ends, reads):
+        '''Coverage of intervals [start, end] carrying reads each.'''
+
+        reads = np.asarray(reads, dtype=np.int64)
+        positions, where = np.unique(np.concatenate((np.asarray(starts, dtype=np.int64),
+                                                     np.asarray(ends, dtype=np.int64) + 1)),
+                                     return_inverse=True)
+        delta = np.bincount(where, weights=np.concatenate((reads, -reads)), minlength=len(positions))
+        keep = delta != 0                           # e.g. one exon ending where the next starts
+        return cls(positions[keep], delta[keep].astype(np.int64))
+
+    @classmethod
+    def fromClusters(cls, clusters):
+        '''Coverage of clusters: the full and partial reads of each on all its exons.'''
+
+        starts = list()
+        ends = list()
+        reads = list()
+        for cluster in clusters:
+            full, partial = cluster.getFP()
+            for exon in cluster.cigar.exons():
+                starts.append(exon.start)
+                ends.append(exon.end)
+                reads.append(full + partial)
+        return cls.fromIntervals(starts, ends, reads)
+
+    @classmethod
+    def total(cls, coverages):
+        '''Sum of the coverages of several files.'''
+
+        coverages = [myCoverage for myCoverage in coverages if len(myCoverage.positions)]
+        if len(coverages) == 1:
+            return coverages[0]
+        if not coverages:
+            return cls(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        positions, where = np.unique(np.concatenate([myCoverage.positions for myCoverage in coverages]),
+                                     return_inverse=True)
+        delta = np.bincount(where, weights=np.concatenate([myCoverage.delta for myCoverage in coverages]),
+                            minlength=len(positions))
+        return cls(positions, delta.astype(np.int64))
+
+    def steps(self):
+        '''(starts, ends, depth) of the stretches of constant non-zero depth.'''
+
+        depth = np.cumsum(self.delta)[:-1]
+        keep = depth > 0
+        return self.positions[:-1][keep], self.positions[1:][keep] - 1, depth[keep]
+
+
+def geneCoverage(opt, matchFile):
+    '''Coverage of opt.gene in a loaded match file, computed once per file and gene.'''
+
+    cache = opt.coverage.setdefault(matchFile, dict())      # dropped with the file (getGene.updateMatchedIsoforms)
+    myCoverage = cache.get(opt.gene)
+    if myCoverage is None:
+        clusters = getGene.getClustersForGene(opt.clusterDict[matchFile], opt.gene)
+        myCoverage = cache[opt.gene] = Coverage.fromClusters(clusters)
+    return myCoverage
+
+
+def emptyCoverageData():
+    return dict(left=np.zeros(0), right=np.zeros(0), bottom=np.zeros(0), top=np.zeros(0),
+                depth=np.zeros(0, dtype=np.int64), track=[],
+                start=np.zeros(0, dtype=np.int64), end=np.zeros(0, dtype=np.int64))
+
+
+def coverageData(opt, blockMap, firstRow):
+    '''
+    Column data of quads for the coverage tracks of opt.coverageMode,
+    from y = firstRow up, each scaled to its own maximum depth; and the
+    names of the tracks. Only for genes: regions have none.
+    '''
+
+    data = emptyCoverageData()
+    if opt.coverageMode == 'none' or opt.region is not None or not opt.clusterDict or not len(blockMap):
+        return data, list()
+    matchFiles = [matchFile for matchFile in opt.matches if matchFile in opt.clusterDict]
+    coverages = [geneCoverage(opt, matchFile) for matchFile in matchFiles]
+    if opt.coverageMode == 'files':
+        names = ['coverage %s' % os.path.splitext(os.path.basename(matchFile))[0] for matchFile in matchFiles]
+    else:
+        coverages = [Coverage.total(coverages)]
+        names = ['coverage']
+
+    columns = dict((name, list()) for name in data)
+    for trackIx, myCoverage in enumerate(coverages):
+        starts, ends, depth = myCoverage.steps()
+        x0, x1, keep = blockMap.mapIntervals(starts, ends)
+        kept = np.flatnonzero(keep)
+        if not len(kept):
+            continue
+        row = firstRow + trackIx
+        columns['left'].append(x0[kept] - 1)        # as exons: base b takes x from b - 1 to b
+        columns['right'].append(x1[kept])
+        columns['bottom'].append(np.full(len(kept), row - 0.4))
+        columns['top'].append(row - 0.4 + 0.8 * depth[kept] / float(depth[kept].max()))
+        columns['depth'].append(depth[kept])
+        columns['start'].append(starts[kept])
+        columns['end'].append(ends[kept])
+        columns['track'].extend([names[trackIx]] * len(kept))
+    for name in data:
+        if name == 'track':
+            data[name] = columns[name]
+        elif columns[name]:
+            data[name] = np.concatenate(columns[name])
+    return data, names
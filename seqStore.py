@@ -0,0 +1,122 @@
+import mmap
+import os
+import string
+
+FASTA_WRAP = 60                 # bases per fasta line
+COMPLTAB = string.maketrans('ACGTacgt', 'TGCAtgca')    # for reverse-complementing reads
+
+
+class SequenceStore (object):
+    '''
+    Cluster sequences kept on disk in an indexed FASTA file (samtools
+    .fai layout) and read back through mmap, so cluster objects in
+    memory don't need to carry their bases.
+    '''
+
+    def __init__(self, fastaFile):
+
+        self.fastaFile = fastaFile
+        self.index = dict()         # name -> (length, offset, line bases, line bytes)
+        with open(faiName(fastaFile)) as handle:
+            for line in handle:
+                name, length, offset, lineBases, lineBytes = line.rstrip('\n').split('\t')
+                self.index[name] = (int(length), int(offset), int(lineBases), int(lineBytes))
+        self.handle = None
+        self.mm = None
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def open(self):
+
+        if self.mm is None:
+            self.handle = open(self.fastaFile, 'rb')
+            self.mm = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def fetch(self, name, reverse=False):
+        '''Bases of a cluster, reverse-complemented if requested.'''
+
+        length, offset, lineBases, lineBytes = self.index[name]
+        if length == 0:
+            return ''
+        self.open()
+        lines = (length - 1) // lineBases            # line breaks inside the sequence
+        raw = self.mm[offset:offset + length + lines * (lineBytes - lineBases)]
+        bases = raw.replace('\n', '')
+        if reverse:
+            bases = bases[::-1].translate(COMPLTAB)
+        return bases
+
+    def close(self):
+
+        if self.mm is not None:
+            self.mm.close()
+            self.handle.close()
+            self.mm = None
+            self.handle = None
+
+
+def faiName(fastaFile):
+    return fastaFile + '.fai'
+
+
+def sidecarName(matchFile):
+    '''Sequence file kept next to a MatchAnnot pickle.'''
+    return matchFile + '.bases.fa'
+
+
+def writeSequences(clusters, fastaFile):
+    '''Write the bases of clusters to fastaFile plus its .fai index.'''
+
+    # Written under temporary names and renamed, so a concurrent reader
+    # sees either no sidecar or a complete one.
+    tmpFasta = '%s.tmp%d' % (fastaFile, os.getpid())
+    tmpFai = faiName(tmpFasta)
+    offset = 0
+    with open(tmpFasta, 'wb') as fasta:
+        with open(tmpFai, 'w') as fai:
+            for cluster in clusters:
+                bases = cluster.bases or ''
+                header = '>%s\n' % cluster.name
+                fasta.write(header)
+                offset += len(header)
+                fai.write('%s\t%d\t%d\t%d\t%d\n' % (cluster.name, len(bases), offset,
+                                                    FASTA_WRAP, FASTA_WRAP + 1))
+                for ix in xrange(0, len(bases), FASTA_WRAP):
+                    fasta.write(bases[ix:ix + FASTA_WRAP] + '\n')
+                offset += len(bases) + (len(bases) + FASTA_WRAP - 1) // FASTA_WRAP
+    os.rename(tmpFasta, fastaFile)
+    os.rename(tmpFai, faiName(fastaFile))
+
+
+def isCurrent(fastaFile, matchFile):
+    '''Is there a complete sidecar at least as new as the pickle?'''
+
+    if not (os.path.isfile(fastaFile) and os.path.isfile(faiName(fastaFile))):
+        return False
+    return min(os.path.getmtime(fastaFile), os.path.getmtime(faiName(fastaFile))) >= os.path.getmtime(matchFile)
+
+
+def stripSequences(clusterDict, matchFile):
+    '''
+    Move the bases of every cluster in clusterDict to the sidecar of
+    matchFile (written once, reused while it is newer than the pickle),
+    leaving cluster.bases as None. Returns the SequenceStore.
+    '''
+
+    clusters = list()
+    seen = set()
+    for geneClusters in clusterDict.getGeneDict().itervalues():
+        for cluster in geneClusters:
+            if id(cluster) not in seen:             # a cluster may be listed under several genes
+                seen.add(id(cluster))
+                clusters.append(cluster)
+
+    fastaFile = sidecarName(matchFile)
+    if not isCurrent(fastaFile, matchFile):
+        writeSequences(clusters, fastaFile)
+    store = SequenceStore(fastaFile)
+    for cluster in clusters:
+        if cluster.name in store:
+            cluster.bases = None
+    return store
@@ -0,0 +1,39 @@
+'''
+Start the browser with websocket compression (permessage-deflate) on.
+Takes the same arguments as "bokeh serve":
+
+    python serve.py --show browse.py --args --input a.pickle --anno a.gtf
+
+and, first, --pool N for the number of worker processes that load files
+for all sessions (default: one per CPU). They are started here, before
+the server has any threads: see workerPool.py.
+
+Plot data goes to the browser over the session websocket; Bokeh leaves
+compression off there, and base64 encoded arrays and repetitive column
+values compress well.
+'''
+
+import sys
+
+from bokeh.command.bootstrap import main
+from bokeh.server.views.ws import WSHandler
+
+import workerPool
+
+COMPRESSION_LEVEL = 6           # zlib level: most of the gain of 9, at a fraction of the CPU
+
+
+def compressionOptions(self):
+    '''Tornado enables permessage-deflate when this returns a dict.'''
+    return dict(compression_level=COMPRESSION_LEVEL, mem_level=8)
+
+
+if __name__ == '__main__':
+    bokehArgs = sys.argv[1:]
+    processes = None
+    if bokehArgs[:1] == ['--pool']:
+        processes = int(bokehArgs[1])
+        bokehArgs = bokehArgs[2:]
+    workerPool.start(processes)
+    WSHandler.get_compression_options = compressionOptions
+    main(['bokeh', 'serve'] + bokehArgs)
@@ -0,0 +1,268 @@
+'''
+Synthetic Iso-Seq data: annotation genes and MatchAnnot-like clusters
+with a controllable number of isoforms, exons, gene length and strand.
+
+Used by the benchmarks; can also write a GTF plus a pickle which the
+browser loads like real data:
+
+    python synthetic.py --genes 200 --isoforms 50 --out synthetic
+'''
+
+import argparse
+import pickle
+import random
+
+import getGene
+
+BASES = 'ACGT'
+
+
+class SyntheticExon (object):
+    '''Mimics the exon objects returned by MatchAnnot's cigar.exons().'''
+
+    def __init__(self, start, end):
+
+        self.start = start
+        self.end = end
+
+    def QScore(self):
+        return 30.0
+
+
+class SyntheticCigar (object):
+
+    def __init__(self, exons):
+
+        self.exonCoords = exons     # list of (start, end)
+        self.MD = None              # no MD string, hence no Q scores
+
+    def exons(self):
+        return [SyntheticExon(start, end) for start, end in self.exonCoords]
+
+    def softclips(self):
+        return 0, 0
+
+
+class SyntheticCluster (object):
+    '''Mimics a MatchAnnot Cluster: name, position, support and CIGAR exons.'''
+
+    def __init__(self, name, chrom, strand, exons, full, partial, bestScore=5, bases=None):
+
+        self.name = name
+        self.chr = chrom
+        self.strand = strand
+        self.cigar = SyntheticCigar(exons)
+        self.full = full
+        self.partial = partial
+        self.bestScore = bestScore
+        self.bases = bases
+
+    def getFP(self):
+        return self.full, self.partial
+
+
+class SyntheticClusterDict (object):
+    '''Mimics a MatchAnnot ClusterDict: gene name -> list of clusters.'''
+
+    def __init__(self, geneDict):
+        self.geneDict = geneDict
+
+    def getGeneDict(self):
+        return self.geneDict
+
+    def toPickle(self, filename):
+        # ClusterDict.fromPickle unpickles a single object, so this is
+        # all the browser needs to load the file.
+        with open(filename, 'wb') as handle:
+            pickle.dump(self, handle, pickle.HIGHEST_PROTOCOL)
+
+
+class SyntheticAnnotation (object):
+    '''Mimics a MatchAnnot Annotation (gene, transcript or exon).'''
+
+    def __init__(self, name, chrom, start, end, strand, ID=None, children=None):
+
+        self.name = name
+        self.ID = ID if ID is not None else name
+        self.chr = chrom
+        self.start = start
+        self.end = end
+        self.strand = strand
+        self.children = children if children is not None else list()
+
+    def getChildren(self):
+        return self.children
+
+
+class SyntheticAnnotationList (object):
+    '''Mimics a MatchAnnot AnnotationList: gene name -> list of genes.'''
+
+    def __init__(self, genes):
+        self.genes = genes
+
+    def getGeneDict(self):
+        geneDict = dict()
+        for gene in self.genes:
+            geneDict.setdefault(gene.name, list()).append(gene.annotation)
+        return geneDict
+
+
+class SyntheticGene (object):
+    '''A gene model plus isoforms drawn from it.'''
+
+    def __init__(self, name, chrom, start, length, strand, template):
+
+        self.name = name
+        self.chr = chrom
+        self.start = start
+        self.end = start + length - 1
+        self.strand = strand
+        self.template = template        # reference exons, list of (start, end)
+        self.annotation = None          # SyntheticAnnotation for the gene
+        self.clusters = list()          # SyntheticCluster objects
+
+
+def makeGene(name='SYN1', isoforms=10, exons=10, length=50000, strand='+',
+             chrom='chr1', start=100000, annotTranscripts=3, bases=False, seed=0):
+    '''Build one synthetic gene with the requested number of isoforms.'''
+
+    rng = random.Random(seed)
+    exons = max(1, exons)
+    slot = max(length // exons, 4)
+    template = list()
+    for ix in xrange(exons):            # one exon somewhere in each slot
+        slotStart = start + ix * slot
+        exonStart = slotStart + rng.randint(0, slot // 4)
+        exonEnd = min(exonStart + rng.randint(max(1, slot // 8), max(2, slot // 2)),
+                      slotStart + slot - 2)
+        template.append((exonStart, exonEnd))
+
+    gene = SyntheticGene(name, chrom, start, slot * exons, strand, template)
+
+    tranAnnots = list()
+    for tranIx in xrange(annotTranscripts):
+        chain = template if tranIx == 0 else drawIsoform(rng, template, jitter=0)
+        tranName = '%s-%03d' % (name, tranIx + 1)
+        exonAnnots = [SyntheticAnnotation('%s:%d' % (tranName, exonIx + 1), chrom, exonStart, exonEnd, strand)
+                      for exonIx, (exonStart, exonEnd) in enumerate(chain)]
+        tranAnnots.append(SyntheticAnnotation(tranName, chrom, chain[0][0], chain[-1][1], strand,
+                                              ID='ENST%s%03d' % (name, tranIx + 1), children=exonAnnots))
+    gene.annotation = SyntheticAnnotation(name, chrom, gene.start, gene.end, strand, children=tranAnnots)
+
+    for clusterIx in xrange(isoforms):
+        chain = drawIsoform(rng, template)
+        full = min(int(rng.paretovariate(1.2)) - 1, 10000)      # a few well supported clusters, a long tail
+        partial = min(int(rng.paretovariate(1.0)) - 1, 10000)
+        clusterLen = sum(exonEnd - exonStart + 1 for exonStart, exonEnd in chain)
+        seq = ''.join(rng.choice(BASES) for ix in xrange(clusterLen)) if bases else None
+        clusterName = 'c%d/f%dp%d/%d' % (seed * 1000000 + clusterIx, full, partial, clusterLen)
+        gene.clusters.append(SyntheticCluster(clusterName, chrom, strand, chain, full, partial,
+                                              bestScore=rng.randint(0, 5), bases=seq))
+    return gene
+
+
+def drawIsoform(rng, template, skip=0.2, jitter=20):
+    '''Draw an exon chain from the template: exon skipping, alternative
+       splice sites and ragged terminal ends.'''
+
+    chain = [exon for exon in template if rng.random() >= skip] or [rng.choice(template)]
+    chain = list(chain)
+    for ix, (exonStart, exonEnd) in enumerate(chain):
+        if rng.random() < 0.05:                             # alternative splice site
+            exonEnd = max(exonStart + 1, exonEnd - rng.randint(1, 30))
+        chain[ix] = (exonStart, exonEnd)
+    if jitter:
+        exonStart, exonEnd = chain[0]
+        chain[0] = (min(exonEnd - 1, exonStart + rng.randint(-jitter, jitter)), exonEnd)
+        exonStart, exonEnd = chain[-1]
+        chain[-1] = (exonStart, max(exonStart + 1, exonEnd + rng.randint(-jitter, jitter)))
+    return chain
+
+
+def makeGenes(genes=10, isoforms=10, exons=10, length=50000, chrom='chr1', bases=False, seed=0):
+    '''Build a run of non-overlapping genes on alternating strands.'''
+
+    geneList = list()
+    start = 100000
+    for ix in xrange(genes):
+        strand = '+' if ix % 2 == 0 else '-'
+        geneList.append(makeGene('SYN%d' % (ix + 1), isoforms=isoforms, exons=exons, length=length,
+                                 strand=strand, chrom=chrom, start=start, bases=bases, seed=seed + ix))
+        start += length + 10000
+    return geneList
+
+
+def makeTranscripts(gene, annot=True):
+    '''Transcript and Exon lists for a gene, built the way getGene builds them.'''
+
+    opt = argparse.Namespace(fasta=None, gtf='synthetic.gtf')
+    tranList = list()
+    exonList = list()
+    if annot:
+        getGene.addAnnotationGene(opt, gene.annotation, tranList, exonList)
+    for cluster in gene.clusters:
+        cluster.source = (1, 'synthetic.pickle')
+    getGene.addClusters(opt, gene.clusters, tranList, exonList)
+    return tranList, exonList
+
+
+def clusterDict(geneList):
+    return SyntheticClusterDict(dict((gene.name, list(gene.clusters)) for gene in geneList))
+
+
+def annotationList(geneList):
+    return SyntheticAnnotationList(geneList)
+
+
+def gtfLines(geneList, source='synthetic'):
+    '''GENCODE-style GTF lines (gene, transcript, exon) for the genes.'''
+
+    for gene in geneList:
+        attrs = 'gene_id "%s"; gene_name "%s";' % (gene.name, gene.name)
+        yield '\t'.join([gene.chr, source, 'gene', str(gene.start), str(gene.end), '.',
+                         gene.strand, '.', attrs]) + '\n'
+        for tran in gene.annotation.getChildren():
+            tranAttrs = '%s transcript_id "%s"; transcript_name "%s";' % (attrs, tran.ID, tran.name)
+            yield '\t'.join([gene.chr, source, 'transcript', str(tran.start), str(tran.end), '.',
+                             gene.strand, '.', tranAttrs]) + '\n'
+            for exonIx, exon in enumerate(tran.getChildren()):
+                exonAttrs = '%s exon_number %d;' % (tranAttrs, exonIx + 1)
+                yield '\t'.join([gene.chr, source, 'exon', str(exon.start), str(exon.end), '.',
+                                 gene.strand, '.', exonAttrs]) + '\n'
+
+
+def writeDataset(prefix, geneList):
+    '''Write prefix.gtf and prefix.pickle; returns their names.'''
+
+    gtfName = '%s.gtf' % prefix
+    pickleName = '%s.pickle' % prefix
+    with open(gtfName, 'w') as handle:
+        handle.writelines(gtfLines(geneList))
+    clusterDict(geneList).toPickle(pickleName)
+    return gtfName, pickleName
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Write a synthetic annotation and MatchAnnot-like pickle.')
+    parser.add_argument('--out', default='synthetic', help='output prefix (default synthetic)')
+    parser.add_argument('--genes', type=int, default=100)
+    parser.add_argument('--isoforms', type=int, default=20, help='isoforms per gene')
+    parser.add_argument('--exons', type=int, default=10, help='exons per gene model')
+    parser.add_argument('--length', type=int, default=50000, help='gene length')
+    parser.add_argument('--bases', action='store_true', help='include cluster sequences')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # Through the module, not this script's globals: run as a script,
+    # the pickled classes would belong to __main__, which the browser
+    # can't import.
+    import synthetic
+    geneList = synthetic.makeGenes(args.genes, args.isoforms, args.exons, args.length,
+                                   bases=args.bases, seed=args.seed)
+    for name in synthetic.writeDataset(args.out, geneList):
+        print name
+
+
+if __name__ == '__main__':
+    main()
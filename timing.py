@@ -0,0 +1,92 @@
+import contextlib
+import cProfile
+import json
+import os
+import time
+import timeit
+
+
+class StageTimer (object):
+    '''Wall-clock timings of the stages of one request, plus a few counts.'''
+
+    def __init__(self, name, profileDir=None):
+
+        self.name = name
+        self.started = time.time()
+        self.stages = list()        # (stage name, seconds), in execution order
+        self.counts = dict()        # e.g. transcripts, exons, blocks
+        self.profile = None
+        self.profileFile = None
+        if profileDir is not None:  # cProfile the whole request
+            self.profileFile = os.path.join(profileDir, 'profile-%s-%d.prof'
+                                            % (safeName(name), int(self.started)))
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''Time the enclosed block as one stage. Repeated names accumulate.'''
+
+        t0 = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.stages.append((name, timeit.default_timer() - t0))
+
+    def count(self, **counts):
+        self.counts.update(counts)
+
+    def total(self):
+        return sum(sec for name, sec in self.stages)
+
+    def stageDict(self):
+        totals = dict()
+        for name, sec in self.stages:
+            totals[name] = totals.get(name, 0.0) + sec
+        return totals
+
+    def stopProfile(self):
+        '''Stop profiling and dump the profile. Call it from the thread that
+           created the timer: a profile only covers that thread.'''
+
+        if self.profile is not None:
+            self.profile.disable()
+            if not os.path.isdir(os.path.dirname(self.profileFile) or '.'):
+                os.makedirs(os.path.dirname(self.profileFile))
+            self.profile.dump_stats(self.profileFile)
+            self.profile = None
+
+    def finish(self, logFile=None):
+        '''Stop profiling, dump the profile and append a JSON record to logFile.'''
+
+        self.stopProfile()
+        if logFile is not None:
+            with open(logFile, 'a') as handle:
+                handle.write(json.dumps(self.record(), sort_keys=True) + '\n')
+
+    def record(self):
+        '''Structured version of the timings, one JSON object per request.'''
+
+        return dict(name=self.name,
+                    time=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                    total=round(self.total(), 6),
+                    stages=[[name, round(sec, 6)] for name, sec in self.stages],
+                    counts=self.counts,
+                    profile=self.profileFile)
+
+    def summary(self, perLine=3):
+        '''Compact text breakdown for the Console, slowest stages first.'''
+
+        totals = sorted(self.stageDict().items(), key=lambda x: x[1], reverse=True)
+        lines = ['total %.2fs  %s' % (self.total(),
+                 ' '.join('%s=%s' % (k, v) for k, v in sorted(self.counts.items())))]
+        cells = ['%s %.2f' % (name, sec) for name, sec in totals]
+        for ix in xrange(0, len(cells), perLine):
+            lines.append('  '.join(cells[ix:ix + perLine]))
+        return '\n'.join(lines)
+
+
+def safeName(name):
+    '''Make a gene name or region usable in a file name.'''
+
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
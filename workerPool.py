@@ -0,0 +1,51 @@
+'''
+Worker processes for loading files (match files, parallel GTF parsing).
+
+Python 2 can only fork its workers, and a child forked while another
+thread holds a lock (logging, the import lock, a session's) may wait
+on it forever. In the server, where every session has threads, the pool
+is therefore made once at startup, before any thread exists (serve.py
+calls start), and shared by all sessions. Elsewhere a pool is made for
+the call if this process has no other threads, or the work is done in
+this process.
+'''
+
+import multiprocessing
+import threading
+
+from tt_log import logger
+
+shared = None                   # multiprocessing.Pool made by start()
+
+
+def start(processes=None):
+    '''Make the shared pool; call before starting any thread.'''
+
+    global shared
+    if shared is None:
+        shared = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    return shared
+
+
+def map(function, jobs, processes=None):
+    '''
+    [function(job) for job in jobs], on up to processes workers (default:
+    one per CPU); with the shared pool if there is one, whatever its size.
+    '''
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(jobs))
+    if processes <= 1:
+        return [function(job) for job in jobs]
+    if shared is not None:
+        return shared.map(function, jobs, chunksize=1)
+    if threading.active_count() > 1:        # forking now could leave a child stuck on a lock
+        logger.warning('no worker pool made at startup (see serve.py): loading in this process')
+        return [function(job) for job in jobs]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(function, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()